@@ -247,6 +247,15 @@ class AddonManager:
                         "Addon handler {} ({}) not callable".format(name, a)
                     )
 
+    def has_handler(self, name):
+        """
+            Returns True if any addon in the chain handles the given event.
+        """
+        return any(
+            callable(getattr(a, name, None))
+            for a in traverse(self.chain)
+        )
+
     def trigger(self, name, *args, **kwargs):
         """
             Trigger an event across all addons.
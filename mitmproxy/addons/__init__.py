@@ -18,6 +18,7 @@ from mitmproxy.addons import setheaders
 from mitmproxy.addons import stickyauth
 from mitmproxy.addons import stickycookie
 from mitmproxy.addons import streambodies
+from mitmproxy.addons import throttle
 from mitmproxy.addons import save
 from mitmproxy.addons import upstream_auth
 
@@ -44,6 +45,7 @@ def default_addons():
         stickyauth.StickyAuth(),
         stickycookie.StickyCookie(),
         streambodies.StreamBodies(),
+        throttle.Throttle(),
         save.Save(),
         upstream_auth.UpstreamAuth(),
     ]
@@ -1,6 +1,7 @@
 import typing
 
 import os
+import socket
 
 from mitmproxy.utils import human
 from mitmproxy import ctx
@@ -58,6 +59,44 @@ class Core:
                     "Invalid body size limit specification: %s" %
                     opts.body_size_limit
                 )
+        for name, desc in (("websocket_messages", "WebSocket messages"), ("tcp_messages", "TCP messages")):
+            if name + "_size_limit" in updated:
+                try:
+                    human.parse_size(getattr(opts, name + "_size_limit"))
+                except ValueError:
+                    raise exceptions.OptionsError(
+                        "Invalid %s size limit specification: %s" %
+                        (desc, getattr(opts, name + "_size_limit"))
+                    )
+            if name + "_limit" in updated:
+                if getattr(opts, name + "_limit") < 0:
+                    raise exceptions.OptionsError(
+                        "Invalid %s limit: must not be negative." % desc
+                    )
+        if "tcp_coalesce_size" in updated:
+            try:
+                human.parse_size(opts.tcp_coalesce_size)
+            except ValueError:
+                raise exceptions.OptionsError(
+                    "Invalid TCP coalesce size specification: %s" %
+                    opts.tcp_coalesce_size
+                )
+        if "workers" in updated:
+            if opts.workers < 0:
+                raise exceptions.OptionsError("Invalid number of workers: must not be negative.")
+            if opts.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+                raise exceptions.OptionsError("Multiple workers require SO_REUSEPORT, which this platform does not support.")
+        if "http2_connection_window_size" in updated or "http2_stream_window_size" in updated:
+            for name in ("http2_connection_window_size", "http2_stream_window_size"):
+                if not 65535 <= getattr(opts, name) <= 2 ** 31 - 1:
+                    raise exceptions.OptionsError(
+                        "Invalid HTTP/2 window size: %s must be between 65535 and 2147483647." % name
+                    )
+        if "http2_max_frame_size" in updated:
+            if not 2 ** 14 <= opts.http2_max_frame_size <= 2 ** 24 - 1:
+                raise exceptions.OptionsError(
+                    "Invalid HTTP/2 max frame size: must be between 16384 and 16777215."
+                )
         if "mode" in updated:
             mode = opts.mode
             if mode.startswith("reverse:") or mode.startswith("upstream:"):
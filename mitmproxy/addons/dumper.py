@@ -56,7 +56,7 @@ class Dumper:
     def configure(self, updated):
         if "dumper_filter" in updated:
             if ctx.options.dumper_filter:
-                self.filter = flowfilter.parse(ctx.options.dumper_filter)
+                self.filter = flowfilter.registry.parse(ctx.options.dumper_filter)
                 if not self.filter:
                     raise exceptions.OptionsError(
                         "Invalid filter expression: %s" % ctx.options.dumper_filter
@@ -26,7 +26,7 @@ class Intercept:
                 self.filt = None
                 ctx.options.intercept_active = False
                 return
-            self.filt = flowfilter.parse(ctx.options.intercept)
+            self.filt = flowfilter.registry.parse(ctx.options.intercept)
             if not self.filt:
                 raise exceptions.OptionsError(
                     "Invalid interception filter: %s" % ctx.options.intercept
@@ -1,13 +1,21 @@
 import asyncio
-import os.path
+import concurrent.futures
 import sys
+import time
 import typing
 
+import blinker
+
 from mitmproxy import ctx
 from mitmproxy import exceptions
 from mitmproxy import flowfilter
 from mitmproxy import io
 from mitmproxy import command
+from mitmproxy.io import parallel
+import mitmproxy.flow
+
+# Log loading progress at most this often, in seconds.
+PROGRESS_INTERVAL = 1
 
 
 class ReadFile:
@@ -17,16 +25,29 @@ class ReadFile:
     def __init__(self):
         self.filter = None
         self.is_reading = False
+        # fraction of the current file that has been read, if known.
+        self.progress: typing.Optional[float] = None
+        self.progress_logged = 0.0
+        # Sent with progress=the percentage read whenever it changes, and
+        # with progress=None once reading is done.
+        self.sig_progress = blinker.Signal()
 
     def load(self, loader):
         loader.add_option(
             "rfile", typing.Optional[str], None,
-            "Read flows from file."
+            "Read flows from file. Gzipped files and glob patterns like flows.* are supported."
         )
         loader.add_option(
             "readfile_filter", typing.Optional[str], None,
             "Read only matching flows."
         )
+        loader.add_option(
+            "readfile_processes", int, 0,
+            """
+            Number of processes that decode flow files. 0 uses one process
+            per CPU core for large files, 1 decodes in the main process.
+            """
+        )
 
     def configure(self, updated):
         if "readfile_filter" in updated:
@@ -38,12 +59,56 @@ class ReadFile:
                         "Invalid readfile filter: %s" % ctx.options.readfile_filter
                     )
             self.filter = filt
+        if "readfile_processes" in updated and ctx.options.readfile_processes < 0:
+            raise exceptions.OptionsError("Invalid number of readfile processes: must not be negative.")
+
+    async def flows(self, fo: typing.IO[bytes]) -> typing.AsyncIterator[mitmproxy.flow.Flow]:
+        """
+            Yields the flows in fo, decoding them in a process pool if the file is large.
+        """
+        processes = parallel.default_processes(fo, ctx.options.readfile_processes)
+        if processes <= 1:
+            for f in io.FlowReader(fo).stream():
+                yield f
+            return
+        loop = asyncio.get_event_loop()
+        executor = parallel.process_pool(processes)
+        # Reading the file and submitting chunks blocks, so this happens in a
+        # thread of its own. The thread also runs the cleanup after any read
+        # that is still in progress when we stop early.
+        reader_thread = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="ReadFile")
+        chunks = parallel.ParallelFlowReader(fo, executor, max_pending=2 * processes).chunks()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(reader_thread, next, chunks, None)
+                if chunk is None:
+                    break
+                for f in await asyncio.wrap_future(chunk):
+                    yield f
+        finally:
+            # Shutting down the pool waits for its processes, which must not block the event loop.
+            reader_thread.submit(parallel.close_reader, chunks, executor)
+            reader_thread.shutdown(wait=False)
+
+    def update_progress(self, fo: typing.IO[bytes], size: typing.Optional[int]) -> None:
+        if not size:
+            return
+        percent = self.get_progress()
+        self.progress = getattr(fo, "fileobj", fo).tell() / size
+        if self.get_progress() != percent:
+            self.sig_progress.send(self, progress=self.get_progress())
+        now = time.monotonic()
+        if now - self.progress_logged >= PROGRESS_INTERVAL:
+            self.progress_logged = now
+            ctx.log.info("Loading flows: {:.0%}".format(self.progress))
 
     async def load_flows(self, fo: typing.IO[bytes]) -> int:
         cnt = 0
-        freader = io.FlowReader(fo)
+        size = parallel.file_size(fo)
+        self.progress_logged = time.monotonic()
         try:
-            for flow in freader.stream():
+            async for flow in self.flows(fo):
+                self.update_progress(fo, size)
                 if self.filter and not self.filter(flow):
                     continue
                 await ctx.master.load_flow(flow)
@@ -58,10 +123,16 @@ class ReadFile:
             return cnt
 
     async def load_flows_from_path(self, path: str) -> int:
-        path = os.path.expanduser(path)
+        """
+            Loads flows from a file, which may be gzipped, or from all files
+            matching a glob pattern, e.g. the segments written by save_stream_file.
+        """
+        cnt = 0
         try:
-            with open(path, "rb") as f:
-                return await self.load_flows(f)
+            for p in io.expand_flow_paths(path):
+                with io.open_flow_file(p) as f:
+                    cnt += await self.load_flows(f)
+            return cnt
         except IOError as e:
             ctx.log.error("Cannot load flows: {}".format(e))
             raise exceptions.FlowReadException(str(e)) from e
@@ -74,6 +145,8 @@ class ReadFile:
             raise exceptions.OptionsError(e) from e
         finally:
             self.is_reading = False
+            self.progress = None
+            self.sig_progress.send(self, progress=None)
 
     def running(self):
         if ctx.options.rfile:
@@ -83,6 +156,13 @@ class ReadFile:
     def reading(self) -> bool:
         return self.is_reading
 
+    @command.command("readfile.progress")
+    def get_progress(self) -> int:
+        """
+            How much of the current flow file has been read, in percent.
+        """
+        return int((self.progress or 0) * 100)
+
 
 class ReadFileStdin(ReadFile):
     """Support the special case of "-" for reading from stdin"""
@@ -70,7 +70,7 @@ class Replace:
             for rep in ctx.options.replacements:
                 fpatt, rex, s = parse_hook(rep)
 
-                flt = flowfilter.parse(fpatt)
+                flt = flowfilter.registry.parse(fpatt)
                 if not flt:
                     raise exceptions.OptionsError(
                         "Invalid filter pattern: %s" % fpatt
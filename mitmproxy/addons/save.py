@@ -7,8 +7,18 @@ from mitmproxy import flowfilter
 from mitmproxy import io
 from mitmproxy import ctx
 from mitmproxy import flow
+from mitmproxy.io import rotate
+from mitmproxy.utils import workers
+from mitmproxy.utils import human
 import mitmproxy.types
 
+# Changing any of these restarts the stream.
+STREAM_OPTIONS = (
+    "save_stream_file", "save_stream_filter", "workers", "save_stream_rotate_size",
+    "save_stream_rotate_interval", "save_stream_compress", "save_stream_background",
+    "save_stream_queue_size", "save_stream_overflow", "save_stream_fsync",
+)
+
 
 class Save:
     def __init__(self):
@@ -25,6 +35,51 @@ class Save:
             "save_stream_filter", typing.Optional[str], None,
             "Filter which flows are written to file."
         )
+        loader.add_option(
+            "save_stream_rotate_size", typing.Optional[str], None,
+            """
+            Split the save_stream_file stream into numbered segments
+            (file.000001, file.000002, ...) and start a new segment once the
+            current one exceeds this size. Understands k/m/g suffixes, e.g.
+            100m. Read segments back with -r "file.*".
+            """
+        )
+        loader.add_option(
+            "save_stream_rotate_interval", int, 0,
+            """
+            Split the save_stream_file stream into numbered segments and start
+            a new segment after this many seconds. 0 disables time-based
+            rotation.
+            """
+        )
+        loader.add_option(
+            "save_stream_compress", bool, False,
+            "Gzip finished save_stream_file segments."
+        )
+        loader.add_option(
+            "save_stream_background", bool, False,
+            "Encode and write streamed flows in a background thread."
+        )
+        loader.add_option(
+            "save_stream_queue_size", int, 1000,
+            "Number of flows the background writer queues before the overflow policy applies."
+        )
+        loader.add_option(
+            "save_stream_overflow", str, "drop",
+            """
+            What to do when the background writer falls behind: drop flows,
+            or block the proxy until it caught up.
+            """,
+            choices=list(io.OVERFLOW_POLICIES),
+        )
+        loader.add_option(
+            "save_stream_fsync", str, "never",
+            """
+            When the background writer calls fsync(): never, after every
+            batch of queued flows, or after every flow.
+            """,
+            choices=list(io.FSYNC_POLICIES),
+        )
 
     def open_file(self, path):
         if path.startswith("+"):
@@ -35,30 +90,73 @@ class Save:
         path = os.path.expanduser(path)
         return open(path, mode)
 
+    def stream_path(self) -> typing.Optional[str]:
+        """
+            With multiple workers, each worker streams to its own file and the
+            supervisor process, which does not see any flows, to none.
+        """
+        path = ctx.options.save_stream_file
+        if path and ctx.options.workers > 1:
+            worker = workers.worker_id()
+            if worker is None:
+                return None
+            path = workers.shard_path(path, worker)
+        return path
+
     def start_stream_to_path(self, path, flt):
         try:
-            f = self.open_file(path)
+            if ctx.options.save_stream_rotate_size or ctx.options.save_stream_rotate_interval:
+                # Segments are never overwritten, so there's no need for "+".
+                f = rotate.RotatingFile(
+                    path.lstrip("+"),
+                    max_size=human.parse_size(ctx.options.save_stream_rotate_size),
+                    max_age=ctx.options.save_stream_rotate_interval,
+                    compress=ctx.options.save_stream_compress,
+                )
+            else:
+                f = self.open_file(path)
         except IOError as v:
             raise exceptions.OptionsError(str(v))
-        self.stream = io.FilteredFlowWriter(f, flt)
+        if ctx.options.save_stream_background:
+            self.stream = io.BackgroundFlowWriter(
+                f,
+                flt,
+                maxsize=ctx.options.save_stream_queue_size,
+                overflow=ctx.options.save_stream_overflow,
+                fsync=ctx.options.save_stream_fsync,
+            )
+        else:
+            self.stream = io.FilteredFlowWriter(f, flt)
         self.active_flows = set()
 
     def configure(self, updated):
         # We're already streaming - stop the previous stream and restart
         if "save_stream_filter" in updated:
             if ctx.options.save_stream_filter:
-                self.filt = flowfilter.parse(ctx.options.save_stream_filter)
+                self.filt = flowfilter.registry.parse(ctx.options.save_stream_filter)
                 if not self.filt:
                     raise exceptions.OptionsError(
                         "Invalid filter specification: %s" % ctx.options.save_stream_filter
                     )
             else:
                 self.filt = None
-        if "save_stream_file" in updated or "save_stream_filter" in updated:
+        if "save_stream_rotate_size" in updated:
+            try:
+                human.parse_size(ctx.options.save_stream_rotate_size)
+            except ValueError:
+                raise exceptions.OptionsError(
+                    "Invalid rotation size specification: %s" % ctx.options.save_stream_rotate_size
+                )
+        if "save_stream_rotate_interval" in updated and ctx.options.save_stream_rotate_interval < 0:
+            raise exceptions.OptionsError("Invalid rotation interval: must not be negative.")
+        if "save_stream_queue_size" in updated and ctx.options.save_stream_queue_size < 1:
+            raise exceptions.OptionsError("Invalid queue size: must be at least 1.")
+        if any(o in updated for o in STREAM_OPTIONS):
             if self.stream:
                 self.done()
-            if ctx.options.save_stream_file:
-                self.start_stream_to_path(ctx.options.save_stream_file, self.filt)
+            path = self.stream_path()
+            if path:
+                self.start_stream_to_path(path, self.filt)
 
     @command.command("save.file")
     def save(self, flows: typing.Sequence[flow.Flow], path: mitmproxy.types.Path) -> None:
@@ -108,5 +206,8 @@ class Save:
             for f in self.active_flows:
                 self.stream.add(f)
             self.active_flows = set([])
-            self.stream.fo.close()
+            self.stream.close()
+            dropped = getattr(self.stream, "dropped", 0)
+            if dropped:
+                ctx.log.warn("Dropped %s flows because writing them to disk could not keep up." % dropped)
             self.stream = None
@@ -61,7 +61,7 @@ class SetHeaders:
             for shead in ctx.options.setheaders:
                 fpatt, header, value = parse_setheader(shead)
 
-                flt = flowfilter.parse(fpatt)
+                flt = flowfilter.registry.parse(fpatt)
                 if not flt:
                     raise exceptions.OptionsError(
                         "Invalid setheader filter pattern %s" % fpatt
@@ -19,7 +19,7 @@ class StickyAuth:
     def configure(self, updated):
         if "stickyauth" in updated:
             if ctx.options.stickyauth:
-                flt = flowfilter.parse(ctx.options.stickyauth)
+                flt = flowfilter.registry.parse(ctx.options.stickyauth)
                 if not flt:
                     raise exceptions.OptionsError(
                         "stickyauth: invalid filter expression: %s" % ctx.options.stickyauth
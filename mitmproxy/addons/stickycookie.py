@@ -43,7 +43,7 @@ class StickyCookie:
     def configure(self, updated):
         if "stickycookie" in updated:
             if ctx.options.stickycookie:
-                flt = flowfilter.parse(ctx.options.stickycookie)
+                flt = flowfilter.registry.parse(ctx.options.stickycookie)
                 if not flt:
                     raise exceptions.OptionsError(
                         "stickycookie: invalid filter expression: %s" % ctx.options.stickycookie
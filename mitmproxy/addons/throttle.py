@@ -0,0 +1,240 @@
+import asyncio
+import threading
+import time
+import typing
+import weakref
+
+from mitmproxy import ctx
+from mitmproxy import exceptions
+from mitmproxy import flowfilter
+from mitmproxy.utils import human
+
+SCOPES = ("client", "host", "filter")
+# Buckets hold enough tokens for this many seconds of traffic, which bounds bursts.
+BURST_WINDOW = 0.1
+# Refilled request buckets are dropped at most this often, in seconds.
+PRUNE_INTERVAL = 60
+
+
+def parse_throttle(s: str) -> typing.Tuple[typing.Optional[str], str, typing.Optional[int], typing.Optional[float]]:
+    """
+        Returns a (pattern, scope, bytes per second, requests per second) tuple.
+
+        The general form of a throttle specification is as follows:
+
+            /pattern/scope/bandwidth/requests
+
+        The first character specifies the separator. The pattern is a flow
+        filter and may be omitted to match all flows. The scope is one of
+        "client", "host" or "filter" and determines whether the limits apply
+        per client address, per destination host, or to all matching flows
+        together. The bandwidth is given in bytes per second and understands
+        k/m/g suffixes. The requests clause is optional. Examples:
+
+            /client/100k
+            :~d example.com:host::5
+    """
+    sep, rem = s[0], s[1:]
+    parts = rem.split(sep)
+    if parts[0] in SCOPES:
+        parts.insert(0, None)
+    if len(parts) == 3:
+        parts.append("")
+    if len(parts) != 4 or parts[1] not in SCOPES:
+        raise exceptions.OptionsError(
+            "Invalid throttle specifier: %s" % s
+        )
+    patt, scope, bandwidth, requests = parts
+    try:
+        bps = human.parse_size(bandwidth) if bandwidth else None
+        rps = float(requests) if requests else None
+    except ValueError:
+        raise exceptions.OptionsError(
+            "Invalid throttle limits: %s" % s
+        )
+    if (bps is None and rps is None) or (bps is not None and bps <= 0) or (rps is not None and rps <= 0):
+        raise exceptions.OptionsError(
+            "Invalid throttle limits: %s" % s
+        )
+    return patt, scope, bps, rps
+
+
+class TokenBucket:
+    """
+        A thread-safe token bucket.
+
+        Instead of waiting until enough tokens are available, callers reserve
+        tokens up front and are told how long to wait for them. The bucket may
+        go into debt, so that concurrent callers are scheduled one after
+        another at the configured rate without polling.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.burst = max(rate * BURST_WINDOW, 1)
+        self.tokens = self.burst
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, n: float) -> float:
+        """
+            Takes n tokens from the bucket and returns the number of seconds
+            until they are available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.timestamp) * self.rate >= self.burst
+
+
+class ConnectionThrottle:
+    """
+        Limits the rate at which data is written to a connection.
+
+        Buckets are only ever added, so that all flows on a connection share
+        its limits. With HTTP/2, one stream does not lift the limits of another.
+    """
+
+    def __init__(self, generation: int) -> None:
+        self.generation = generation
+        self.buckets: typing.Tuple[TokenBucket, ...] = ()
+
+    def add(self, buckets: typing.Iterable[TokenBucket]) -> None:
+        # Replace the tuple rather than mutating it, the connection thread may be iterating.
+        self.buckets = self.buckets + tuple(b for b in buckets if b not in self.buckets)
+
+    def __call__(self, size: int) -> None:
+        buckets = self.buckets
+        if buckets:
+            delay = max(b.reserve(size) for b in buckets)
+            if delay > 0:
+                time.sleep(delay)
+
+
+class Throttle:
+    def __init__(self):
+        self.specs = []
+        # Bandwidth buckets live as long as a connection uses them.
+        self.buckets: typing.MutableMapping[tuple, TokenBucket] = weakref.WeakValueDictionary()
+        self.request_buckets: typing.Dict[tuple, TokenBucket] = {}
+        self.generation = 0
+        self.last_prune = time.monotonic()
+
+    def load(self, loader):
+        loader.add_option(
+            "throttle", typing.Sequence[str], [],
+            """
+            Limit bandwidth and request rate of the form
+            "/pattern/scope/bandwidth/requests", where the separator can be any
+            character. The scope is one of "client", "host" or "filter", the
+            bandwidth is given in bytes per second per direction and understands
+            k/m/g suffixes. The pattern and the requests clause are optional,
+            e.g. "/client/100k" or ":~d example.com:host::5". Bandwidth limits
+            apply to the whole connection once one of its flows matches.
+            """
+        )
+
+    def configure(self, updated):
+        if "throttle" in updated:
+            specs = []
+            for spec in ctx.options.throttle:
+                patt, scope, bps, rps = parse_throttle(spec)
+                flt = None
+                if patt:
+                    flt = flowfilter.parse(patt)
+                    if not flt:
+                        raise exceptions.OptionsError(
+                            "Invalid throttle filter pattern %s" % patt
+                        )
+                specs.append((flt, scope, bps, rps))
+            self.specs = specs
+            self.buckets = weakref.WeakValueDictionary()
+            self.request_buckets = {}
+            # Connection throttles of earlier generations are reset on their next flow.
+            self.generation += 1
+
+    def bucket(self, key: tuple, rate: float) -> TokenBucket:
+        buckets = self.request_buckets if key[-1] == "requests" else self.buckets
+        b = buckets.get(key)
+        if b is None:
+            b = buckets[key] = TokenBucket(rate)
+        return b
+
+    def prune(self) -> None:
+        """
+            Drops request buckets that have refilled completely,
+            a new bucket behaves exactly the same.
+        """
+        now = time.monotonic()
+        if now - self.last_prune < PRUNE_INTERVAL:
+            return
+        self.last_prune = now
+        for key, b in list(self.request_buckets.items()):
+            if b.full(now):
+                del self.request_buckets[key]
+
+    def _bandwidth(self) -> bool:
+        return any(bps for _, _, bps, _ in self.specs)
+
+    def _attach(self, conn) -> typing.Optional[ConnectionThrottle]:
+        """
+            Returns the throttle of a connection, installing one if needed.
+        """
+        t = conn.throttle
+        if isinstance(t, ConnectionThrottle) and t.generation == self.generation:
+            return t
+        if not self._bandwidth():
+            conn.throttle = None
+            return None
+        conn.throttle = ConnectionThrottle(self.generation)
+        return conn.throttle
+
+    def clientconnect(self, layer):
+        self._attach(layer.client_conn)
+
+    def serverconnect(self, conn):
+        self._attach(conn)
+
+    def requestheaders(self, f):
+        upload: typing.List[TokenBucket] = []
+        download: typing.List[TokenBucket] = []
+        delay = 0.0
+        for i, (flt, scope, bps, rps) in enumerate(self.specs):
+            if flt and not flt(f):
+                continue
+            if scope == "client":
+                key = (i, f.client_conn.address[0] if f.client_conn.address else None)
+            elif scope == "host":
+                key = (i, f.request.host)
+            else:
+                key = (i,)
+            if bps:
+                upload.append(self.bucket(key + ("upload",), bps))
+                download.append(self.bucket(key + ("download",), bps))
+            if rps:
+                delay = max(delay, self.bucket(key + ("requests",), rps).reserve(1))
+        self.prune()
+
+        # Unshaped connections keep writing without any indirection.
+        for conn, buckets in ((f.client_conn, download), (f.server_conn, upload)):
+            t = self._attach(conn)
+            if t:
+                t.add(buckets)
+
+        if delay > 0:
+            # Hold the flow back without blocking the event loop.
+            f.reply.take()
+            asyncio.get_event_loop().call_later(delay, self.release, f)
+
+    def release(self, f):
+        if f.reply.state == "taken":
+            if not f.reply.has_message:
+                f.reply.ack()
+            f.reply.commit()
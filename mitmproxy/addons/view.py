@@ -8,7 +8,11 @@ The View:
 - Exposes a settings store for flows that automatically expires if the flow is
   removed from the store.
 """
+import asyncio
 import collections
+import itertools
+import os
+import time
 import typing
 
 import blinker
@@ -23,6 +27,7 @@ from mitmproxy import ctx
 from mitmproxy import io
 from mitmproxy import http
 from mitmproxy import tcp
+from mitmproxy import websocket
 from mitmproxy.utils import human
 
 
@@ -113,7 +118,118 @@ class OrderKeySize(_OrderKey):
             raise NotImplementedError()
 
 
-matchall = flowfilter.parse("~http | ~tcp")
+class Selection(list):
+    """
+        Flows returned by View.select(), with constant-time index lookups.
+        Selections are cached and shared, don't modify them.
+    """
+    def __init__(self, flows: typing.Iterable[mitmproxy.flow.Flow]) -> None:
+        super().__init__(flows)
+        self.positions = {f.id: i for i, f in enumerate(self)}
+
+    def index(self, f: mitmproxy.flow.Flow, *args) -> int:  # type: ignore
+        if args:
+            return super().index(f, *args)
+        try:
+            return self.positions[f.id]
+        except KeyError:
+            raise ValueError("{} is not in selection".format(f))
+
+
+class FlowIndex:
+    """
+        Maps a key computed from each flow to the flows with that key.
+
+        Only flows of the given types are indexed. All others are kept
+        aside, so that lookups can still account for them.
+    """
+    def __init__(self, key: typing.Callable[[typing.Any], typing.Hashable], types=(mitmproxy.flow.Flow,)) -> None:
+        self.key = key
+        self.types = types
+        self.buckets: typing.Dict[typing.Hashable, typing.Dict[str, mitmproxy.flow.Flow]] = {}
+        self.keys: typing.Dict[str, typing.Hashable] = {}
+        self.other: typing.Dict[str, mitmproxy.flow.Flow] = {}
+
+    def add(self, f: mitmproxy.flow.Flow) -> None:
+        if not isinstance(f, self.types):
+            self.other[f.id] = f
+            return
+        k = self.key(f)
+        self.keys[f.id] = k
+        self.buckets.setdefault(k, {})[f.id] = f
+
+    def remove(self, f: mitmproxy.flow.Flow) -> None:
+        self.other.pop(f.id, None)
+        if f.id in self.keys:
+            k = self.keys.pop(f.id)
+            bucket = self.buckets[k]
+            del bucket[f.id]
+            if not bucket:
+                del self.buckets[k]
+
+    def update(self, f: mitmproxy.flow.Flow) -> None:
+        if f.id in self.keys and self.keys[f.id] == self.key(f):
+            return
+        self.remove(f)
+        self.add(f)
+
+    def clear(self) -> None:
+        self.buckets.clear()
+        self.keys.clear()
+        self.other.clear()
+
+    def get(self, k: typing.Hashable) -> typing.Sequence[mitmproxy.flow.Flow]:
+        return list(self.buckets.get(k, {}).values())
+
+    def where(self, predicate: typing.Callable[[typing.Any], typing.Any]) -> typing.Set[str]:
+        """
+            Returns the ids of all indexed flows whose key satisfies predicate.
+        """
+        ret: typing.Set[str] = set()
+        for k, bucket in self.buckets.items():
+            if predicate(k):
+                ret.update(bucket)
+        return ret
+
+    def counts(self) -> typing.Dict[typing.Hashable, int]:
+        return {k: len(bucket) for k, bucket in self.buckets.items()}
+
+
+def _content_types(message) -> typing.Tuple[bytes, ...]:
+    return tuple(
+        value for name, value in message.headers.fields
+        if name.lower() == b"content-type"
+    )
+
+
+def _index_host(f: http.HTTPFlow):
+    return f.request.host, f.request.pretty_host
+
+
+def _index_status(f: http.HTTPFlow):
+    return f.response.status_code if f.response else None
+
+
+def _index_method(f: http.HTTPFlow):
+    return f.request.data.method
+
+
+def _index_content_type(f: http.HTTPFlow):
+    return _content_types(f.request), _content_types(f.response) if f.response else None
+
+
+def _search_any(rex, values) -> bool:
+    return values is not None and any(rex.search(v) for v in values)
+
+
+def _message_size(message) -> int:
+    size = len(message.raw_content or b"")
+    for name, value in message.headers.fields:
+        size += len(name) + len(value)
+    return size
+
+
+matchall = flowfilter.optimize(flowfilter.parse("~http | ~tcp"))
 
 orders = [
     ("t", "time"),
@@ -124,10 +240,49 @@ orders = [
 
 
 class View(collections.abc.Sequence):
+    # Re-filtering works through the store in chunks of this many flows,
+    # yielding to the event loop in between.
+    refilter_chunk_size = 10000
+    # Minimum time between refresh signals while re-filtering in the background.
+    refilter_refresh_interval = 0.5
+    # Number of filters for which per-flow verdicts are remembered.
+    verdict_cache_size = 4
+    # Number of select() results that are remembered until the store changes.
+    selection_cache_size = 4
+
     def __init__(self):
         super().__init__()
         self._store = collections.OrderedDict()
         self.filter = matchall
+        # The parsed filter before optimization, which _candidates() understands.
+        self._filter_tree: typing.Optional[flowfilter.TFilter] = None
+        # filter pattern -> {flow id: verdict}, least recently used first.
+        self._verdicts: typing.MutableMapping[str, typing.Dict[str, bool]] = collections.OrderedDict()
+        # Flows that a background re-filter has yet to look at.
+        self._refilter_pending: typing.Set[str] = set()
+        self._refilter_task: typing.Optional[asyncio.Task] = None
+        # (filter, order, reversed, from view) -> select() result, least recently used first.
+        self._selections: typing.MutableMapping[tuple, Selection] = collections.OrderedDict()
+        # Secondary indexes on the store, kept up to date by add, update and remove.
+        # Marked state is not indexed: it is often changed without an update().
+        self.indexes = dict(
+            host = FlowIndex(_index_host, (http.HTTPFlow,)),
+            status = FlowIndex(_index_status, (http.HTTPFlow,)),
+            method = FlowIndex(_index_method, (http.HTTPFlow,)),
+            content_type = FlowIndex(_index_content_type, (http.HTTPFlow,)),
+        )
+        # Position of each flow in the store, to return indexed flows in store order.
+        self._seq: typing.Dict[str, int] = {}
+        self._counter = itertools.count()
+        # Memory limits, 0 means unlimited.
+        self.max_flows = 0
+        self.max_bytes = 0
+        # Approximate size of the flows in the store.
+        self.store_bytes = 0
+        # flow id -> (size, number of messages accounted for, first of them)
+        self._sizes: typing.Dict[str, typing.Tuple[int, int, typing.Any]] = {}
+        self._spill: typing.Optional[io.FlowWriter] = None
+        self._spill_file: typing.Optional[typing.BinaryIO] = None
         # Should we show only marked flows?
         self.show_marked = False
 
@@ -182,6 +337,29 @@ class View(collections.abc.Sequence):
             "console_focus_follow", bool, False,
             "Focus follows new flows."
         )
+        loader.add_option(
+            "view_max_flows", int, 0,
+            """
+            Maximum number of flows to keep in memory. The oldest flows are
+            evicted first, marked and intercepted flows are never evicted.
+            0 means unlimited.
+            """
+        )
+        loader.add_option(
+            "view_max_bytes", typing.Optional[str], None,
+            """
+            Maximum size of the flows to keep in memory. Sizes are estimated
+            from headers, bodies and messages. Understands k/m/g suffixes,
+            i.e. 512m for 512 megabytes. By default, the size is unlimited.
+            """
+        )
+        loader.add_option(
+            "view_spill_file", typing.Optional[str], None,
+            """
+            Append evicted flows to this file, so that they can be loaded
+            and searched later.
+            """
+        )
 
     def store_count(self):
         return len(self._store)
@@ -224,15 +402,247 @@ class View(collections.abc.Sequence):
         self.settings[f][self._order_key_name()] = self.order_key(f)
         self._view.add(f)
 
+    def _filter_verdicts(self) -> typing.Optional[typing.Dict[str, bool]]:
+        """
+            Returns the cached verdicts of the current filter.
+        """
+        pattern = getattr(self.filter, "pattern", None)
+        if pattern is None:
+            return None
+        if pattern in self._verdicts:
+            self._verdicts.move_to_end(pattern)
+        else:
+            self._verdicts[pattern] = {}
+            while len(self._verdicts) > self.verdict_cache_size:
+                self._verdicts.popitem(last=False)
+        return self._verdicts[pattern]
+
+    def _matches(self, f: mitmproxy.flow.Flow) -> bool:
+        verdicts = self._filter_verdicts()
+        if verdicts is None:
+            return bool(self.filter(f))
+        try:
+            return verdicts[f.id]
+        except KeyError:
+            ret = verdicts[f.id] = bool(self.filter(f))
+            return ret
+
+    def _forget(self, f: mitmproxy.flow.Flow) -> None:
+        """
+            Drops everything we know about a flow that has changed or is gone.
+        """
+        for verdicts in self._verdicts.values():
+            verdicts.pop(f.id, None)
+        self._refilter_pending.discard(f.id)
+        self._selections.clear()
+
+    def _refilter_chunk(self, flows: typing.Iterable[mitmproxy.flow.Flow]) -> None:
+        verdicts = self._filter_verdicts()
+        matching = []
+        for f in flows:
+            if self.show_marked and not f.marked:
+                continue
+            if verdicts is None:
+                v = self.filter(f)
+            else:
+                v = verdicts.get(f.id)
+                if v is None:
+                    v = verdicts[f.id] = bool(self.filter(f))
+            if v:
+                self.settings[f][self._order_key_name()] = self.order_key(f)
+                matching.append(f)
+        self._view.update(matching)
+
     def _refilter(self):
+        """
+            Rebuilds the view. With an event loop running, only the first chunk
+            of flows is filtered right away. The rest is merged in by a
+            background task, so that the UI stays responsive.
+        """
+        if self._refilter_task:
+            self._refilter_task.cancel()
+            self._refilter_task = None
+        self._refilter_pending.clear()
+        self._selections.clear()
         self._view.clear()
-        for i in self._store.values():
-            if self.show_marked and not i.marked:
-                continue
-            if self.filter(i):
-                self._base_add(i)
+        candidates = self._candidates(self._filter_tree) if self._filter_tree else None
+        if candidates is None:
+            flows = list(self._store.values())
+        else:
+            # Flows the indexes rule out cannot match, so they are not evaluated.
+            flows = self._in_store_order(candidates)
+        chunk = self.refilter_chunk_size
+        loop = None
+        if len(flows) > chunk:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+        if loop:
+            self._refilter_chunk(flows[:chunk])
+            rest = flows[chunk:]
+            self._refilter_pending.update(f.id for f in rest)
+            self._refilter_task = loop.create_task(self._refilter_rest(rest))
+        else:
+            self._refilter_chunk(flows)
+        self.sig_view_refresh.send(self)
+
+    async def _refilter_rest(self, flows: typing.List[mitmproxy.flow.Flow]) -> None:
+        chunk = self.refilter_chunk_size
+        last_refresh = time.monotonic()
+        for i in range(0, len(flows), chunk):
+            await asyncio.sleep(0)
+            # Flows that have been updated or removed in the meantime are
+            # already taken care of.
+            self._refilter_chunk(
+                f for f in flows[i:i + chunk] if f.id in self._refilter_pending
+            )
+            self._refilter_pending.difference_update(f.id for f in flows[i:i + chunk])
+            if time.monotonic() - last_refresh > self.refilter_refresh_interval:
+                last_refresh = time.monotonic()
+                self.sig_view_refresh.send(self)
+        self._refilter_task = None
         self.sig_view_refresh.send(self)
 
+    @property
+    def refiltering(self) -> bool:
+        """
+            Is the view still being re-filtered in the background?
+        """
+        return bool(self._refilter_pending)
+
+    def _index_add(self, f: mitmproxy.flow.Flow) -> None:
+        self._seq[f.id] = next(self._counter)
+        for i in self.indexes.values():
+            i.add(f)
+
+    def _index_remove(self, f: mitmproxy.flow.Flow) -> None:
+        self._seq.pop(f.id, None)
+        for i in self.indexes.values():
+            i.remove(f)
+
+    def _in_store_order(self, ids: typing.Iterable[str]) -> typing.List[mitmproxy.flow.Flow]:
+        return [self._store[i] for i in sorted(ids, key=self._seq.__getitem__)]
+
+    def _candidates(self, flt) -> typing.Optional[typing.Set[str]]:
+        """
+            Uses the indexes to find the ids of all flows that may match a
+            parsed filter. Returns None if the indexes cannot tell.
+        """
+        if isinstance(flt, flowfilter.FAnd):
+            known = [c for c in map(self._candidates, flt.lst) if c is not None]
+            return set.intersection(*known) if known else None
+        if isinstance(flt, flowfilter.FOr):
+            ret: typing.Set[str] = set()
+            for c in map(self._candidates, flt.lst):
+                if c is None:
+                    return None
+                ret |= c
+            return ret
+        if isinstance(flt, flowfilter.FReq):
+            return set(self.indexes["status"].buckets.get(None, ()))
+        if isinstance(flt, flowfilter.FResp):
+            return self.indexes["status"].where(lambda k: k is not None)
+        if isinstance(flt, flowfilter.FCode):
+            return set(self.indexes["status"].buckets.get(flt.num, ()))
+        if isinstance(flt, flowfilter.FMethod):
+            return self.indexes["method"].where(flt.re.search)
+        if isinstance(flt, flowfilter.FDomain):
+            # ~d also matches WebSocket flows, which are not indexed.
+            hosts = self.indexes["host"]
+            return hosts.where(lambda k: _search_any(flt.re, k)) | set(hosts.other)
+        if isinstance(flt, flowfilter.FContentType):
+            return self.indexes["content_type"].where(
+                lambda k: _search_any(flt.re, k[0]) or _search_any(flt.re, k[1])
+            )
+        if isinstance(flt, flowfilter.FContentTypeRequest):
+            return self.indexes["content_type"].where(lambda k: _search_any(flt.re, k[0]))
+        if isinstance(flt, flowfilter.FContentTypeResponse):
+            return self.indexes["content_type"].where(lambda k: _search_any(flt.re, k[1]))
+        return None
+
+    def count_by(self, index: str) -> typing.Dict[typing.Hashable, int]:
+        """
+            Returns the number of flows in the store for each key of an index,
+            e.g. count_by("status") -> {200: 10, 404: 1, None: 2}.
+        """
+        return self.indexes[index].counts()
+
+    def _account(self, f: mitmproxy.flow.Flow) -> None:
+        """
+            Updates the size of a flow. Messages are appended to TCP and
+            WebSocket flows, so usually only new ones need to be counted. If
+            the oldest messages have been trimmed in the meantime, the
+            remaining ones, which the trim limits keep few, are counted again.
+        """
+        old, counted, first = self._sizes.get(f.id, (0, 0, None))
+        if isinstance(f, http.HTTPFlow):
+            size = _message_size(f.request)
+            if f.response:
+                size += _message_size(f.response)
+        elif isinstance(f, (tcp.TCPFlow, websocket.WebSocketFlow)):
+            messages = f.messages
+            if counted and len(messages) >= counted and messages[0] is first:
+                size = old + sum(len(m.content) for m in messages[counted:])
+            else:
+                size = sum(len(m.content) for m in messages)
+            counted = len(messages)
+            first = messages[0] if messages else None
+        else:
+            size = 0
+        self._sizes[f.id] = (size, counted, first)
+        self.store_bytes += size - old
+
+    def _store_remove(self, f: mitmproxy.flow.Flow) -> None:
+        """
+            Removes a flow from the store and all bookkeeping, but not from the view.
+        """
+        self._forget(f)
+        self._index_remove(f)
+        size = self._sizes.pop(f.id, (0, 0, None))[0]
+        self.store_bytes -= size
+        del self._store[f.id]
+
+    def _over_limit(self, count: int, size: int) -> bool:
+        return bool(
+            (self.max_flows and count > self.max_flows) or
+            (self.max_bytes and size > self.max_bytes)
+        )
+
+    def _evict(self) -> None:
+        """
+            Evicts the oldest flows until the store is within its limits.
+        """
+        count, size = len(self._store), self.store_bytes
+        if not self._over_limit(count, size):
+            return
+        evicted = []
+        for f in self._store.values():
+            if not self._over_limit(count, size):
+                break
+            if f.marked or f.intercepted:
+                continue
+            evicted.append(f)
+            count -= 1
+            size -= self._sizes[f.id][0]
+        for f in evicted:
+            if f in self._view:
+                idx = self._view.index(f)
+                self._view.remove(f)
+                self.sig_view_remove.send(self, flow=f, index=idx)
+            if self._spill:
+                self._spill.add(f)
+            self._store_remove(f)
+            self.sig_store_remove.send(self, flow=f)
+        if self._spill_file:
+            self._spill_file.flush()
+
+    def _close_spill(self) -> None:
+        if self._spill_file:
+            self._spill_file.close()
+            self._spill_file = None
+            self._spill = None
+
     """ View API """
 
     # Focus
@@ -300,6 +710,8 @@ class View(collections.abc.Sequence):
                 "Unknown flow order: %s" % order_key
             )
         order_key = self.orders[order_key]
+        if order_key is self.order_key:
+            return
         self.order_key = order_key
         newview = sortedcontainers.SortedListWithKey(key=order_key)
         newview.update(self._view)
@@ -332,7 +744,8 @@ class View(collections.abc.Sequence):
         self.set_filter(filt)
 
     def set_filter(self, flt: typing.Optional[flowfilter.TFilter]):
-        self.filter = flt or matchall
+        self._filter_tree = flt
+        self.filter = flowfilter.registry.optimize(flt) if flt else matchall
         self._refilter()
 
     # View Updates
@@ -341,6 +754,17 @@ class View(collections.abc.Sequence):
         """
             Clears both the store and view.
         """
+        if self._refilter_task:
+            self._refilter_task.cancel()
+            self._refilter_task = None
+        self._refilter_pending.clear()
+        self._verdicts.clear()
+        self._selections.clear()
+        for i in self.indexes.values():
+            i.clear()
+        self._seq.clear()
+        self._sizes.clear()
+        self.store_bytes = 0
         self._store.clear()
         self._view.clear()
         self.sig_view_refresh.send(self)
@@ -351,9 +775,9 @@ class View(collections.abc.Sequence):
         """
             Clears only the unmarked flows.
         """
-        for flow in self._store.copy().values():
+        for flow in list(self._store.values()):
             if not flow.marked:
-                self._store.pop(flow.id)
+                self._store_remove(flow)
 
         self._refilter()
         self.sig_store_refresh.send(self)
@@ -426,7 +850,7 @@ class View(collections.abc.Sequence):
                     idx = self._view.index(f)
                     self._view.remove(f)
                     self.sig_view_remove.send(self, flow=f, index=idx)
-                del self._store[f.id]
+                self._store_remove(f)
                 self.sig_store_remove.send(self, flow=f)
         if len(flows) > 1:
             ctx.log.alert("Removed %s flows" % len(flows))
@@ -452,7 +876,58 @@ class View(collections.abc.Sequence):
             filt = flowfilter.parse(flow_spec)
             if not filt:
                 raise exceptions.CommandError("Invalid flow filter: %s" % flow_spec)
-            return [i for i in self._store.values() if filt(i)]
+            candidates = self._candidates(filt)
+            filt = flowfilter.optimize(filt)
+            if candidates is None:
+                return [i for i in self._store.values() if filt(i)]
+            return [i for i in self._in_store_order(candidates) if filt(i)]
+
+    def select(
+        self,
+        filter_expr: typing.Optional[str] = None,
+        order: typing.Optional[str] = None,
+        reverse: typing.Optional[bool] = None,
+    ) -> typing.Sequence[mitmproxy.flow.Flow]:
+        """
+            Returns the flows matching a filter expression in the given order,
+            without changing the view. Arguments that are None default to the
+            view's own settings. If all of them match the view, the view
+            itself is returned. Otherwise, the result is a Selection, which
+            is cached until the store changes.
+        """
+        if order is None:
+            order_key = self.order_key
+        elif order in self.orders:
+            order_key = self.orders[order]
+        else:
+            raise exceptions.CommandError("Unknown flow order: %s" % order)
+        if reverse is None:
+            reverse = self.order_reversed
+        current = "" if self.filter is matchall else self.filter.pattern
+        from_view = filter_expr is None or filter_expr == current
+        if from_view and isinstance(order_key, type(self.order_key)) and reverse == self.order_reversed:
+            return self
+        key = (current if from_view else filter_expr, type(order_key), reverse, from_view)
+        selection = self._selections.get(key)
+        if selection is not None:
+            self._selections.move_to_end(key)
+            return selection
+        if from_view:
+            flows = list(self._view)
+        elif filter_expr:
+            flows = list(self.resolve(filter_expr))
+        else:
+            flows = list(self._store.values())
+        # Keys cached by the order key are only kept up to date for the
+        # view's own order, so compute them afresh.
+        flows.sort(key=order_key.generate)
+        if reverse:
+            flows.reverse()
+        selection = Selection(flows)
+        self._selections[key] = selection
+        while len(self._selections) > self.selection_cache_size:
+            self._selections.popitem(last=False)
+        return selection
 
     @command.command("view.flows.create")
     def create(self, method: str, url: str) -> None:
@@ -473,12 +948,13 @@ class View(collections.abc.Sequence):
             Load flows into the view, without processing them with addons.
         """
         try:
-            with open(path, "rb") as f:
-                for i in io.FlowReader(f).stream():
-                    # Do this to get a new ID, so we can load the same file N times and
-                    # get new flows each time. It would be more efficient to just have a
-                    # .newid() method or something.
-                    self.add([i.copy()])
+            for p in io.expand_flow_paths(path):
+                with io.open_flow_file(p) as f:
+                    for i in io.FlowReader(f).stream():
+                        # Do this to get a new ID, so we can load the same file N times and
+                        # get new flows each time. It would be more efficient to just have a
+                        # .newid() method or something.
+                        self.add([i.copy()])
         except IOError as e:
             ctx.log.error(e.strerror)
         except exceptions.FlowReadException as e:
@@ -492,11 +968,15 @@ class View(collections.abc.Sequence):
         for f in flows:
             if f.id not in self._store:
                 self._store[f.id] = f
-                if self.filter(f):
+                self._selections.clear()
+                self._index_add(f)
+                self._account(f)
+                if self._matches(f):
                     self._base_add(f)
                     if self.focus_follow:
                         self.focus.flow = f
                     self.sig_view_add.send(self, flow=f)
+        self._evict()
 
     def get_by_id(self, flow_id: str) -> typing.Optional[mitmproxy.flow.Flow]:
         """
@@ -556,6 +1036,29 @@ class View(collections.abc.Sequence):
             self.set_reversed(ctx.options.view_order_reversed)
         if "console_focus_follow" in updated:
             self.focus_follow = ctx.options.console_focus_follow
+        if "view_max_flows" in updated or "view_max_bytes" in updated:
+            try:
+                max_bytes = human.parse_size(ctx.options.view_max_bytes) or 0
+            except ValueError as e:
+                raise exceptions.OptionsError("Invalid view_max_bytes: %s" % e)
+            if ctx.options.view_max_flows < 0 or max_bytes < 0:
+                raise exceptions.OptionsError("View limits must not be negative.")
+            self.max_flows = ctx.options.view_max_flows
+            self.max_bytes = max_bytes
+        if "view_spill_file" in updated:
+            self._close_spill()
+            if ctx.options.view_spill_file:
+                path = os.path.expanduser(ctx.options.view_spill_file)
+                try:
+                    self._spill_file = open(path, "ab")
+                except OSError as e:
+                    raise exceptions.OptionsError("Error opening view spill file: %s" % e)
+                self._spill = io.FlowWriter(self._spill_file)
+        if "view_max_flows" in updated or "view_max_bytes" in updated or "view_spill_file" in updated:
+            self._evict()
+
+    def done(self):
+        self._close_spill()
 
     def request(self, f):
         self.add([f])
@@ -593,7 +1096,11 @@ class View(collections.abc.Sequence):
         """
         for f in flows:
             if f.id in self._store:
-                if self.filter(f):
+                self._forget(f)
+                for i in self.indexes.values():
+                    i.update(f)
+                self._account(f)
+                if self._matches(f):
                     if f not in self._view:
                         self._base_add(f)
                         if self.focus_follow:
@@ -614,6 +1121,7 @@ class View(collections.abc.Sequence):
                     else:
                         self._view.remove(f)
                         self.sig_view_remove.send(self, flow=f, index=idx)
+        self._evict()
 
 
 class Focus:
@@ -0,0 +1,47 @@
+import sys
+import typing
+
+from mitmproxy import ctx
+from mitmproxy.utils import workers
+
+
+class WorkerStats:
+    """
+        Counts the traffic handled by a worker process and reports it to the
+        supervisor on exit, which adds up the numbers of all workers.
+    """
+    def __init__(self, output: typing.Optional[typing.TextIO] = None):
+        self.output = output
+        self.stats = dict(
+            client_connections=0,
+            http_flows=0,
+            tcp_flows=0,
+            websocket_flows=0,
+            errors=0,
+        )
+
+    def clientconnect(self, layer):
+        self.stats["client_connections"] += 1
+
+    def response(self, f):
+        self.stats["http_flows"] += 1
+
+    def tcp_end(self, f):
+        self.stats["tcp_flows"] += 1
+
+    def websocket_end(self, f):
+        self.stats["websocket_flows"] += 1
+
+    def error(self, f):
+        self.stats["errors"] += 1
+
+    def tcp_error(self, f):
+        self.stats["errors"] += 1
+
+    def websocket_error(self, f):
+        self.stats["errors"] += 1
+
+    def done(self):
+        if ctx.options.workers > 1 and workers.worker_id() is not None:
+            out = self.output or sys.stdout
+            print(workers.format_stats(self.stats), file=out, flush=True)
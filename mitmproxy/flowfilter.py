@@ -32,10 +32,14 @@
         rex         Equivalent to ~u rex
 """
 
+import contextvars
 import functools
 import re
+import string
 import sys
-from typing import Callable, ClassVar, Optional, Sequence, Type
+import types
+import weakref
+from typing import Callable, ClassVar, Dict, List, Optional, Sequence, Tuple, Type
 
 import pyparsing as pp
 
@@ -53,11 +57,34 @@ def only(*types):
                 return fn(self, flow)
             return False
 
+        filter_types.types = types
         return filter_types
 
     return decorator
 
 
+# Decoded bodies of the flow that is currently being matched by a compiled
+# filter, keyed by message id. None outside of compiled evaluations.
+_content_cache: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "flowfilter_content_cache", default=None
+)
+
+
+def _get_content(message) -> bytes:
+    """
+        message.get_content(strict=False), decoded only once per evaluation
+        of a compiled filter, no matter how many body filters look at it.
+    """
+    cache = _content_cache.get()
+    if cache is None:
+        return message.get_content(strict=False)
+    key = id(message)
+    if key not in cache:
+        # keep a reference to the message so that its id cannot be reused.
+        cache[key] = (message, message.get_content(strict=False))
+    return cache[key][1]
+
+
 class _Token:
 
     def dump(self, indent=0, fp=sys.stdout):
@@ -71,6 +98,9 @@ class _Token:
 class _Action(_Token):
     code: ClassVar[str]
     help: ClassVar[str]
+    # Rough relative cost of evaluating this filter, used by optimize().
+    # Body filters are the most expensive, as they may have to decode large bodies.
+    cost: ClassVar[int] = 1
 
     @classmethod
     def make(klass, s, loc, toks):
@@ -164,6 +194,7 @@ def _check_content_type(rex, message):
 class FAsset(_Action):
     code = "a"
     help = "Match asset in response: CSS, Javascript, Flash, images."
+    cost = 15
     ASSET_TYPES = [re.compile(x) for x in [
         b"text/javascript",
         b"application/x-javascript",
@@ -185,6 +216,7 @@ class FAsset(_Action):
 class FContentType(_Rex):
     code = "t"
     help = "Content-type header"
+    cost = 5
 
     @only(http.HTTPFlow)
     def __call__(self, f):
@@ -198,6 +230,7 @@ class FContentType(_Rex):
 class FContentTypeRequest(_Rex):
     code = "tq"
     help = "Request Content-Type header"
+    cost = 5
 
     @only(http.HTTPFlow)
     def __call__(self, f):
@@ -207,6 +240,7 @@ class FContentTypeRequest(_Rex):
 class FContentTypeResponse(_Rex):
     code = "ts"
     help = "Response Content-Type header"
+    cost = 5
 
     @only(http.HTTPFlow)
     def __call__(self, f):
@@ -218,6 +252,7 @@ class FContentTypeResponse(_Rex):
 class FHead(_Rex):
     code = "h"
     help = "Header"
+    cost = 10
     flags = re.MULTILINE
 
     @only(http.HTTPFlow)
@@ -232,6 +267,7 @@ class FHead(_Rex):
 class FHeadRequest(_Rex):
     code = "hq"
     help = "Request header"
+    cost = 5
     flags = re.MULTILINE
 
     @only(http.HTTPFlow)
@@ -243,6 +279,7 @@ class FHeadRequest(_Rex):
 class FHeadResponse(_Rex):
     code = "hs"
     help = "Response header"
+    cost = 5
     flags = re.MULTILINE
 
     @only(http.HTTPFlow)
@@ -254,16 +291,17 @@ class FHeadResponse(_Rex):
 class FBod(_Rex):
     code = "b"
     help = "Body"
+    cost = 100
     flags = re.DOTALL
 
     @only(http.HTTPFlow, websocket.WebSocketFlow, tcp.TCPFlow)
     def __call__(self, f):
         if isinstance(f, http.HTTPFlow):
             if f.request and f.request.raw_content:
-                if self.re.search(f.request.get_content(strict=False)):
+                if self.re.search(_get_content(f.request)):
                     return True
             if f.response and f.response.raw_content:
-                if self.re.search(f.response.get_content(strict=False)):
+                if self.re.search(_get_content(f.response)):
                     return True
         elif isinstance(f, websocket.WebSocketFlow) or isinstance(f, tcp.TCPFlow):
             for msg in f.messages:
@@ -275,13 +313,14 @@ class FBod(_Rex):
 class FBodRequest(_Rex):
     code = "bq"
     help = "Request body"
+    cost = 50
     flags = re.DOTALL
 
     @only(http.HTTPFlow, websocket.WebSocketFlow, tcp.TCPFlow)
     def __call__(self, f):
         if isinstance(f, http.HTTPFlow):
             if f.request and f.request.raw_content:
-                if self.re.search(f.request.get_content(strict=False)):
+                if self.re.search(_get_content(f.request)):
                     return True
         elif isinstance(f, websocket.WebSocketFlow) or isinstance(f, tcp.TCPFlow):
             for msg in f.messages:
@@ -292,13 +331,14 @@ class FBodRequest(_Rex):
 class FBodResponse(_Rex):
     code = "bs"
     help = "Response body"
+    cost = 50
     flags = re.DOTALL
 
     @only(http.HTTPFlow, websocket.WebSocketFlow, tcp.TCPFlow)
     def __call__(self, f):
         if isinstance(f, http.HTTPFlow):
             if f.response and f.response.raw_content:
-                if self.re.search(f.response.get_content(strict=False)):
+                if self.re.search(_get_content(f.response)):
                     return True
         elif isinstance(f, websocket.WebSocketFlow) or isinstance(f, tcp.TCPFlow):
             for msg in f.messages:
@@ -309,6 +349,7 @@ class FBodResponse(_Rex):
 class FMethod(_Rex):
     code = "m"
     help = "Method"
+    cost = 2
     flags = re.IGNORECASE
 
     @only(http.HTTPFlow)
@@ -319,6 +360,7 @@ class FMethod(_Rex):
 class FDomain(_Rex):
     code = "d"
     help = "Domain"
+    cost = 20
     flags = re.IGNORECASE
     is_binary = False
 
@@ -335,6 +377,7 @@ class FDomain(_Rex):
 class FUrl(_Rex):
     code = "u"
     help = "URL"
+    cost = 30
     is_binary = False
 
     # FUrl is special, because it can be "naked".
@@ -357,6 +400,7 @@ class FUrl(_Rex):
 class FSrc(_Rex):
     code = "src"
     help = "Match source address"
+    cost = 2
     is_binary = False
 
     def __call__(self, f):
@@ -369,6 +413,7 @@ class FSrc(_Rex):
 class FDst(_Rex):
     code = "dst"
     help = "Match destination address"
+    cost = 2
     is_binary = False
 
     def __call__(self, f):
@@ -467,6 +512,10 @@ filter_int = [
 
 
 def _make():
+    """
+        Builds the reference pyparsing grammar. parse() uses the equivalent,
+        but much faster, _Parser; the grammar is only built by the tests.
+    """
     # Order is important - multi-char expressions need to come before narrow
     # ones.
     parts = []
@@ -519,21 +568,445 @@ def _make():
     return expr.setParseAction(lambda x: FAnd(x) if len(x) != 1 else x)
 
 
-bnf = _make()
 TFilter = Callable[[flow.Flow], bool]
 
+_WHITESPACE = " \n\t\r"
+_PRINTABLES = frozenset(string.printable) - frozenset(string.whitespace)
+_NOT_REGEX = frozenset("()~'\"" + _WHITESPACE)
+_QUOTED = {
+    q: re.compile(r'{q}(?:[^{q}\n\r\\]|(?:\\.))*{q}'.format(q=q))
+    for q in "\"'"
+}
+_ESCAPED = re.compile(r"\\(.)")
+_WHITESPACE_ESCAPES = {r"\t": "\t", r"\n": "\n", r"\f": "\f", r"\r": "\r"}
+_ACTIONS = {cls.code: cls for cls in [*filter_unary, *filter_rex, *filter_int]}
 
+
+class _ParseError(Exception):
+    pass
+
+
+class _Parser:
+    """
+        A recursive descent parser that accepts the same language as _make() and
+        builds the same filter trees, including its quirks: operands are
+        separated by whitespace only at the top level, and "&", "|" and "!"
+        are part of a regex if they are not followed by a valid operand.
+    """
+
+    def __init__(self, s: str) -> None:
+        # pyparsing does the same.
+        self.s = s.expandtabs()
+        self.pos = 0
+
+    def skip_whitespace(self) -> None:
+        while self.pos < len(self.s) and self.s[self.pos] in _WHITESPACE:
+            self.pos += 1
+
+    def next_is(self, c: str) -> bool:
+        self.skip_whitespace()
+        return self.s.startswith(c, self.pos)
+
+    def parse(self) -> _Token:
+        items = [self.or_expr()]
+        while True:
+            start = self.pos
+            try:
+                items.append(self.or_expr())
+            except _ParseError:
+                self.pos = start
+                break
+        self.skip_whitespace()
+        if self.pos != len(self.s):
+            raise _ParseError()
+        return FAnd(items) if len(items) != 1 else items[0]
+
+    def binary(self, operand, op: str, cls):
+        items = [operand()]
+        while True:
+            start = self.pos
+            if self.next_is(op):
+                self.pos += 1
+                try:
+                    items.append(operand())
+                    continue
+                except _ParseError:
+                    pass
+            self.pos = start
+            break
+        return cls(items) if len(items) > 1 else items[0]
+
+    def or_expr(self) -> _Token:
+        return self.binary(self.and_expr, "|", FOr)
+
+    def and_expr(self) -> _Token:
+        return self.binary(self.not_expr, "&", FAnd)
+
+    def not_expr(self) -> _Token:
+        start = self.pos
+        if self.next_is("!"):
+            self.pos += 1
+            try:
+                return FNot([self.not_expr()])
+            except _ParseError:
+                self.pos = start
+        return self.operand()
+
+    def operand(self) -> _Token:
+        start = self.pos
+        try:
+            return self.action()
+        except _ParseError:
+            self.pos = start
+        if not self.next_is("("):
+            raise _ParseError()
+        self.pos += 1
+        expr = self.or_expr()
+        if not self.next_is(")"):
+            raise _ParseError()
+        self.pos += 1
+        return expr
+
+    def action(self) -> _Action:
+        if not self.next_is("~"):
+            return FUrl(self.regex())
+        end = self.pos + 1
+        while end < len(self.s) and self.s[end] in _PRINTABLES:
+            end += 1
+        cls = _ACTIONS.get(self.s[self.pos + 1:end])
+        if cls is None:
+            raise _ParseError()
+        self.pos = end
+        if issubclass(cls, _Rex):
+            return cls(self.regex())
+        if issubclass(cls, _Int):
+            self.skip_whitespace()
+            end = self.pos
+            while end < len(self.s) and self.s[end] in string.digits:
+                end += 1
+            if end == self.pos:
+                raise _ParseError()
+            num, self.pos = self.s[self.pos:end], end
+            return cls(num)
+        return cls()
+
+    def regex(self) -> str:
+        self.skip_whitespace()
+        if self.pos == len(self.s):
+            raise _ParseError()
+        c = self.s[self.pos]
+        if c in _QUOTED:
+            m = _QUOTED[c].match(self.s, self.pos)
+            if not m:
+                raise _ParseError()
+            self.pos = m.end()
+            ret = m.group()[1:-1]
+            if "\\" in ret:
+                for escape, char in _WHITESPACE_ESCAPES.items():
+                    ret = ret.replace(escape, char)
+                ret = _ESCAPED.sub(r"\g<1>", ret)
+            return ret
+        end = self.pos
+        while end < len(self.s) and self.s[end] not in _NOT_REGEX:
+            end += 1
+        if end == self.pos:
+            raise _ParseError()
+        ret, self.pos = self.s[self.pos:end], end
+        return ret
+
+
+@functools.lru_cache(maxsize=1024)
 def parse(s: str) -> Optional[TFilter]:
+    """
+        Parses a filter expression, returns None if it is invalid.
+
+        Results are cached, as the same expressions are parsed over and over
+        again, e.g. while a filter is typed in the web interface. The
+        returned filter is therefore shared and must not be modified.
+    """
     try:
-        flt = bnf.parseString(s, parseAll=True)[0]
+        flt = _Parser(s).parse()
         flt.pattern = s
         return flt
-    except pp.ParseException:
+    except _ParseError:
         return None
     except ValueError:
         return None
 
 
+def _cost(node) -> int:
+    if isinstance(node, (FAnd, FOr)):
+        return sum(_cost(i) for i in node.lst)
+    if isinstance(node, FNot):
+        return _cost(node.itm)
+    return node.cost
+
+
+def _operands(node) -> List:
+    """
+        Flattens nested expressions of the same operator: (a & (b & c)) -> [a, b, c]
+    """
+    ret = []
+    for i in node.lst:
+        if type(i) is type(node):
+            ret.extend(_operands(i))
+        else:
+            ret.append(i)
+    return ret
+
+
+def _count_body_filters(node) -> int:
+    if isinstance(node, (FAnd, FOr)):
+        return sum(_count_body_filters(i) for i in node.lst)
+    if isinstance(node, FNot):
+        return _count_body_filters(node.itm)
+    return isinstance(node, (FBod, FBodRequest, FBodResponse))
+
+
+def _flow_types(node) -> tuple:
+    """
+        The flow types a filter is restricted to with @only, or () if it accepts all flows.
+    """
+    flow_types = getattr(type(node).__call__, "types", ())
+    return flow_types if isinstance(flow_types, tuple) else ()
+
+
+def _compile(node, known: tuple, atom=None) -> TFilter:
+    """
+        known are the flow types that earlier operands of an enclosing & have
+        already checked for, so that type checks can be skipped.
+        atom, if given, may replace individual filters with shared ones.
+    """
+    if isinstance(node, FNot):
+        itm = _compile(node.itm, known, atom)
+        return lambda f: not itm(f)
+
+    if isinstance(node, (FAnd, FOr)):
+        # Filters have no side effects, so operands can be evaluated in any
+        # order. Cheap ones go first, in the hope that they decide the result.
+        operands = sorted(_operands(node), key=_cost)
+        fns = []
+        for i in operands:
+            fns.append(_compile(i, known, atom))
+            flow_types = _flow_types(i)
+            if isinstance(node, FAnd) and len(flow_types) == 1:
+                known = flow_types
+        if len(fns) == 1:
+            return fns[0]
+        if isinstance(node, FAnd):
+            if len(fns) == 2:
+                a, b = fns
+                return lambda f: bool(a(f) and b(f))
+
+            def all_of(f):
+                for fn in fns:
+                    if not fn(f):
+                        return False
+                return True
+            return all_of
+        else:
+            if len(fns) == 2:
+                a, b = fns
+                return lambda f: bool(a(f) or b(f))
+
+            def any_of(f):
+                for fn in fns:
+                    if fn(f):
+                        return True
+                return False
+            return any_of
+
+    if atom is not None:
+        shared = atom(node)
+        if shared is not None:
+            return shared
+    flow_types = _flow_types(node)
+    if flow_types and known and all(issubclass(k, flow_types) for k in known):
+        # The type check has already been done, call the undecorated method.
+        return type(node).__call__.__wrapped__.__get__(node)
+    return node
+
+
+def _with_content_cache(fn: TFilter) -> TFilter:
+    def cached(f):
+        token = _content_cache.set({})
+        try:
+            return fn(f)
+        finally:
+            _content_cache.reset(token)
+    return cached
+
+
+def _compile_filter(flt: TFilter, atom=None) -> TFilter:
+    fn = _compile(flt, (), atom)
+    if _count_body_filters(flt) > 1:
+        fn = _with_content_cache(fn)
+    elif not isinstance(fn, types.FunctionType):
+        # A single filter, wrap it so that we can set attributes on it.
+        fn = functools.partial(fn)
+    fn.pattern = getattr(flt, "pattern", None)  # type: ignore
+    return fn
+
+
+def optimize(flt: TFilter) -> TFilter:
+    """
+        Turns a parsed filter into a faster callable that gives the same results.
+
+        Nested & and | expressions are flattened and their operands reordered
+        by estimated cost, so that cheap metadata checks can short-circuit
+        before headers are serialized or bodies decoded. Decoded bodies are
+        shared between all body filters of a single evaluation.
+    """
+    return _compile_filter(flt)
+
+
+def _http_state(f: http.HTTPFlow) -> tuple:
+    """
+        Everything the memoised filters look at. Messages store immutable values
+        and replace them when they are modified, so comparing this with an
+        earlier state tells us whether the flow has changed in between.
+    """
+    rq = f.request.data
+    rs = f.response.data if f.response else None
+    return (
+        rq, rq.first_line_format, rq.method, rq.scheme, rq.host, rq.port, rq.path,
+        rq.headers, rq.headers.fields, rq.content,
+        rs, rs and rs.headers, rs and rs.headers.fields, rs and rs.content,
+    )
+
+
+class _SharedFilter:
+    """
+        A filter that is shared by all expressions of a registry that contain it.
+        Results are memoised per HTTP flow.
+    """
+
+    def __init__(self, registry: "FilterRegistry", node: _Action, key: tuple) -> None:
+        self.registry = registry
+        self.node = node
+        self.key = key
+
+    def __call__(self, f):
+        if not isinstance(f, http.HTTPFlow) or not f.request:
+            return self.node(f)
+        results = self.registry.results(f)
+        try:
+            return results[self.key]
+        except KeyError:
+            pass
+        group = self.registry.groups.get(type(self.node))
+        if group and not group(f, results):
+            ret = False
+        else:
+            ret = bool(self.node(f))
+        results[self.key] = ret
+        return ret
+
+
+class _RexGroup:
+    """
+        All shared filters of one regex filter class. Their patterns are
+        combined into a single regex, so that a single scan of the flow
+        rules them all out in the common case that none of them matches.
+    """
+
+    def __init__(self, cls: Type[_Rex]) -> None:
+        self.cls = cls
+        self.members: "weakref.WeakSet[_SharedFilter]" = weakref.WeakSet()
+        self.version = 0
+        self.combined: Optional[_Rex] = None
+
+    def add(self, shared: _SharedFilter) -> None:
+        self.members.add(shared)
+        self.version += 1
+        exprs = sorted({m.node.expr for m in self.members})
+        self.combined = None
+        if len(exprs) < 2 or any(m.node.re.groups for m in self.members):
+            # Group references would point to the wrong group once combined.
+            return
+        combined = self.cls.__new__(self.cls)
+        try:
+            _Rex.__init__(combined, "|".join("(?:{})".format(e) for e in exprs))
+        except ValueError:
+            return
+        self.combined = combined
+
+    def __call__(self, f, results: dict) -> bool:
+        """
+            False if none of the group's filters can match the flow.
+        """
+        if self.combined is None:
+            return True
+        key = (_RexGroup, self.cls, self.version)
+        try:
+            return results[key]
+        except KeyError:
+            ret = results[key] = bool(self.combined(f))
+            return ret
+
+
+class FilterRegistry:
+    """
+        Compiles filter expressions so that they share work.
+
+        Identical filters in different expressions, e.g. ~d example.com in the
+        intercept and the view filter, are evaluated once per HTTP flow. The
+        result is remembered until the flow is modified. Regex filters of the
+        same kind are also checked together with a single combined regex.
+        Cheap filters are evaluated directly, as remembering them would be
+        more expensive than evaluating them again.
+    """
+    # Filters that cost less than this are not shared.
+    min_cost = 5
+
+    def __init__(self) -> None:
+        self.shared: "weakref.WeakValueDictionary[tuple, _SharedFilter]" = weakref.WeakValueDictionary()
+        self.groups: Dict[type, _RexGroup] = {}
+        self.memo: "weakref.WeakKeyDictionary[flow.Flow, Tuple[tuple, dict]]" = weakref.WeakKeyDictionary()
+
+    def _share(self, node) -> Optional[_SharedFilter]:
+        if not isinstance(node, _Action) or node.cost < self.min_cost:
+            return None
+        key = (type(node), getattr(node, "expr", None), getattr(node, "num", None))
+        shared = self.shared.get(key)
+        if shared is None:
+            shared = _SharedFilter(self, node, key)
+            self.shared[key] = shared
+            if isinstance(node, _Rex):
+                if type(node) not in self.groups:
+                    self.groups[type(node)] = _RexGroup(type(node))
+                self.groups[type(node)].add(shared)
+        return shared
+
+    def results(self, f: http.HTTPFlow) -> dict:
+        """
+            The memoised results for a flow, reset if it has changed since they were stored.
+        """
+        state = _http_state(f)
+        entry = self.memo.get(f)
+        if entry is None or entry[0] != state:
+            entry = (state, {})
+            self.memo[f] = entry
+        return entry[1]
+
+    def optimize(self, flt: TFilter) -> TFilter:
+        return _compile_filter(flt, self._share)
+
+    def parse(self, s: str) -> Optional[TFilter]:
+        """
+            Like parse(), but returns a compiled filter that shares work with
+            all other filters of this registry.
+        """
+        flt = parse(s)
+        if not flt:
+            return None
+        return self.optimize(flt)
+
+
+# The registry used by mitmproxy's addons. Scripts can use it as well.
+registry = FilterRegistry()
+
+
 def match(flt, flow):
     """
         Matches a flow against a compiled filter expression.
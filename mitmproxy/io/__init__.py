@@ -1,8 +1,10 @@
 
-from .io import FlowWriter, FlowReader, FilteredFlowWriter, read_flows_from_paths
+from .io import FlowWriter, FlowReader, FilteredFlowWriter, BackgroundFlowWriter, read_flows_from_paths
+from .io import open_flow_file, expand_flow_paths, FSYNC_POLICIES, OVERFLOW_POLICIES
 from .db import DBHandler
 
 
 __all__ = [
-    "FlowWriter", "FlowReader", "FilteredFlowWriter", "read_flows_from_paths", "DBHandler"
+    "FlowWriter", "FlowReader", "FilteredFlowWriter", "BackgroundFlowWriter", "read_flows_from_paths",
+    "open_flow_file", "expand_flow_paths", "FSYNC_POLICIES", "OVERFLOW_POLICIES", "DBHandler"
 ]
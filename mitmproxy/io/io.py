@@ -1,5 +1,8 @@
+import glob
+import gzip
 import os
-from typing import Type, Iterable, Dict, Union, Any, cast  # noqa
+import queue
+from typing import Type, Iterable, Dict, Union, Any, Optional, cast  # noqa
 
 from mitmproxy import exceptions
 from mitmproxy import flow
@@ -7,6 +10,7 @@ from mitmproxy import flowfilter
 from mitmproxy import http
 from mitmproxy import tcp
 from mitmproxy import websocket
+from mitmproxy.coretypes import basethread
 
 from mitmproxy.io import compat
 from mitmproxy.io import tnetstring
@@ -26,6 +30,9 @@ class FlowWriter:
         d = flow.get_state()
         tnetstring.dump(d, self.fo)
 
+    def close(self):
+        self.fo.close()
+
 
 class FlowReader:
     def __init__(self, fo):
@@ -66,6 +73,122 @@ class FilteredFlowWriter:
         d = f.get_state()
         tnetstring.dump(d, self.fo)
 
+    def close(self):
+        self.fo.close()
+
+
+FSYNC_POLICIES = ("never", "batch", "flow")
+OVERFLOW_POLICIES = ("drop", "block")
+
+
+class BackgroundFlowWriter(FilteredFlowWriter):
+    """
+        A FilteredFlowWriter that encodes and writes flows in a background thread.
+
+        The flow state is taken when the flow is added, so flows may be modified
+        afterwards. At most maxsize flows are queued. If the writer falls
+        behind, add() either discards the flow and counts it in self.dropped
+        ("drop"), or blocks until there is room again ("block"). Blocking
+        stalls the caller, which is the event loop when used from an addon.
+
+        The writer thread writes everything that is queued and flushes the
+        file afterwards. With the "batch" fsync policy it then also calls
+        fsync(), with "flow" it does so after every flow.
+
+        Write errors are raised by the next call to add(). After an error the
+        writer thread keeps taking flows off the queue, so that neither add()
+        nor close() can get stuck.
+    """
+
+    def __init__(self, fo, flt, maxsize: int = 1000, overflow: str = "drop", fsync: str = "never"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Invalid overflow policy: {}".format(overflow))
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Invalid fsync policy: {}".format(fsync))
+        super().__init__(fo, flt)
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.overflow = overflow
+        self.fsync = fsync
+        self.written = 0
+        self.dropped = 0
+        self.error: Optional[Exception] = None
+        self.thread = basethread.BaseThread("FlowWriter", target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, f: flow.Flow):
+        if self.error:
+            raise self.error
+        if self.flt and not flowfilter.match(self.flt, f):
+            return
+        try:
+            self.queue.put(f.get_state(), block=self.overflow == "block")
+        except queue.Full:
+            self.dropped += 1
+
+    def _sync(self):
+        self.fo.flush()
+        os.fsync(self.fo.fileno())
+
+    def _write_batch(self, batch):
+        for d in batch:
+            tnetstring.dump(d, self.fo)
+            self.written += 1
+            if self.fsync == "flow":
+                self._sync()
+        if self.fsync == "batch":
+            self._sync()
+        else:
+            self.fo.flush()
+
+    def run(self):
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                done = True
+                batch = batch[:batch.index(None)]
+            if self.error or not batch:
+                continue
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """
+            Writes all queued flows and closes the file.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.fo.close()
+
+
+def open_flow_file(path: str):
+    """
+        Opens a flow file for reading, decompressing it if it is gzipped.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def expand_flow_paths(path: str):
+    """
+        Expands a glob pattern like "flows.*" into the matching flow files, sorted by name.
+        Paths that exist or match nothing are returned unchanged.
+    """
+    path = os.path.expanduser(path)
+    if os.path.exists(path):
+        return [path]
+    return sorted(glob.glob(path)) or [path]
+
 
 def read_flows_from_paths(paths):
     """
@@ -73,15 +196,18 @@ def read_flows_from_paths(paths):
     From a performance perspective, streaming would be advisable -
     however, if there's an error with one of the files, we want it to be raised immediately.
 
+    Large files are decoded on all CPU cores.
+
     Raises:
         FlowReadException, if any error occurs.
     """
+    from mitmproxy.io import parallel  # parallel imports this module
     try:
         flows = []
-        for path in paths:
-            path = os.path.expanduser(path)
-            with open(path, "rb") as f:
-                flows.extend(FlowReader(f).stream())
+        for pattern in paths:
+            for path in expand_flow_paths(pattern):
+                with open_flow_file(path) as f:
+                    flows.extend(parallel.read_flows(f))
     except IOError as e:
         raise exceptions.FlowReadException(e.strerror)
     return flows
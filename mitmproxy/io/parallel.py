@@ -0,0 +1,222 @@
+"""
+Decode flow files on several CPU cores.
+
+Decoding a flow means parsing its tnetstring, migrating the state to the
+current format and building the flow object, which makes reading large
+files CPU-bound. Here, the main process only looks at the tnetstring length
+prefixes to split the file into chunks of complete records. A process pool
+turns the chunks into flows, which are sent back to the main process in
+file order. Unpickling a flow is considerably cheaper than building it from
+its state.
+"""
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import typing
+
+from mitmproxy import exceptions
+from mitmproxy import flow
+from mitmproxy.io import compat
+from mitmproxy.io import io
+from mitmproxy.io import tnetstring
+
+CHUNK_SIZE = 4 * 1024 * 1024
+# With processes=0, files smaller than this are read in-process.
+PARALLEL_THRESHOLD = 16 * 1024 * 1024
+# tnetstring.load rejects length prefixes with more than nine digits.
+MAX_PREFIX = 10
+
+
+def record_end(buf, pos: int) -> typing.Optional[int]:
+    """
+        Returns the end of the tnetstring that starts at pos,
+        or None if buf does not contain all of it yet.
+
+        Raises:
+            ValueError, if there's no valid length prefix at pos.
+    """
+    colon = buf.find(b":", pos, pos + MAX_PREFIX + 1)
+    if colon == -1:
+        if len(buf) - pos <= MAX_PREFIX:
+            return None
+        raise ValueError("not a tnetstring: missing or invalid length prefix")
+    length = buf[pos:colon]
+    if not length.isdigit():
+        raise ValueError("not a tnetstring: missing or invalid length prefix")
+    end = colon + int(length) + 2
+    if end > len(buf):
+        return None
+    return end
+
+
+def read_chunks(fo: typing.BinaryIO, chunk_size: int = CHUNK_SIZE) -> typing.Iterator[bytes]:
+    """
+        Splits a flow file into chunks of about chunk_size bytes that
+        consist of complete records. Records are not decoded.
+
+        Raises:
+            ValueError, if the file is not a sequence of tnetstrings.
+    """
+    buf = bytearray()
+    scanned = 0
+    while True:
+        data = fo.read(chunk_size)
+        buf += data
+        try:
+            while True:
+                end = record_end(buf, scanned)
+                if end is None:
+                    break
+                scanned = end
+        except ValueError:
+            if scanned:
+                yield bytes(buf[:scanned])
+            raise
+        if scanned and (scanned >= chunk_size or not data):
+            yield bytes(buf[:scanned])
+            del buf[:scanned]
+            scanned = 0
+        if not data:
+            break
+    if buf:
+        raise ValueError("not a tnetstring: incomplete record at end of file")
+
+
+def decode_chunk(data: bytes) -> typing.List[flow.Flow]:
+    """
+        Decodes all flows in a chunk. This runs in the worker processes.
+    """
+    states = []
+    pos = 0
+    while pos < len(data):
+        end = record_end(data, pos)
+        try:
+            loaded = tnetstring.loads(data[pos:end])
+        except ValueError:
+            raise exceptions.FlowReadException("Invalid data format.")
+        try:
+            states.append(compat.migrate_flow(loaded))
+        except ValueError as e:
+            raise exceptions.FlowReadException(str(e))
+        pos = end
+    return list(load_states(states))
+
+
+def load_states(states: typing.Iterable[dict]) -> typing.Iterator[flow.Flow]:
+    for state in states:
+        if state["type"] not in io.FLOW_TYPES:
+            raise exceptions.FlowReadException("Unknown flow type: {}".format(state["type"]))
+        yield io.FLOW_TYPES[state["type"]].from_state(state)
+
+
+def file_size(fo) -> typing.Optional[int]:
+    """
+        Returns the size of a regular file, or None for pipes and the like.
+        For gzipped files, this is the compressed size.
+    """
+    raw = getattr(fo, "fileobj", fo)
+    try:
+        st = os.fstat(raw.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    return st.st_size if st.st_size else None
+
+
+def default_processes(fo, processes: int) -> int:
+    """
+        Resolves processes=0 to one process per core for large files and 1 otherwise.
+    """
+    if processes:
+        return processes
+    size = file_size(fo)
+    if size is None or size < PARALLEL_THRESHOLD:
+        return 1
+    return os.cpu_count() or 1
+
+
+def process_pool(processes: int) -> concurrent.futures.ProcessPoolExecutor:
+    """
+        Returns a pool of decoding processes that are not forked from this
+        one. Forking a process that runs other threads, like the proxy does,
+        can leave locks held in the child.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    else:
+        context = multiprocessing.get_context("spawn")
+    return concurrent.futures.ProcessPoolExecutor(processes, mp_context=context)
+
+
+def close_reader(
+    chunks: typing.Generator[concurrent.futures.Future, None, None],
+    executor: concurrent.futures.Executor,
+) -> None:
+    """
+        Stops a ParallelFlowReader.chunks() generator and waits for the executor to shut down.
+    """
+    chunks.close()
+    executor.shutdown(wait=True)
+
+
+class ParallelFlowReader:
+    """
+        Reads flows like io.FlowReader, but decodes them in an executor,
+        usually a concurrent.futures.ProcessPoolExecutor.
+
+        At most max_pending chunks are decoded ahead of the consumer, which
+        bounds memory usage. Flows are yielded in file order.
+    """
+
+    def __init__(
+        self,
+        fo: typing.BinaryIO,
+        executor: concurrent.futures.Executor,
+        max_pending: int = 4,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> None:
+        self.fo = fo
+        self.executor = executor
+        self.max_pending = max_pending
+        self.chunk_size = chunk_size
+
+    def chunks(self) -> typing.Iterator[concurrent.futures.Future]:
+        """
+            Yields futures for lists of flows, in file order.
+            Chunks before a corrupted part of the file are yielded first.
+        """
+        pending: typing.Deque[concurrent.futures.Future] = collections.deque()
+        error = None
+        try:
+            try:
+                for chunk in read_chunks(self.fo, self.chunk_size):
+                    pending.append(self.executor.submit(decode_chunk, chunk))
+                    if len(pending) > self.max_pending:
+                        yield pending.popleft()
+            except ValueError:
+                error = exceptions.FlowReadException("Invalid data format.")
+            while pending:
+                yield pending.popleft()
+        finally:
+            # The consumer may stop early, don't decode chunks nobody waits for.
+            for f in pending:
+                f.cancel()
+        if error:
+            raise error
+
+    def stream(self) -> typing.Iterator[flow.Flow]:
+        for f in self.chunks():
+            yield from f.result()
+
+
+def read_flows(fo: typing.BinaryIO, processes: int = 0) -> typing.Iterator[flow.Flow]:
+    """
+        Yields flows from a file, decoding them on processes cores.
+        0 picks a sensible default based on the size of the file.
+    """
+    processes = default_processes(fo, processes)
+    if processes <= 1:
+        yield from io.FlowReader(fo).stream()
+        return
+    with process_pool(processes) as executor:
+        yield from ParallelFlowReader(fo, executor, max_pending=2 * processes).stream()
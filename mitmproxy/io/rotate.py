@@ -0,0 +1,145 @@
+import glob
+import gzip
+import os
+import re
+import shutil
+import threading
+import time
+import typing
+
+from mitmproxy.coretypes import basethread
+
+SEGMENT_DIGITS = 6
+
+
+def segment_path(path: str, n: int) -> str:
+    return "{}.{:0{}d}".format(path, n, SEGMENT_DIGITS)
+
+
+def segment_pattern(path: str) -> str:
+    """
+        A glob pattern that matches all segments of path, compressed or not.
+        Sorting the matches gives the segments in the order they were written.
+    """
+    return glob.escape(path) + "." + "[0-9]" * SEGMENT_DIGITS + "*"
+
+
+def segments(path: str) -> typing.List[typing.Tuple[int, str]]:
+    """
+        Returns (number, path) for all existing segments of path, ordered by number.
+    """
+    ret = []
+    seg = re.compile(r"\.(\d{%d})(\.gz)?$" % SEGMENT_DIGITS)
+    for p in glob.glob(segment_pattern(path)):
+        m = seg.match(p, len(path))
+        if m:
+            ret.append((int(m.group(1)), p))
+    return sorted(ret)
+
+
+def compress(path: str) -> str:
+    """
+        Gzips a finished segment and removes the original.
+        The compressed data is written to a hidden temporary file first,
+        so that an interrupted compression never leaves a truncated segment behind.
+    """
+    dirname, basename = os.path.split(path)
+    tmp = os.path.join(dirname, "." + basename + ".gz")
+    with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp, path + ".gz")
+    os.remove(path)
+    return path + ".gz"
+
+
+class RotatingFile:
+    """
+        A writable file object that splits a flow stream into numbered segment
+        files: path.000001, path.000002, ...
+
+        A new segment is started when the current one has grown beyond
+        max_size bytes or is older than max_age seconds. This is checked
+        before every write, and flow writers write each flow with a single
+        call, so flows never span segments. Finished segments are gzipped
+        in the background if compress is set.
+
+        Numbering continues after the last existing segment, so nothing is
+        ever overwritten.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: typing.Optional[int] = None,
+        max_age: typing.Optional[float] = None,
+        compress: bool = False,
+    ) -> None:
+        self.path = os.path.expanduser(path)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compress = compress
+        existing = segments(self.path)
+        self.number = existing[-1][0] if existing else 0
+        self.compressing: typing.List[threading.Thread] = []
+        self.closed = False
+        self._open()
+
+    def _open(self) -> None:
+        self.number += 1
+        self.current = segment_path(self.path, self.number)
+        self.fo = open(self.current, "xb")
+        self.size = 0
+        self.opened = time.monotonic()
+
+    def _finish(self) -> None:
+        self.fo.close()
+        if not self.size:
+            os.remove(self.current)
+        elif self.compress:
+            t = basethread.BaseThread(
+                "Compress {}".format(self.current),
+                target=compress,
+                args=(self.current,),
+                daemon=True,
+            )
+            t.start()
+            self.compressing.append(t)
+        self.compressing = [t for t in self.compressing if t.is_alive()]
+
+    def should_rotate(self) -> bool:
+        if not self.size:
+            return False
+        if self.max_size and self.size >= self.max_size:
+            return True
+        if self.max_age and time.monotonic() - self.opened >= self.max_age:
+            return True
+        return False
+
+    def rotate(self) -> None:
+        self._finish()
+        self._open()
+
+    def write(self, data: bytes) -> int:
+        if self.should_rotate():
+            self.rotate()
+        n = self.fo.write(data)
+        self.size += len(data)
+        return n
+
+    def flush(self) -> None:
+        self.fo.flush()
+
+    def fileno(self) -> int:
+        return self.fo.fileno()
+
+    def close(self) -> None:
+        """
+            Closes the current segment and waits until all segments are compressed.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._finish()
+        for t in self.compressing:
+            t.join()
+        self.compressing = []
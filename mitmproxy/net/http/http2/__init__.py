@@ -1,7 +1,8 @@
-from mitmproxy.net.http.http2.framereader import read_raw_frame, parse_frame
+from mitmproxy.net.http.http2.framereader import FrameReader, read_raw_frame, parse_frame
 from mitmproxy.net.http.http2.utils import parse_headers
 
 __all__ = [
+    "FrameReader",
     "read_raw_frame",
     "parse_frame",
     "parse_headers",
@@ -1,20 +1,85 @@
-import codecs
-
 import hyperframe.frame
 from mitmproxy import exceptions
 
+# b"HTT" interpreted as frame length, i.e. the peer speaks HTTP/1.1
+HTTP1_LENGTH = int.from_bytes(b"HTT", "big")
+
 
 def read_raw_frame(rfile):
     header = rfile.safe_read(9)
-    length = int(codecs.encode(header[:3], 'hex_codec'), 16)
+    length = int.from_bytes(header[:3], "big")
 
-    if length == 4740180:
+    if length == HTTP1_LENGTH:
         raise exceptions.HttpException("Length field looks more like HTTP/1.1:\n{}".format(rfile.read(-1)))
 
     body = rfile.safe_read(length)
     return [header, body]
 
 
+class FrameReader:
+    """
+    Reads HTTP/2 frames from a connection in large blocks.
+
+    In contrast to read_raw_frame, which needs two reads per frame, this pulls
+    everything that is available on the connection into a buffer and returns all
+    complete frames at once, so that they can be passed to h2 in a single
+    receive_data call. Incomplete frames are kept in the buffer until the next
+    read, i.e. the buffer never holds a complete frame in between calls and it is
+    safe to select() on the underlying connection.
+    """
+
+    def __init__(self, rfile, blocksize: int = 256 * 1024) -> None:
+        self.rfile = rfile
+        self.blocksize = blocksize
+        self._buf = bytearray()
+        # offset of the first frame header in _buf we have not looked at yet
+        self._scanned = 0
+
+    def _complete_frames(self) -> int:
+        """
+        Returns the length of the prefix of the buffer that consists of complete frames.
+        """
+        buf = self._buf
+        pos = self._scanned
+        while len(buf) - pos >= 9:
+            length = int.from_bytes(buf[pos:pos + 3], "big")
+            if length == HTTP1_LENGTH:
+                raise exceptions.HttpException(
+                    "Length field looks more like HTTP/1.1:\n{}".format(bytes(buf[pos:]) + self.rfile.read(-1))
+                )
+            if len(buf) - pos < 9 + length:
+                break
+            pos += 9 + length
+        self._scanned = pos
+        return pos
+
+    def read_frames(self) -> bytes:
+        """
+        Blocks until at least one complete frame is available and returns all
+        complete frames read so far.
+
+        Raises:
+            exceptions.TcpDisconnect, if the connection was closed before any data was read.
+            exceptions.TcpReadIncomplete, if the connection was closed within a frame.
+        """
+        end = self._complete_frames()
+        while not end:
+            data = self.rfile.read_some(self.blocksize)
+            if not data:
+                if self._buf:
+                    raise exceptions.TcpReadIncomplete(
+                        "Connection closed with {} bytes of an incomplete frame buffered".format(len(self._buf))
+                    )
+                raise exceptions.TcpDisconnect()
+            self._buf += data
+            end = self._complete_frames()
+
+        frames = bytes(self._buf[:end])
+        del self._buf[:end]
+        self._scanned = 0
+        return frames
+
+
 def parse_frame(header, body=None):
     if body is None:
         body = header[9:]
@@ -0,0 +1,128 @@
+import socket
+import threading
+import time
+import typing
+
+from mitmproxy.coretypes import basethread
+
+AddrInfo = typing.List[tuple]
+
+
+class Resolver:
+    """
+    A getaddrinfo() cache that is shared by all upstream connections.
+
+    The system resolver does not tell us the TTL of the records it returns, so
+    successful lookups are kept for a fixed time. Failed lookups are cached as
+    well, usually for a shorter time. Concurrent lookups for the same name are
+    coalesced into a single getaddrinfo() call.
+    """
+
+    def __init__(self, ttl: float = 0, negative_ttl: float = 0, max_entries: int = 4096) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # key -> (expiry time, result or exception)
+        self._cache: typing.Dict[tuple, typing.Tuple[float, typing.Union[AddrInfo, socket.gaierror]]] = {}
+        # lookups in progress, other threads asking for the same name wait for them.
+        self._lookups: typing.Dict[tuple, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._prefetches = threading.BoundedSemaphore(8)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.ttl or self.negative_ttl)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def _cached(self, key: tuple) -> typing.Optional[AddrInfo]:
+        """
+        Returns the cached result for key, raises the cached error, or returns None.
+        Must be called with the lock held.
+        """
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expiry, result = entry
+        if expiry < time.monotonic():
+            del self._cache[key]
+            return None
+        if isinstance(result, socket.gaierror):
+            raise socket.gaierror(*result.args)
+        return result
+
+    def _store(self, key: tuple, result: typing.Union[AddrInfo, socket.gaierror], ttl: float) -> None:
+        if not ttl:
+            return
+        with self._lock:
+            if len(self._cache) >= self.max_entries:
+                now = time.monotonic()
+                for k in [k for k, (expiry, _) in self._cache.items() if expiry < now]:
+                    del self._cache[k]
+                # still full: drop the oldest entries.
+                while len(self._cache) >= self.max_entries:
+                    del self._cache[next(iter(self._cache))]
+            self._cache[key] = (time.monotonic() + ttl, result)
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0) -> AddrInfo:
+        """
+        Like socket.getaddrinfo(), but answered from the cache if possible.
+        """
+        if not self.enabled:
+            return socket.getaddrinfo(host, port, family, type, proto, flags)
+
+        key = (host, port, family, type, proto, flags)
+        while True:
+            with self._lock:
+                result = self._cached(key)
+                if result is not None:
+                    return result
+                lookup = self._lookups.get(key)
+                if lookup is None:
+                    lookup = self._lookups[key] = threading.Event()
+                    break
+            # Somebody else is resolving this name already, wait for them and try again.
+            lookup.wait()
+
+        try:
+            result = socket.getaddrinfo(host, port, family, type, proto, flags)
+        except socket.gaierror as e:
+            self._store(key, e, self.negative_ttl)
+            raise
+        else:
+            self._store(key, result, self.ttl)
+            return result
+        finally:
+            with self._lock:
+                del self._lookups[key]
+            lookup.set()
+
+    def prefetch(self, host, port, family=0, type=socket.SOCK_STREAM) -> None:
+        """
+        Resolves a name in the background, so that a later getaddrinfo() call
+        with the same arguments is answered from the cache.
+        """
+        if not self.enabled:
+            return
+        key = (host, port, family, type, 0, 0)
+        with self._lock:
+            try:
+                if self._cached(key) is not None or key in self._lookups:
+                    return
+            except socket.gaierror:
+                return
+        # Don't pile up threads if the resolver is slow.
+        if not self._prefetches.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.getaddrinfo(host, port, family, type)
+            except (socket.error, UnicodeError):
+                pass
+            finally:
+                self._prefetches.release()
+
+        basethread.BaseThread("DNS prefetch ({}:{})".format(host, port), target=run, daemon=True).start()
@@ -1,5 +1,6 @@
 import os
 import errno
+import itertools
 import select
 import socket
 import sys
@@ -7,6 +8,7 @@ import threading
 import time
 import traceback
 
+import typing
 from typing import Optional  # noqa
 
 from mitmproxy.net import tls
@@ -72,6 +74,12 @@ class _FileLike:
 
 
 class Writer(_FileLike):
+    # Optional callable that is passed the number of bytes before they are written.
+    # It may block to limit the transfer rate, see _Connection.throttle.
+    throttle = None
+    # Throttled writes are split into chunks of this size, so that large writes
+    # are spread out evenly.
+    THROTTLE_CHUNK_SIZE = 16 * 1024
 
     def flush(self):
         """
@@ -87,6 +95,15 @@ class Writer(_FileLike):
         """
             May raise exceptions.TcpDisconnect
         """
+        if v and self.throttle:
+            for i in range(0, len(v), self.THROTTLE_CHUNK_SIZE):
+                chunk = v[i:i + self.THROTTLE_CHUNK_SIZE]
+                self.throttle(len(chunk))
+                self._write(chunk)
+            return None
+        return self._write(v)
+
+    def _write(self, v):
         if v:
             self.first_byte_timestamp = self.first_byte_timestamp or time.time()
             try:
@@ -103,6 +120,50 @@ class Writer(_FileLike):
 
 class Reader(_FileLike):
 
+    def _read_once(self, rlen, start):
+        """
+            Performs a single read of up to rlen bytes on the underlying file object.
+
+            Returns b"" if the connection was closed and None if the read should be
+            retried.
+        """
+        try:
+            data = self.o.read(rlen)
+        except SSL.ZeroReturnError:
+            # TLS connection was shut down cleanly
+            return b""
+        except (SSL.WantWriteError, SSL.WantReadError) as e:
+            # From the OpenSSL docs:
+            # If the underlying BIO is non-blocking, SSL_read() will also return when the
+            # underlying BIO could not satisfy the needs of SSL_read() to continue the
+            # operation. In this case a call to SSL_get_error with the return value of
+            # SSL_read() will yield SSL_ERROR_WANT_READ or SSL_ERROR_WANT_WRITE.
+            # We wait until the socket is ready and then retry.
+            timeout = self.o.gettimeout()
+            if timeout is not None:
+                timeout -= time.time() - start
+                if timeout <= 0:
+                    raise exceptions.TcpTimeout()
+            if isinstance(e, SSL.WantReadError):
+                ready = select.select([self.o], (), (), timeout)[0]
+            else:
+                ready = select.select((), [self.o], (), timeout)[1]
+            if not ready:
+                raise exceptions.TcpTimeout()
+            return None
+        except socket.timeout:
+            raise exceptions.TcpTimeout()
+        except socket.error as e:
+            raise exceptions.TcpDisconnect(str(e))
+        except SSL.SysCallError as e:
+            if e.args == (-1, 'Unexpected EOF'):
+                return b""
+            raise exceptions.TlsException(str(e))
+        except SSL.Error as e:
+            raise exceptions.TlsException(str(e))
+        self.first_byte_timestamp = self.first_byte_timestamp or time.time()
+        return data
+
     def read(self, length):
         """
             If length is -1, we read until connection closes.
@@ -114,33 +175,9 @@ class Reader(_FileLike):
                 rlen = self.BLOCKSIZE
             else:
                 rlen = length
-            try:
-                data = self.o.read(rlen)
-            except SSL.ZeroReturnError:
-                # TLS connection was shut down cleanly
-                break
-            except (SSL.WantWriteError, SSL.WantReadError):
-                # From the OpenSSL docs:
-                # If the underlying BIO is non-blocking, SSL_read() will also return when the
-                # underlying BIO could not satisfy the needs of SSL_read() to continue the
-                # operation. In this case a call to SSL_get_error with the return value of
-                # SSL_read() will yield SSL_ERROR_WANT_READ or SSL_ERROR_WANT_WRITE.
-                if (time.time() - start) < self.o.gettimeout():
-                    time.sleep(0.1)
-                    continue
-                else:
-                    raise exceptions.TcpTimeout()
-            except socket.timeout:
-                raise exceptions.TcpTimeout()
-            except socket.error as e:
-                raise exceptions.TcpDisconnect(str(e))
-            except SSL.SysCallError as e:
-                if e.args == (-1, 'Unexpected EOF'):
-                    break
-                raise exceptions.TlsException(str(e))
-            except SSL.Error as e:
-                raise exceptions.TlsException(str(e))
-            self.first_byte_timestamp = self.first_byte_timestamp or time.time()
+            data = self._read_once(rlen, start)
+            if data is None:
+                continue
             if not data:
                 break
             result += data
@@ -149,6 +186,18 @@ class Reader(_FileLike):
         self.add_log(result)
         return result
 
+    def read_some(self, length):
+        """
+            Reads up to length bytes with a single read on the underlying connection.
+            Blocks only until some data is available, returns b"" if the connection was closed.
+        """
+        start = time.time()
+        data = None
+        while data is None:
+            data = self._read_once(length, start)
+        self.add_log(data)
+        return data
+
     def readline(self, size=None):
         result = b''
         bytes_read = 0
@@ -227,6 +276,39 @@ def ssl_read_select(rlist, timeout):
     ] or select.select(rlist, (), (), timeout)[0]
 
 
+class Waker:
+    """
+    A socket pair that can be passed to select() alongside other connections,
+    so that other threads can interrupt a blocking select() call.
+    """
+
+    def __init__(self):
+        self._r, self._w = socket.socketpair()
+        self._r.setblocking(False)
+        self._w.setblocking(False)
+
+    def fileno(self):
+        return self._r.fileno()
+
+    def wake(self):
+        try:
+            self._w.send(b"\x00")
+        except OSError:
+            # The buffer is full (so select() will return anyway) or we are closed.
+            pass
+
+    def clear(self):
+        try:
+            while self._r.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def close(self):
+        self._r.close()
+        self._w.close()
+
+
 def close_socket(sock):
     """
     Does a hard close of a socket, without emitting a RST.
@@ -276,6 +358,7 @@ class _Connection:
 
     rbufsize = -1
     wbufsize = -1
+    _throttle = None
 
     def _makefile(self):
         """
@@ -288,6 +371,22 @@ class _Connection:
         # https://mail.python.org/pipermail/python-dev/2009-June/089986.html
         self.rfile = Reader(socket.SocketIO(self.connection, "rb"))
         self.wfile = Writer(socket.SocketIO(self.connection, "wb"))
+        self.wfile.throttle = self._throttle
+
+    @property
+    def throttle(self):
+        """
+        An optional callable that is passed the number of bytes before they are
+        written to the connection. It may block to limit the transfer rate.
+        The setting is kept if the connection is (re-)established later on.
+        """
+        return self._throttle
+
+    @throttle.setter
+    def throttle(self, throttle):
+        self._throttle = throttle
+        if isinstance(self.wfile, Writer):
+            self.wfile.throttle = throttle
 
     def __init__(self, connection):
         if connection:
@@ -354,9 +453,43 @@ class ConnectionCloser:
             self.conn.close()
 
 
+# Address families that recently failed with a network error, mapped to when we want to try them again.
+_broken_families: typing.Dict[int, float] = {}
+BROKEN_FAMILY_TIMEOUT = 10 * 60
+_BROKEN_FAMILY_ERRORS = {errno.ENETUNREACH, errno.EADDRNOTAVAIL, errno.EAFNOSUPPORT}
+
+
+def _address_family_failed(family, err):
+    if err in _BROKEN_FAMILY_ERRORS:
+        _broken_families[family] = time.monotonic() + BROKEN_FAMILY_TIMEOUT
+
+
+def sort_addresses(addresses):
+    """
+    Orders getaddrinfo() results for connection attempts as described in RFC 8305:
+    Alternate between address families, starting with the family of the first result.
+    Addresses of families that recently failed with a network error go last.
+    """
+    families = {}
+    for a in addresses:
+        families.setdefault(a[0], []).append(a)
+
+    now = time.monotonic()
+    working = [f for f in families if _broken_families.get(f, 0) < now]
+    broken = [f for f in families if f not in working]
+
+    ret = []
+    for group in (working, broken):
+        for attempt in itertools.zip_longest(*(families[f] for f in group)):
+            ret.extend(a for a in attempt if a is not None)
+    return ret
+
+
 class TCPClient(_Connection):
+    # Time to wait before starting the next connection attempt, see RFC 8305.
+    CONNECTION_ATTEMPT_DELAY = 0.25
 
-    def __init__(self, address, source_address=None, spoof_source_address=None):
+    def __init__(self, address, source_address=None, spoof_source_address=None, resolver=None):
         super().__init__(None)
         self.address = address
         self.source_address = source_address
@@ -364,6 +497,8 @@ class TCPClient(_Connection):
         self.server_certs = []
         self.sni = None
         self.spoof_source_address = spoof_source_address
+        # an optional mitmproxy.net.resolver.Resolver used instead of socket.getaddrinfo
+        self.resolver = resolver
 
     @property
     def ssl_verification_error(self) -> Optional[exceptions.InvalidCertificateException]:
@@ -412,43 +547,101 @@ class TCPClient(_Connection):
         # some parties (cuckoo sandbox) need to hook this
         return socket.socket(family, type, proto)
 
+    def _start_connect(self, addrinfo):
+        """
+        Creates a non-blocking socket for addrinfo and starts connecting it.
+        Returns the socket and whether it is connected already.
+        """
+        af, socktype, proto, canonname, sa = addrinfo
+        sock = self.makesocket(af, socktype, proto)
+        try:
+            if self.source_address:
+                sock.bind(self.source_address)
+            if self.spoof_source_address:
+                try:
+                    if not sock.getsockopt(socket.SOL_IP, socket.IP_TRANSPARENT):
+                        sock.setsockopt(socket.SOL_IP, socket.IP_TRANSPARENT, 1)  # pragma: windows no cover  pragma: osx no cover
+                except Exception as e:
+                    # socket.IP_TRANSPARENT might not be available on every OS and Python version
+                    raise exceptions.TcpException(
+                        "Failed to spoof the source address: " + str(e)
+                    )
+            sock.setblocking(False)
+            err = sock.connect_ex(sa)
+            # Windows reports WSAEWOULDBLOCK, which is not errno.EWOULDBLOCK there.
+            in_progress = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, getattr(errno, "WSAEWOULDBLOCK", None))
+            if err != 0 and err not in in_progress:
+                raise OSError(err, os.strerror(err))
+        except:
+            sock.close()
+            raise
+        return sock, err == 0
+
     def create_connection(self, timeout=None):
-        # Based on the official socket.create_connection implementation of Python 3.6.
-        # https://github.com/python/cpython/blob/3cc5817cfaf5663645f4ee447eaed603d2ad290a/Lib/socket.py
+        """
+        Connects to self.address.
+
+        If the name resolves to multiple addresses, connection attempts are
+        started one after another, CONNECTION_ATTEMPT_DELAY seconds apart,
+        alternating between IPv6 and IPv4 (RFC 8305, "Happy Eyeballs").
+        The first connection that succeeds is used. The timeout applies to
+        the whole process.
+        """
+        getaddrinfo = self.resolver.getaddrinfo if self.resolver else socket.getaddrinfo
+        addresses = sort_addresses(getaddrinfo(self.address[0], self.address[1], 0, socket.SOCK_STREAM))
+        if not addresses:
+            raise socket.error("getaddrinfo returns an empty list")  # pragma: no cover
 
+        deadline = time.monotonic() + timeout if timeout else None
+        pending = {}
         err = None
-        for res in socket.getaddrinfo(self.address[0], self.address[1], 0, socket.SOCK_STREAM):
-            af, socktype, proto, canonname, sa = res
-            sock = None
-            try:
-                sock = self.makesocket(af, socktype, proto)
-                if timeout:
-                    sock.settimeout(timeout)
-                if self.source_address:
-                    sock.bind(self.source_address)
-                if self.spoof_source_address:
+        next_attempt = 0.0
+        try:
+            while True:
+                now = time.monotonic()
+                if addresses and (not pending or now >= next_attempt):
+                    addrinfo = addresses.pop(0)
                     try:
-                        if not sock.getsockopt(socket.SOL_IP, socket.IP_TRANSPARENT):
-                            sock.setsockopt(socket.SOL_IP, socket.IP_TRANSPARENT, 1)  # pragma: windows no cover  pragma: osx no cover
-                    except Exception as e:
-                        # socket.IP_TRANSPARENT might not be available on every OS and Python version
-                        if sock is not None:
-                            sock.close()
-                        raise exceptions.TcpException(
-                            "Failed to spoof the source address: " + str(e)
-                        )
-                sock.connect(sa)
-                return sock
-
-            except socket.error as _:
-                err = _
-                if sock is not None:
+                        sock, connected = self._start_connect(addrinfo)
+                    except socket.error as e:
+                        err = e
+                        _address_family_failed(addrinfo[0], e.errno)
+                        continue
+                    if connected:
+                        return self._connected(sock, addrinfo[0], timeout)
+                    pending[sock] = addrinfo[0]
+                    next_attempt = now + self.CONNECTION_ATTEMPT_DELAY
+                    continue
+
+                if not pending:
+                    raise err
+
+                wait = max(next_attempt - now, 0) if addresses else None
+                if deadline is not None:
+                    if now >= deadline:
+                        raise socket.timeout("timed out")
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+
+                # Windows reports failed connection attempts as exceptional conditions.
+                _, w, x = select.select((), list(pending), list(pending), wait)
+                for sock in set(w) | set(x):
+                    family = pending.pop(sock)
+                    e = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if not e:
+                        return self._connected(sock, family, timeout)
                     sock.close()
+                    err = OSError(e, os.strerror(e))
+                    _address_family_failed(family, e)
+                    # Don't wait for the attempt delay if an attempt failed.
+                    next_attempt = now
+        finally:
+            for sock in pending:
+                sock.close()
 
-        if err is not None:
-            raise err
-        else:
-            raise socket.error("getaddrinfo returns an empty list")  # pragma: no cover
+    def _connected(self, sock, family, timeout):
+        _broken_families.pop(family, None)
+        sock.settimeout(timeout or socket.getdefaulttimeout())
+        return sock
 
     def connect(self):
         try:
@@ -546,7 +739,10 @@ class Counter:
 
 class TCPServer:
 
-    def __init__(self, address):
+    def __init__(self, address, reuse_port=False):
+        """
+            reuse_port: Set SO_REUSEPORT, so that several processes can listen on the same address.
+        """
         self.address = address
         self.__is_shut_down = threading.Event()
         self.__is_shut_down.set()
@@ -563,6 +759,8 @@ class TCPServer:
             # Only works if self.address == ""
             self.socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
             self.socket.setsockopt(IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
             self.socket.bind(self.address)
@@ -576,6 +774,8 @@ class TCPServer:
                 # Binding to an IPv6 + IPv4 socket failed, lets fall back to IPv4 only.
                 self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if reuse_port:
+                    self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
                 self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
                 self.socket.bind(self.address)
             except socket.error:
@@ -587,12 +787,16 @@ class TCPServer:
             # Binding to an IPv4 only socket failed, lets fall back to IPv6 only.
             self.socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
             self.socket.bind(self.address)
 
         self.address = self.socket.getsockname()
         self.socket.listen()
         self.handler_counter = Counter()
+        # wakes up serve_forever() on shutdown.
+        self.__waker = Waker()
 
     def connection_thread(self, connection, client_address):
         with self.handler_counter:
@@ -610,11 +814,11 @@ class TCPServer:
             finally:
                 close_socket(connection)
 
-    def serve_forever(self, poll_interval=0.1):
+    def serve_forever(self):
         self.__is_shut_down.clear()
         try:
             while not self.__shutdown_request:
-                r, w_, e_ = select.select([self.socket], [], [], poll_interval)
+                r, w_, e_ = select.select([self.socket, self.__waker], [], [])
                 if self.socket in r:
                     connection, client_address = self.socket.accept()
                     t = basethread.BaseThread(
@@ -640,8 +844,10 @@ class TCPServer:
 
     def shutdown(self):
         self.__shutdown_request = True
+        self.__waker.wake()
         self.__is_shut_down.wait()
         self.socket.close()
+        self.__waker.close()
         self.handle_shutdown()
 
     def handle_error(self, connection_, client_address, fp=sys.stderr):
@@ -243,12 +243,12 @@ class Frame:
         """
             Serialize the frame to wire format. Returns a string.
         """
-        b = bytes(self.header)
+        b = bytearray(bytes(self.header))
+        start = len(b)
+        b += self.payload
         if self.header.masking_key:
-            b += Masker(self.header.masking_key)(self.payload)
-        else:
-            b += self.payload
-        return b
+            Masker(self.header.masking_key).mask_inplace(0, b, start)
+        return bytes(b)
 
     @classmethod
     def from_file(cls, fp):
@@ -262,7 +262,9 @@ class Frame:
         payload = fp.safe_read(header.payload_length)
 
         if header.mask == 1 and header.masking_key:
-            payload = Masker(header.masking_key)(payload)
+            # The payload has to end up as bytes, mask() already masks
+            # large payloads in a single bytearray copy.
+            payload = Masker(header.masking_key).mask(0, payload)
 
         frame = cls(payload)
         frame.header = header
@@ -1,5 +1,15 @@
+import functools
 import sys
 
+# Below this size, XORing the payload as one big integer is faster than
+# four bytes.translate passes.
+TRANSLATE_THRESHOLD = 512
+
+
+@functools.lru_cache(maxsize=256)
+def _xor_table(k: int) -> bytes:
+    return bytes(b ^ k for b in range(256))
+
 
 class Masker:
     """
@@ -14,7 +24,7 @@ class Masker:
         self.key = key
         self.offset = 0
 
-    def mask(self, offset, data):
+    def _mask_int(self, offset, data):
         datalen = len(data)
         offset_mod = offset % 4
         data = int.from_bytes(data, sys.byteorder)
@@ -23,6 +33,29 @@ class Masker:
                                                     offset_mod], sys.byteorder)
         return (data ^ mask).to_bytes(datalen, sys.byteorder)
 
+    def mask_inplace(self, offset: int, buf: bytearray, start: int = 0) -> None:
+        """
+        Mask buf[start:] in place, e.g. the payload behind a frame header.
+
+        Every fourth byte is XORed with the same key byte, so we can mask each
+        of the four strides with a single bytes.translate call. This only needs
+        a temporary copy of a quarter of the payload at a time.
+        """
+        if len(buf) - start < TRANSLATE_THRESHOLD:
+            buf[start:] = self._mask_int(offset, buf[start:])
+            return
+        for i in range(4):
+            k = self.key[(offset + i) % 4]
+            if k:
+                buf[start + i::4] = buf[start + i::4].translate(_xor_table(k))
+
+    def mask(self, offset, data):
+        if len(data) < TRANSLATE_THRESHOLD:
+            return self._mask_int(offset, data)
+        buf = bytearray(data)
+        self.mask_inplace(offset, buf)
+        return bytes(buf)
+
     def __call__(self, data):
         ret = self.mask(self.offset, data)
         self.offset += len(ret)
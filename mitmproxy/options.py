@@ -9,6 +9,9 @@ CONF_BASENAME = "mitmproxy"
 LISTEN_PORT = 8080
 CONTENT_VIEW_LINES_CUTOFF = 512
 KEY_SIZE = 2048
+HTTP2_CONNECTION_WINDOW_SIZE = 16 * 1024 * 1024
+HTTP2_STREAM_WINDOW_SIZE = 1024 * 1024
+HTTP2_MAX_FRAME_SIZE = 16384
 
 
 class Options(optmanager.OptManager):
@@ -81,10 +84,33 @@ class Options(optmanager.OptManager):
             "listen_port", int, LISTEN_PORT,
             "Proxy service port."
         )
+        self.add_option(
+            "workers", int, 0,
+            """
+            Run this many mitmdump processes that share the proxy port using
+            SO_REUSEPORT. Each worker runs its own addons, and flows saved with
+            save_stream_file go to one file per worker. 0 runs a single process.
+            """
+        )
         self.add_option(
             "upstream_bind_address", str, "",
             "Address to bind upstream requests to."
         )
+        self.add_option(
+            "dns_cache_ttl", int, 60,
+            """
+            Number of seconds for which upstream host name lookups are cached,
+            0 to disable. The system resolver does not expose record TTLs, so
+            this applies to all names.
+            """
+        )
+        self.add_option(
+            "dns_negative_cache_ttl", int, 5,
+            """
+            Number of seconds for which failed upstream host name lookups are
+            cached, 0 to disable.
+            """
+        )
         self.add_option(
             "mode", str, "regular",
             """
@@ -110,11 +136,51 @@ class Options(optmanager.OptManager):
             with misbehaving servers.
             """
         )
+        self.add_option(
+            "http2_connection_window_size", int, HTTP2_CONNECTION_WINDOW_SIZE,
+            """
+            HTTP/2 connection-level flow control window we grant to clients and servers.
+            Bounds the amount of data that may be in flight or not yet forwarded on a
+            connection across all streams.
+            """
+        )
+        self.add_option(
+            "http2_stream_window_size", int, HTTP2_STREAM_WINDOW_SIZE,
+            """
+            HTTP/2 initial stream-level flow control window we grant to clients and
+            servers. Window space is only handed back once data has been consumed, so
+            this bounds the amount of data buffered for a streamed message.
+            """
+        )
+        self.add_option(
+            "http2_max_frame_size", int, HTTP2_MAX_FRAME_SIZE,
+            """
+            Largest HTTP/2 frame payload we allow clients and servers to send,
+            between 16384 and 16777215 bytes.
+            """
+        )
         self.add_option(
             "websocket", bool, True,
             "Enable/disable WebSocket support. "
             "WebSocket support is enabled by default.",
         )
+        self.add_option(
+            "websocket_messages_limit", int, 0,
+            """
+            Maximum number of messages kept in a WebSocket flow, 0 for no
+            limit. Once the limit is reached, the oldest messages are
+            discarded. Messages are always passed to addons before they are
+            discarded.
+            """
+        )
+        self.add_option(
+            "websocket_messages_size_limit", Optional[str], None,
+            """
+            Maximum total size of the messages kept in a WebSocket flow.
+            Understands k/m/g suffixes, i.e. 3m for 3 megabytes. Once the limit
+            is reached, the oldest messages are discarded.
+            """
+        )
         self.add_option(
             "rawtcp", bool, False,
             "Enable/disable experimental raw TCP support. TCP connections starting with non-ascii "
@@ -168,6 +234,30 @@ class Options(optmanager.OptManager):
             communication contents are printed to the log in verbose mode.
             """
         )
+        self.add_option(
+            "tcp_messages_limit", int, 0,
+            """
+            Maximum number of messages kept in a TCP flow, 0 for no limit. Once
+            the limit is reached, the oldest messages are discarded. Messages
+            are always passed to addons before they are discarded.
+            """
+        )
+        self.add_option(
+            "tcp_messages_size_limit", Optional[str], None,
+            """
+            Maximum total size of the messages kept in a TCP flow. Understands
+            k/m/g suffixes, i.e. 3m for 3 megabytes. Once the limit is reached,
+            the oldest messages are discarded.
+            """
+        )
+        self.add_option(
+            "tcp_coalesce_size", Optional[str], None,
+            """
+            Merge data that arrives back-to-back in the same direction into a
+            single TCP message of up to this size, instead of creating a
+            message for every read of up to 4 KB. Understands k/m/g suffixes.
+            """
+        )
         self.add_option(
             "content_view_lines_cutoff", int, CONTENT_VIEW_LINES_CUTOFF,
             """
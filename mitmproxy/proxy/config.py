@@ -7,6 +7,7 @@ from OpenSSL import crypto
 from mitmproxy import certs
 from mitmproxy import exceptions
 from mitmproxy import options as moptions
+from mitmproxy.net import resolver
 from mitmproxy.net import server_spec
 
 
@@ -38,6 +39,7 @@ class ProxyConfig:
         self.check_filter: typing.Optional[HostMatcher] = None
         self.check_tcp: typing.Optional[HostMatcher] = None
         self.upstream_server: typing.Optional[server_spec.ServerSpec] = None
+        self.resolver = resolver.Resolver()
         self.configure(options, set(options.keys()))
         options.changed.connect(self.configure)
 
@@ -55,6 +57,13 @@ class ProxyConfig:
         if "tcp_hosts" in updated:
             self.check_tcp = HostMatcher("tcp", options.tcp_hosts)
 
+        if "dns_cache_ttl" in updated or "dns_negative_cache_ttl" in updated:
+            if options.dns_cache_ttl < 0 or options.dns_negative_cache_ttl < 0:
+                raise exceptions.OptionsError("DNS cache TTLs must not be negative.")
+            self.resolver.ttl = options.dns_cache_ttl
+            self.resolver.negative_ttl = options.dns_negative_cache_ttl
+            self.resolver.clear()
+
         certstore_path = os.path.expanduser(options.confdir)
         if not os.path.exists(os.path.dirname(certstore_path)):
             raise exceptions.OptionsError(
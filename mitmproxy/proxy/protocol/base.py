@@ -1,3 +1,5 @@
+import typing
+
 from mitmproxy import exceptions
 from mitmproxy import connections
 from mitmproxy import controller  # noqa
@@ -120,11 +122,14 @@ class ServerConnectionMixin:
     def __make_server_conn(self, server_address):
         if self.config.options.spoof_source_address and self.config.options.upstream_bind_address == '':
             return connections.ServerConnection(
-                server_address, (self.ctx.client_conn.address[0], 0), True)
+                server_address, (self.ctx.client_conn.address[0], 0), True,
+                resolver=self.config.resolver
+            )
         else:
             return connections.ServerConnection(
                 server_address, (self.config.options.upstream_bind_address, 0),
-                self.config.options.spoof_source_address
+                self.config.options.spoof_source_address,
+                resolver=self.config.resolver
             )
 
     def set_server(self, address):
@@ -148,7 +153,10 @@ class ServerConnectionMixin:
         self.server_conn.close()
         self.channel.tell("serverdisconnect", self.server_conn)
 
+        throttle = self.server_conn.throttle
         self.server_conn = self.__make_server_conn(address)
+        # The replacement connection continues to be rate limited.
+        self.server_conn.throttle = throttle
 
     def connect(self):
         """
@@ -170,3 +178,27 @@ class ServerConnectionMixin:
                     repr(self.server_conn.address), str(e)
                 )
             )
+
+
+def trim_messages(messages: list, size: int, limit: int, size_limit: typing.Optional[int]) -> int:
+    """
+    Discards the oldest entries of a flow's message list, so that at most limit messages
+    (0 for no limit) with a total content size of at most size_limit (None for no limit) remain.
+
+    Args:
+        size: The total content size of all messages.
+
+    Returns:
+        The total content size of the remaining messages.
+    """
+    excess = 0
+    while excess < len(messages) and (
+        (limit and len(messages) - excess > limit) or
+        (size_limit is not None and size > size_limit)
+    ):
+        size -= len(messages[excess].content)
+        excess += 1
+
+    if excess:
+        del messages[:excess]
+    return size
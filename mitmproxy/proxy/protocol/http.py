@@ -256,6 +256,9 @@ class HttpLayer(base.Layer):
                     self.read_request_body(f.request)
                 )
                 f.request.timestamp_end = time.time()
+                if self.mode is HTTPMode.regular:
+                    # resolve the target while addons look at the request.
+                    self.config.resolver.prefetch(f.request.host, f.request.port)
                 self.channel.ask("http_connect", f)
 
                 if self.mode is HTTPMode.regular:
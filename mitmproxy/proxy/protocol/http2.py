@@ -1,7 +1,7 @@
 import threading
 import time
 import functools
-from typing import Dict, Callable, Any, List, Optional  # noqa
+from typing import Dict, Callable, Any, List, Optional, Tuple  # noqa
 
 import h2.exceptions
 from h2 import connection
@@ -25,15 +25,26 @@ class SafeH2Connection(connection.H2Connection):
     def __init__(self, conn, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.conn = conn
-        self.lock = threading.RLock()
+        # The condition doubles as the connection lock. Stream workers wait on it
+        # for flow control windows and stream slots, the connection loop notifies
+        # them whenever new frames have been processed.
+        self.lock = threading.Condition(threading.RLock())
+
+    def notify_all(self):
+        with self.lock:
+            self.lock.notify_all()
 
     def safe_acknowledge_received_data(self, acknowledged_size: int, stream_id: int):
         if acknowledged_size == 0:
             return
 
         with self.lock:
+            if self.state_machine.state == h2.connection.ConnectionState.CLOSED:
+                return
             self.acknowledge_received_data(acknowledged_size, stream_id)
-            self.conn.send(self.data_to_send())
+            data = self.data_to_send()
+            if data:
+                self.conn.send(data)
 
     def safe_reset_stream(self, stream_id: int, error_code: int):
         with self.lock:
@@ -43,6 +54,7 @@ class SafeH2Connection(connection.H2Connection):
                 # stream is already closed - good
                 pass
             self.conn.send(self.data_to_send())
+            self.lock.notify_all()
 
     def safe_update_settings(self, new_settings: Dict[int, Any]):
         with self.lock:
@@ -64,8 +76,9 @@ class SafeH2Connection(connection.H2Connection):
                 max_outbound_frame_size = self.max_outbound_frame_size
                 frame_chunk = chunk[position:position + max_outbound_frame_size]
                 if self.local_flow_control_window(stream_id) < len(frame_chunk):  # pragma: no cover
+                    # wait for a WINDOW_UPDATE, the connection loop wakes us up.
+                    self.lock.wait()
                     self.lock.release()
-                    time.sleep(0.1)
                     continue
                 self.send_data(stream_id, frame_chunk)
                 try:
@@ -79,10 +92,73 @@ class SafeH2Connection(connection.H2Connection):
             raise_zombie()
             self.end_stream(stream_id)
             self.conn.send(self.data_to_send())
+            self.lock.notify_all()
+
+
+class _StreamWorkerPool:
+
+    """
+    A set of reusable daemon threads that run the streams of one HTTP/2 connection.
+
+    Workers are only spawned if no idle worker is available and are kept around
+    for subsequent streams, so that a connection with many short-lived streams
+    does not pay for a new thread per stream. Streams never wait for a worker:
+    a stream may block for a long time, e.g. while it is intercepted, and must
+    not hold up the others. The number of workers is bounded by the number of
+    concurrent streams, which Http2Layer limits with MAX_CONCURRENT_STREAMS.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._jobs: queue.Queue[Optional[Callable[[], None]]] = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = 0
+        self._idle = 0
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def submit(self, fn: Callable[[], None]) -> None:
+        with self._lock:
+            if self._idle > 0:
+                self._idle -= 1
+            else:
+                self._workers += 1
+                t = basethread.BaseThread(
+                    "{} worker {}".format(self.name, self._workers),
+                    target=self._work,
+                )
+                t.daemon = True
+                t.start()
+            self._jobs.put(fn)
+
+    def _work(self):
+        while True:
+            fn = self._jobs.get()
+            if fn is None:
+                return
+            try:
+                fn()
+            finally:
+                with self._lock:
+                    self._idle += 1
+
+    def shutdown(self):
+        """
+        Let all workers exit once they have finished their current and all queued streams.
+        """
+        with self._lock:
+            for _ in range(self._workers):
+                self._jobs.put(None)
 
 
 class Http2Layer(base.Layer):
 
+    # Announced to the client as MAX_CONCURRENT_STREAMS. Every running stream
+    # has a worker thread, so this bounds the threads per connection.
+    max_concurrent_streams = 100
+
     if False:
         # mypy type hints
         client_conn: connections.ClientConnection = None
@@ -105,6 +181,7 @@ class Http2Layer(base.Layer):
         self.streams: Dict[int, Http2SingleStreamLayer] = dict()
         self.server_to_client_stream_ids: Dict[int, int] = dict([(0, 0)])
         self.connections: Dict[object, SafeH2Connection] = {}
+        self.stream_workers: Optional[_StreamWorkerPool] = None
 
         config = h2.config.H2Configuration(
             client_side=False,
@@ -124,14 +201,36 @@ class Http2Layer(base.Layer):
                 logger=self.H2ConnLogger("server", self.log))
             self.connections[self.server_conn] = SafeH2Connection(self.server_conn, config=config)
         self.connections[self.server_conn].initiate_connection()
+        self._configure_flow_control(self.connections[self.server_conn])
         self.server_conn.send(self.connections[self.server_conn].data_to_send())
 
     def _complete_handshake(self):
         preamble = self.client_conn.rfile.read(24)
         self.connections[self.client_conn].initiate_connection()
+        self.connections[self.client_conn].update_settings({
+            h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: self.max_concurrent_streams,
+        })
+        self._configure_flow_control(self.connections[self.client_conn])
         self.connections[self.client_conn].receive_data(preamble)
         self.client_conn.send(self.connections[self.client_conn].data_to_send())
 
+    def _configure_flow_control(self, h2_conn: SafeH2Connection):
+        """
+        Announce our window sizes and max frame size to the peer.
+
+        Received data is only acknowledged once the stream has consumed it (see
+        Http2SingleStreamLayer.read_request_body/read_response_body), so the windows
+        bound the amount of data buffered per stream and connection.
+        """
+        opts = self.config.options
+        h2_conn.update_settings({
+            h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: opts.http2_stream_window_size,
+            h2.settings.SettingCodes.MAX_FRAME_SIZE: opts.http2_max_frame_size,
+        })
+        increment = opts.http2_connection_window_size - h2_conn.inbound_flow_control_window
+        if increment > 0:
+            h2_conn.increment_flow_control_window(increment)
+
     def next_layer(self):  # pragma: no cover
         # WebSocket over HTTP/2?
         # CONNECT for proxying?
@@ -185,7 +284,7 @@ class Http2Layer(base.Layer):
             self.streams[eid].priority_depends_on = event.priority_updated.depends_on
             self.streams[eid].priority_weight = event.priority_updated.weight
             self.streams[eid].handled_priority_event = event.priority_updated
-        self.streams[eid].start()
+        self._start_stream(self.streams[eid])
         self.streams[eid].request_arrived.set()
         return True
 
@@ -198,28 +297,34 @@ class Http2Layer(base.Layer):
         return True
 
     def _handle_data_received(self, eid, event, source_conn):
+        h2_conn = self.connections[source_conn]
+        # Padding is never handed to the stream, acknowledge it right away.
+        unacknowledged = event.flow_controlled_length - len(event.data)
+
         bsl = human.parse_size(self.config.options.body_size_limit)
         if bsl and self.streams[eid].queued_data_length > bsl:
             self.streams[eid].kill()
-            self.connections[source_conn].safe_reset_stream(
+            h2_conn.safe_reset_stream(
                 event.stream_id,
                 h2.errors.ErrorCodes.REFUSED_STREAM
             )
             self.log("HTTP body too large. Limit is {}.".format(bsl), "info")
+            unacknowledged = event.flow_controlled_length
+        elif self.streams[eid].zombie:
+            # nobody is going to read this anymore
+            unacknowledged = event.flow_controlled_length
         else:
-            self.streams[eid].data_queue.put(event.data)
+            # The stream acknowledges the data once it has been consumed.
+            self.streams[eid].data_queue.put((event.data, h2_conn, event.stream_id))
             self.streams[eid].queued_data_length += len(event.data)
 
-        # always acknowledge receved data with a WINDOW_UPDATE frame
-        self.connections[source_conn].safe_acknowledge_received_data(
-            event.flow_controlled_length,
-            event.stream_id
-        )
+        # WINDOW_UPDATE frames are batched by h2's window manager.
+        h2_conn.safe_acknowledge_received_data(unacknowledged, event.stream_id)
         return True
 
     def _handle_stream_ended(self, eid):
         self.streams[eid].timestamp_end = time.time()
-        self.streams[eid].data_finished.set()
+        self.streams[eid].finish_data()
         return True
 
     def _handle_stream_reset(self, eid, event, is_server, other_conn):
@@ -234,8 +339,13 @@ class Http2Layer(base.Layer):
         return True
 
     def _handle_remote_settings_changed(self, event, other_conn):
-        new_settings = dict([(key, cs.new_value) for (key, cs) in event.changed_settings.items()])
-        self.connections[other_conn].safe_update_settings(new_settings)
+        new_settings = dict([
+            (key, cs.new_value) for (key, cs) in event.changed_settings.items()
+            # we announce our own flow control settings, see _configure_flow_control
+            if key not in (h2.settings.SettingCodes.INITIAL_WINDOW_SIZE, h2.settings.SettingCodes.MAX_FRAME_SIZE)
+        ])
+        if new_settings:
+            self.connections[other_conn].safe_update_settings(new_settings)
         return True
 
     def _handle_connection_terminated(self, event, is_server):
@@ -278,8 +388,8 @@ class Http2Layer(base.Layer):
         self.streams[event.pushed_stream_id].parent_stream_id = parent_eid
         self.streams[event.pushed_stream_id].timestamp_end = time.time()
         self.streams[event.pushed_stream_id].request_arrived.set()
-        self.streams[event.pushed_stream_id].request_data_finished.set()
-        self.streams[event.pushed_stream_id].start()
+        self.streams[event.pushed_stream_id].finish_data()
+        self._start_stream(self.streams[event.pushed_stream_id])
         return True
 
     def _handle_priority_updated(self, eid, event):
@@ -338,15 +448,22 @@ class Http2Layer(base.Layer):
         for stream in self.streams.values():
             stream.kill()
 
+    def _start_stream(self, stream):
+        self.stream_workers.submit(stream.run)
+
     def __call__(self):
         self._initiate_server_conn()
         self._complete_handshake()
 
+        self.stream_workers = _StreamWorkerPool(
+            "Http2Layer ({})".format(repr(self.client_conn.address)),
+        )
         conns = [c.connection for c in self.connections.keys()]
+        frame_readers = {c: http2.FrameReader(c.rfile) for c in self.connections.keys()}
 
         try:
             while True:
-                r = tcp.ssl_read_select(conns, 0.1)
+                r = tcp.ssl_read_select(conns, None)
                 for conn in r:
                     source_conn = self.client_conn if conn == self.client_conn.connection else self.server_conn
                     other_conn = self.server_conn if conn == self.client_conn.connection else self.client_conn
@@ -354,7 +471,7 @@ class Http2Layer(base.Layer):
 
                     with self.connections[source_conn].lock:
                         try:
-                            raw_frame = b''.join(http2.read_raw_frame(source_conn.rfile))
+                            raw_frames = frame_readers[source_conn].read_frames()
                         except:
                             # read frame failed: connection closed
                             self._kill_all_streams()
@@ -364,7 +481,7 @@ class Http2Layer(base.Layer):
                             self.log("HTTP/2 connection entered closed state already", "debug")
                             return
 
-                        incoming_events = self.connections[source_conn].receive_data(raw_frame)
+                        incoming_events = self.connections[source_conn].receive_data(raw_frames)
                         source_conn.send(self.connections[source_conn].data_to_send())
 
                         for event in incoming_events:
@@ -373,10 +490,15 @@ class Http2Layer(base.Layer):
                                 self._kill_all_streams()
                                 return
 
+                        # wake up stream workers waiting for window updates or free stream slots
+                        self.connections[source_conn].lock.notify_all()
+
                     self._cleanup_streams()
         except Exception as e:  # pragma: no cover
             self.log(repr(e), "info")
             self._kill_all_streams()
+        finally:
+            self.stream_workers.shutdown()
 
 
 def detect_zombie_stream(func):  # pragma: no cover
@@ -390,12 +512,15 @@ def detect_zombie_stream(func):  # pragma: no cover
     return wrapper
 
 
-class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer, basethread.BaseThread):
+# A chunk of received DATA, and the connection and stream id it needs to be acknowledged on.
+_DataChunk = Tuple[bytes, SafeH2Connection, int]
+
+
+class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer):
 
     def __init__(self, ctx, h2_connection, stream_id: int, request_headers: mitmproxy.net.http.Headers) -> None:
-        super().__init__(
-            ctx, name="Http2SingleStreamLayer-{}".format(stream_id)
-        )
+        super().__init__(ctx)
+        self.name = "Http2SingleStreamLayer-{}".format(stream_id)
         self.h2_connection = h2_connection
         self.zombie: Optional[float] = None
         self.client_stream_id: int = stream_id
@@ -408,12 +533,12 @@ class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer, basethread.BaseThr
         self.timestamp_end: Optional[float] = None
 
         self.request_arrived = threading.Event()
-        self.request_data_queue: queue.Queue[bytes] = queue.Queue()
+        self.request_data_queue: queue.Queue[Optional[_DataChunk]] = queue.Queue()
         self.request_queued_data_length = 0
         self.request_data_finished = threading.Event()
 
         self.response_arrived = threading.Event()
-        self.response_data_queue: queue.Queue[bytes] = queue.Queue()
+        self.response_data_queue: queue.Queue[Optional[_DataChunk]] = queue.Queue()
         self.response_queued_data_length = 0
         self.response_data_finished = threading.Event()
 
@@ -431,6 +556,29 @@ class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer, basethread.BaseThr
             self.request_arrived.set()
             self.response_arrived.set()
             self.response_data_finished.set()
+            for data_queue, conn in ((self.request_data_queue, self.client_conn), (self.response_data_queue, self.server_conn)):
+                # Hold the connection lock so that the connection loop either queues data
+                # before we drain the queue or sees that we are a zombie.
+                with self.connections[conn].lock:
+                    # hand back the flow control window of data we are never going to read.
+                    while True:
+                        try:
+                            chunk = data_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if chunk is not None:
+                            data, h2_conn, stream_id = chunk
+                            h2_conn.safe_acknowledge_received_data(len(data), stream_id)
+                    # wake up readers blocked on the data queue and senders blocked on the connection.
+                    data_queue.put(None)
+                    self.connections[conn].lock.notify_all()
+
+    def finish_data(self):
+        """
+        Marks the current message as complete. Called by the connection loop on END_STREAM.
+        """
+        self.data_queue.put(None)
+        self.data_finished.set()
 
     def connect(self):  # pragma: no cover
         raise exceptions.Http2ProtocolException("HTTP2 layer should already have a connection.")
@@ -501,22 +649,36 @@ class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer, basethread.BaseThr
             timestamp_end=self.timestamp_end,
         )
 
-    @detect_zombie_stream
-    def read_request_body(self, request):
-        if not request.stream:
-            self.request_data_finished.wait()
-
+    def _read_data_queue(self, data_queue):
         while True:
-            try:
-                yield self.request_data_queue.get(timeout=0.1)
-            except queue.Empty:  # pragma: no cover
-                pass
-            if self.request_data_finished.is_set():
+            chunk = data_queue.get()
+            if chunk is None:
+                # end of message or stream killed
                 self.raise_zombie()
-                while self.request_data_queue.qsize() > 0:
-                    yield self.request_data_queue.get()
-                break
-            self.raise_zombie()
+                return
+            data, h2_conn, stream_id = chunk
+            try:
+                yield data
+            except GeneratorExit:
+                # The consumer stopped early. Return the credit of everything
+                # that is already queued, it would be lost for the connection otherwise.
+                while True:
+                    try:
+                        chunk = data_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if chunk is not None:
+                        chunk[1].safe_acknowledge_received_data(len(chunk[0]), chunk[2])
+                raise
+            finally:
+                # Only open the window once the data has been consumed, i.e. buffered by the
+                # HTTP layer or forwarded for streamed messages. This gives us backpressure
+                # and bounds the amount of data queued for a stream by the stream window.
+                h2_conn.safe_acknowledge_received_data(len(data), stream_id)
+
+    @detect_zombie_stream
+    def read_request_body(self, request):
+        yield from self._read_data_queue(self.request_data_queue)
 
     @detect_zombie_stream
     def send_request_headers(self, request):
@@ -531,8 +693,8 @@ class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer, basethread.BaseThr
             max_streams = self.connections[self.server_conn].remote_settings.max_concurrent_streams
             if self.connections[self.server_conn].open_outbound_streams + 1 >= max_streams:
                 # wait until we get a free slot for a new outgoing stream
+                self.connections[self.server_conn].lock.wait()
                 self.connections[self.server_conn].lock.release()
-                time.sleep(0.1)
                 continue
 
             # keep the lock
@@ -618,17 +780,7 @@ class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer, basethread.BaseThr
 
     @detect_zombie_stream
     def read_response_body(self, request, response):
-        while True:
-            try:
-                yield self.response_data_queue.get(timeout=0.1)
-            except queue.Empty:  # pragma: no cover
-                pass
-            if self.response_data_finished.is_set():
-                self.raise_zombie()
-                while self.response_data_queue.qsize() > 0:
-                    yield self.response_data_queue.get()
-                break
-            self.raise_zombie()
+        yield from self._read_data_queue(self.response_data_queue)
 
     @detect_zombie_stream
     def send_response_headers(self, response):
@@ -650,7 +802,7 @@ class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer, basethread.BaseThr
         )
 
     def __call__(self):  # pragma: no cover
-        raise EnvironmentError('Http2SingleStreamLayer must be run as thread')
+        raise EnvironmentError('Http2SingleStreamLayer must be run by Http2Layer.stream_workers')
 
     def run(self):
         layer = httpbase.HttpLayer(self, self.mode)
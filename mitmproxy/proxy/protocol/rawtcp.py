@@ -1,16 +1,28 @@
+import os
+import select
 import socket
 
 from OpenSSL import SSL
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
 import mitmproxy.net.tcp
 from mitmproxy import tcp
 from mitmproxy import flow
 from mitmproxy import exceptions
 from mitmproxy.proxy.protocol import base
+from mitmproxy.utils import human
 
 
 class RawTCPLayer(base.Layer):
     chunk_size = 4096
+    # Nobody looks at passthrough traffic, so we can move it in much larger chunks.
+    passthrough_chunk_size = 256 * 1024
+    # Move passthrough traffic between plain sockets with splice(2) where available.
+    use_splice = hasattr(os, "splice")
 
     def __init__(self, ctx, ignore=False):
         self.ignore = ignore
@@ -23,7 +35,18 @@ class RawTCPLayer(base.Layer):
             f = tcp.TCPFlow(self.client_conn, self.server_conn, self)
             self.channel.ask("tcp_start", f)
 
-        buf = memoryview(bytearray(self.chunk_size))
+        options = self.config.options
+        coalesce_size = None
+        if self.ignore:
+            chunk_size = self.passthrough_chunk_size
+        else:
+            coalesce_size = human.parse_size(options.tcp_coalesce_size)
+            chunk_size = coalesce_size or self.chunk_size
+        buf = memoryview(bytearray(chunk_size))
+        messages_size = 0
+        # Looked up once per connection, not for every chunk.
+        handled = not self.ignore and self.channel.master.addons.has_handler("tcp_message")
+        messages_size_limit = human.parse_size(options.tcp_messages_size_limit)
 
         client = self.client_conn.connection
         server = self.server_conn.connection
@@ -35,12 +58,15 @@ class RawTCPLayer(base.Layer):
                 SSL._lib.SSL_clear_mode(conn._ssl, SSL._lib.SSL_MODE_AUTO_RETRY)
 
         try:
+            if self.ignore and self.use_splice and not any(isinstance(c, SSL.Connection) for c in conns):
+                return self._splice(conns)
+
             while not self.channel.should_exit.is_set():
                 r = mitmproxy.net.tcp.ssl_read_select(conns, 10)
                 for conn in r:
                     dst = server if conn == client else client
                     try:
-                        size = conn.recv_into(buf, self.chunk_size)
+                        size = conn.recv_into(buf, chunk_size)
                     except (SSL.WantReadError, SSL.WantWriteError):
                         continue
                     if not size:
@@ -57,10 +83,24 @@ class RawTCPLayer(base.Layer):
                             return
                         continue
 
+                    if self.ignore:
+                        dst.sendall(buf[:size])
+                        continue
+
+                    if coalesce_size:
+                        size = self._coalesce(conn, buf, size, coalesce_size)
+
                     tcp_message = tcp.TCPMessage(dst == server, buf[:size].tobytes())
-                    if not self.ignore:
-                        f.messages.append(tcp_message)
+                    f.messages.append(tcp_message)
+                    if handled:
                         self.channel.ask("tcp_message", f)
+                    # Trim only after the event, so that addons see every message.
+                    messages_size = base.trim_messages(
+                        f.messages,
+                        messages_size + len(tcp_message.content),
+                        options.tcp_messages_limit,
+                        messages_size_limit,
+                    )
                     dst.sendall(tcp_message.content)
 
         except (socket.error, exceptions.TcpException, SSL.Error) as e:
@@ -70,3 +110,69 @@ class RawTCPLayer(base.Layer):
         finally:
             if not self.ignore:
                 self.channel.tell("tcp_end", f)
+
+    def _coalesce(self, conn, buf, size, limit):
+        """
+        Reads whatever else is immediately available on the connection into buf,
+        up to a total of limit bytes. Returns the new number of bytes in buf.
+        """
+        while size < limit and mitmproxy.net.tcp.ssl_read_select([conn], 0):
+            try:
+                n = conn.recv_into(buf[size:], limit - size)
+            except (SSL.WantReadError, SSL.WantWriteError):
+                break
+            if not n:
+                # The connection has been closed, which we notice on the next read.
+                break
+            size += n
+        return size
+
+    def _splice(self, conns):
+        """
+        Relay data between two plain sockets through a pipe with splice(2),
+        so that it never needs to be copied to userspace.
+        """
+        client, server = conns
+        pipes = {}
+        try:
+            for conn in conns:
+                pipes[conn] = os.pipe()
+                if hasattr(fcntl, "F_SETPIPE_SZ"):
+                    try:
+                        fcntl.fcntl(pipes[conn][1], fcntl.F_SETPIPE_SZ, self.passthrough_chunk_size)
+                    except OSError:  # pragma: no cover
+                        # larger than /proc/sys/fs/pipe-max-size, keep the default.
+                        pass
+
+            while not self.channel.should_exit.is_set():
+                r, _, _ = select.select(conns, (), (), 10)
+                for conn in r:
+                    dst = server if conn == client else client
+                    pipe_r, pipe_w = pipes[conn]
+                    try:
+                        size = os.splice(
+                            conn.fileno(), pipe_w, self.passthrough_chunk_size,
+                            flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+                        )
+                    except BlockingIOError:
+                        continue
+                    if not size:
+                        conns.remove(conn)
+                        dst.shutdown(socket.SHUT_WR)
+                        if len(conns) == 0:
+                            return
+                        continue
+
+                    while size:
+                        try:
+                            size -= os.splice(
+                                pipe_r, dst.fileno(), size,
+                                flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+                            )
+                        except BlockingIOError:
+                            if not select.select((), (dst,), (), 10)[1]:
+                                raise exceptions.TcpTimeout()
+        finally:
+            for pipe_r, pipe_w in pipes.values():
+                os.close(pipe_r)
+                os.close(pipe_w)
@@ -13,8 +13,8 @@ from mitmproxy import exceptions
 from mitmproxy import flow
 from mitmproxy.proxy.protocol import base
 from mitmproxy.net import tcp
-from mitmproxy.net import websockets
 from mitmproxy.websocket import WebSocketFlow, WebSocketMessage
+from mitmproxy.utils import human
 from mitmproxy.utils import strutils
 
 
@@ -50,6 +50,9 @@ class WebSocketLayer(base.Layer):
 
         self.client_frame_buffer = []
         self.server_frame_buffer = []
+        self.messages_size = 0
+        # Looked up once per connection, not for every message.
+        self.messages_size_limit = human.parse_size(self.config.options.websocket_messages_size_limit)
 
         self.connections: dict[object, WSConnection] = {}
 
@@ -111,6 +114,7 @@ class WebSocketLayer(base.Layer):
             length = len(websocket_message.content)
             self.flow.messages.append(websocket_message)
             self.channel.ask("websocket_message", self.flow)
+            self._trim_messages(websocket_message)
 
             if not self.flow.stream and not websocket_message.killed:
                 def get_chunk(payload):
@@ -137,6 +141,18 @@ class WebSocketLayer(base.Layer):
             other_conn.send(data)
         return True
 
+    def _trim_messages(self, websocket_message):
+        """
+            Discard the oldest messages of the flow once the configured limits are exceeded.
+            This is done after the websocket_message event, so addons always see every message.
+        """
+        self.messages_size = base.trim_messages(
+            self.flow.messages,
+            self.messages_size + len(websocket_message.content),
+            self.config.options.websocket_messages_limit,
+            self.messages_size_limit,
+        )
+
     def _handle_ping(self, event, source_conn, other_conn, is_server):
         # Use event.response to create the approprate Pong response
         data = self.connections[other_conn].send(Ping())
@@ -185,7 +201,11 @@ class WebSocketLayer(base.Layer):
         self.handshake_flow.metadata['websocket_flow'] = self.flow.id
         self.channel.ask("websocket_start", self.flow)
 
+        # inject_message() wakes us up, so that we can block until there is something to do.
+        waker = tcp.Waker()
+        self.flow._inject_waker = waker
         conns = [c.connection for c in self.connections.keys()]
+        conns.append(waker)
         close_received = False
 
         try:
@@ -193,15 +213,20 @@ class WebSocketLayer(base.Layer):
                 self._inject_messages(self.client_conn, self.flow._inject_messages_client)
                 self._inject_messages(self.server_conn, self.flow._inject_messages_server)
 
-                r = tcp.ssl_read_select(conns, 0.1)
+                r = tcp.ssl_read_select(conns, None)
                 for conn in r:
+                    if conn is waker:
+                        waker.clear()
+                        continue
                     source_conn = self.client_conn if conn == self.client_conn.connection else self.server_conn
                     other_conn = self.server_conn if conn == self.client_conn.connection else self.client_conn
                     is_server = (source_conn == self.server_conn)
 
-                    frame = websockets.Frame.from_file(source_conn.rfile)
-                    data = self.connections[source_conn].receive_data(bytes(frame))
-                    source_conn.send(data)
+                    # wsproto takes care of frame boundaries, so we can pass on whatever we receive.
+                    data = source_conn.rfile.read_some(source_conn.rfile.BLOCKSIZE)
+                    if not data:
+                        raise exceptions.TcpDisconnect()
+                    self.connections[source_conn].receive_data(data)
 
                     if close_received:
                         return
@@ -215,5 +240,7 @@ class WebSocketLayer(base.Layer):
             self.flow.error = flow.Error("WebSocket connection closed unexpectedly by {}: {}".format(s, repr(e)))
             self.channel.tell("websocket_error", self.flow)
         finally:
+            self.flow._inject_waker = None
+            waker.close()
             self.flow.ended = True
             self.channel.tell("websocket_end", self.flow)
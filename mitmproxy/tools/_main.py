@@ -11,6 +11,8 @@ import signal
 import typing
 
 from mitmproxy.tools import cmdline
+from mitmproxy.tools.workers import Supervisor
+from mitmproxy.utils import workers
 from mitmproxy import exceptions, master
 from mitmproxy import options
 from mitmproxy import optmanager
@@ -60,11 +62,14 @@ def run(
         master_cls: typing.Type[master.Master],
         make_parser: typing.Callable[[options.Options], argparse.ArgumentParser],
         arguments: typing.Sequence[str],
-        extra: typing.Callable[[typing.Any], dict] = None
+        extra: typing.Callable[[typing.Any], dict] = None,
+        supports_workers: bool = False,
 ) -> master.Master:  # pragma: no cover
     """
         extra: Extra argument processing callable which returns a dict of
         options.
+        supports_workers: Whether the tool can run in several processes,
+        see the workers option.
     """
     debug.register_info_dumpers()
 
@@ -92,6 +97,10 @@ def run(
             os.path.join(opts.confdir, "config.yml"),
         )
         pconf = process_options(parser, opts, args)
+        if opts.workers > 1 and workers.worker_id() is None and not (args.options or args.commands):
+            if not supports_workers:
+                raise exceptions.OptionsError("The workers option is only supported by mitmdump.")
+            sys.exit(Supervisor(opts.workers, arguments).run())
         server: typing.Any = None
         if pconf.options.server:
             try:
@@ -163,7 +172,7 @@ def mitmdump(args=None) -> typing.Optional[int]:  # pragma: no cover
             )
         return {}
 
-    m = run(dump.DumpMaster, cmdline.mitmdump, args, extra)
+    m = run(dump.DumpMaster, cmdline.mitmdump, args, extra, supports_workers=True)
     if m and m.errorcheck.has_errored:  # type: ignore
         return 1
     return None
@@ -89,6 +89,10 @@ def common_options(parser, opts):
     group = parser.add_argument_group("Set Headers")
     opts.make_parser(group, "setheaders", metavar="PATTERN", short="H")
 
+    # Throttling
+    group = parser.add_argument_group("Throttling")
+    opts.make_parser(group, "throttle", metavar="PATTERN")
+
 
 def mitmproxy(opts):
     parser = argparse.ArgumentParser(usage="%(prog)s [options]")
@@ -110,6 +114,7 @@ def mitmdump(opts):
 
     common_options(parser, opts)
     opts.make_parser(parser, "flow_detail", metavar = "LEVEL")
+    opts.make_parser(parser, "workers", metavar = "N")
     parser.add_argument(
         'filter_args',
         nargs="...",
@@ -220,6 +220,8 @@ class StatusBar(urwid.WidgetWrap):
             r.append("[")
             r.append(("heading_key", "splayback"))
             r.append(":%s]" % sreplay)
+        if self.master.commands.call("readfile.reading"):
+            r.append("[loading:%s%%]" % self.master.commands.call("readfile.progress"))
         if self.master.options.ignore_hosts:
             r.append("[")
             r.append(("heading_key", "I"))
@@ -1,7 +1,7 @@
 from mitmproxy import addons
 from mitmproxy import options
 from mitmproxy import master
-from mitmproxy.addons import dumper, termlog, termstatus, keepserving, readfile
+from mitmproxy.addons import dumper, termlog, termstatus, keepserving, readfile, workerstats
 
 
 class ErrorCheck:
@@ -31,5 +31,6 @@ class DumpMaster(master.Master):
         self.addons.add(
             keepserving.KeepServing(),
             readfile.ReadFileStdin(),
+            workerstats.WorkerStats(),
             self.errorcheck
         )
@@ -1,13 +1,16 @@
 import asyncio
+import collections
 import hashlib
+import itertools
 import json
 import logging
 import os.path
 import re
 from io import BytesIO
-from typing import ClassVar, Optional
+from typing import ClassVar, Dict, Optional, Set, Tuple
 
 import tornado.escape
+import tornado.httputil
 import tornado.web
 import tornado.websocket
 
@@ -21,6 +24,25 @@ from mitmproxy import io
 from mitmproxy import log
 from mitmproxy import optmanager
 from mitmproxy import version
+from mitmproxy.io import parallel
+from mitmproxy.net import http as net_http
+
+
+def content_info(message: net_http.Message) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Returns the length and SHA-256 hash of the raw message content.
+
+    The hash is cached on the message until its content is replaced,
+    so that flows which are sent repeatedly are only hashed once.
+    """
+    content = message.raw_content
+    if not content:
+        return None, None
+    cached = getattr(message, "_content_hash", None)
+    if cached is None or cached[0] is not content:
+        cached = (content, hashlib.sha256(content).hexdigest())
+        message._content_hash = cached  # type: ignore
+    return len(content), cached[1]
 
 
 def flow_to_json(flow: mitmproxy.flow.Flow) -> dict:
@@ -51,15 +73,8 @@ def flow_to_json(flow: mitmproxy.flow.Flow) -> dict:
         f["error"] = flow.error.get_state()
 
     if isinstance(flow, http.HTTPFlow):
-        content_length: Optional[int]
-        content_hash: Optional[str]
         if flow.request:
-            if flow.request.raw_content:
-                content_length = len(flow.request.raw_content)
-                content_hash = hashlib.sha256(flow.request.raw_content).hexdigest()
-            else:
-                content_length = None
-                content_hash = None
+            content_length, content_hash = content_info(flow.request)
             f["request"] = {
                 "method": flow.request.method,
                 "scheme": flow.request.scheme,
@@ -76,12 +91,7 @@ def flow_to_json(flow: mitmproxy.flow.Flow) -> dict:
                 "pretty_host": flow.request.pretty_host,
             }
         if flow.response:
-            if flow.response.raw_content:
-                content_length = len(flow.response.raw_content)
-                content_hash = hashlib.sha256(flow.response.raw_content).hexdigest()
-            else:
-                content_length = None
-                content_hash = None
+            content_length, content_hash = content_info(flow.response)
             f["response"] = {
                 "http_version": flow.response.http_version,
                 "status_code": flow.response.status_code,
@@ -99,6 +109,55 @@ def flow_to_json(flow: mitmproxy.flow.Flow) -> dict:
     return f
 
 
+def json_diff(old: dict, new: dict) -> dict:
+    """
+    Returns the keys of new that differ from old. Nested dicts are diffed
+    recursively, removed keys are set to None.
+    The web UI merges these diffs into its copy of the flow.
+    """
+    diff = {}
+    for k, v in new.items():
+        if k not in old:
+            diff[k] = v
+        elif old[k] != v:
+            if isinstance(v, dict) and isinstance(old[k], dict):
+                diff[k] = json_diff(old[k], v)
+            else:
+                diff[k] = v
+    for k in old.keys() - new.keys():
+        diff[k] = None
+    return diff
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a Range header with a single byte range into (start, end),
+    where end is exclusive. Returns None if the range is not satisfiable.
+
+    Raises:
+        ValueError, if the header is malformed or has multiple ranges.
+    """
+    unit, _, spec = header.partition("=")
+    first, sep, last = spec.strip().partition("-")
+    if unit.strip() != "bytes" or not sep or not (first or last):
+        raise ValueError("Unsupported range: {}".format(header))
+    if not all(x.isdigit() for x in (first, last) if x):
+        raise ValueError("Unsupported range: {}".format(header))
+    if first:
+        start = int(first)
+        end = int(last) + 1 if last else size
+        if last and end <= start:
+            raise ValueError("Invalid range: {}".format(header))
+    else:
+        start = max(size - int(last), 0)
+        end = size
+        if not int(last):
+            return None
+    if start >= size:
+        return None
+    return start, min(end, size)
+
+
 def logentry_to_json(e: log.LogEntry) -> dict:
     return {
         "id": id(e),  # we just need some kind of id.
@@ -204,11 +263,19 @@ class WebSocketEventBroadcaster(tornado.websocket.WebSocketHandler):
     def on_close(self):
         self.connections.remove(self)
 
+    def wants(self, resource: str, cmd: str, data=None) -> bool:
+        """
+        Returns whether this client should receive a broadcast message.
+        """
+        return True
+
     @classmethod
     def broadcast(cls, **kwargs):
         message = json.dumps(kwargs, ensure_ascii=False).encode("utf8", "surrogateescape")
 
         for conn in cls.connections:
+            if not conn.wants(**kwargs):
+                continue
             try:
                 conn.write_message(message)
             except Exception:  # pragma: no cover
@@ -217,32 +284,217 @@ class WebSocketEventBroadcaster(tornado.websocket.WebSocketHandler):
 
 class ClientConnection(WebSocketEventBroadcaster):
     connections: ClassVar[set] = set()
+    # The ids of the flows the client displays, or None for all flows.
+    flow_window: Optional[Set[str]] = None
+
+    def open(self):
+        super().open()
+        # Clients that can merge partial flow updates opt in with /updates?diffs=1.
+        self.diffs = self.get_query_argument("diffs", "").lower() in ("1", "true")
+        # flow id -> the JSON state this client has last been sent
+        self.sent: Dict[str, dict] = {}
+
+    def on_message(self, message):
+        """
+        Clients that only display a window of the flow list can subscribe to
+        updates for those flows with
+        {"resource": "flows", "cmd": "subscribe", "ids": [...]}. The first
+        update of a flow that enters the window contains the whole flow.
+        "ids": null subscribes to all flows.
+        """
+        try:
+            msg = json.loads(message)
+            if msg["resource"] != "flows" or msg["cmd"] != "subscribe":
+                raise ValueError("Unknown message.")
+            ids = msg["ids"]
+            self.flow_window = None if ids is None else {str(i) for i in ids}
+        except (ValueError, KeyError, TypeError) as e:
+            logging.debug("Invalid client message: %s", e)
+
+    def wants(self, resource: str, cmd: str, data=None) -> bool:
+        if resource == "flows" and cmd == "update" and self.flow_window is not None:
+            return data["id"] in self.flow_window
+        return True
+
+    @staticmethod
+    def _flow_message(cmd: str, data: dict) -> bytes:
+        message = dict(resource="flows", cmd=cmd, data=data)
+        return json.dumps(message, ensure_ascii=False).encode("utf8", "surrogateescape")
+
+    @classmethod
+    def broadcast_flow(cls, cmd: str, data: dict) -> None:
+        """
+        Sends a flow "add" or "update" to all clients. Clients that have
+        opted in to diffs are only sent the parts of an update that differ
+        from the state they have last been sent.
+        """
+        full = None
+        for conn in cls.connections:
+            if not conn.wants("flows", cmd, data):
+                # The client misses this update, so the next one must be complete.
+                conn.sent.pop(data["id"], None)
+                continue
+            last = None
+            if conn.diffs:
+                last = conn.sent.get(data["id"])
+                conn.sent[data["id"]] = data
+            if last is None:
+                if full is None:
+                    full = cls._flow_message(cmd, data)
+                message = full
+            else:
+                diff = json_diff(last, data)
+                if not diff:
+                    continue
+                diff["id"] = data["id"]
+                message = cls._flow_message(cmd, diff)
+            try:
+                conn.write_message(message)
+            except Exception:  # pragma: no cover
+                logging.error("Error sending message", exc_info=True)
+
+    @classmethod
+    def forget(cls, flow_id: Optional[str] = None) -> None:
+        """
+        Drops the state clients have last been sent for a flow, or for all
+        flows if flow_id is None.
+        """
+        for conn in cls.connections:
+            if flow_id is None:
+                conn.sent.clear()
+            else:
+                conn.sent.pop(flow_id, None)
 
 
 class Flows(RequestHandler):
     def get(self):
-        self.write([flow_to_json(f) for f in self.view])
+        """
+        Without query arguments, all flows in the view are returned.
+
+        Otherwise, a page of flows is returned as {"flows", "total", "next"}:
+        limit is the page size, after is the cursor returned as next by the
+        previous page. filter, order and reversed default to the settings of
+        the view.
+        """
+        if not self.request.query_arguments:
+            self.write([flow_to_json(f) for f in self.view])
+            return
 
+        reverse = self.get_query_argument("reversed", None)
+        try:
+            flows = self.view.select(
+                self.get_query_argument("filter", None),
+                self.get_query_argument("order", None),
+                None if reverse is None else reverse.lower() in ("1", "true"),
+            )
+        except exceptions.CommandError as e:
+            raise APIError(400, str(e))
+
+        start = 0
+        after = self.get_query_argument("after", None)
+        if after:
+            f = self.view.get_by_id(after)
+            try:
+                if f is None:
+                    raise ValueError
+                start = flows.index(f) + 1
+            except ValueError:
+                raise APIError(400, "Unknown cursor: {}".format(after))
+        end = len(flows)
+        limit = self.get_query_argument("limit", None)
+        if limit is not None:
+            try:
+                limit = int(limit)
+                if limit < 1:
+                    raise ValueError
+            except ValueError:
+                raise APIError(400, "Invalid limit.")
+            end = min(start + limit, end)
+        page = [flows[i] for i in range(start, end)]
+        self.write(dict(
+            flows=[flow_to_json(f) for f in page],
+            total=len(flows),
+            next=page[-1].id if end < len(flows) else None,
+        ))
 
+
+@tornado.web.stream_request_body
 class DumpFlows(RequestHandler):
-    def get(self):
+    # Downloads are sent in chunks of about this many bytes.
+    chunk_size = 1024 * 1024
+    # Plain uploads are streamed, so they can be much larger than form uploads.
+    max_upload_size = 64 * 1024 ** 3
+
+    async def get(self):
         self.set_header("Content-Disposition", "attachment; filename=flows")
         self.set_header("Content-Type", "application/octet-stream")
 
         bio = BytesIO()
         fw = io.FlowWriter(bio)
-        for f in self.view:
+        for f in list(self.view):
             fw.add(f)
-
+            if bio.tell() >= self.chunk_size:
+                self.write(bio.getvalue())
+                bio.seek(0)
+                bio.truncate()
+                # Sends the chunk and lets the event loop run in between.
+                await self.flush()
         self.write(bio.getvalue())
         bio.close()
 
-    def post(self):
+    def prepare(self):
+        if self.request.method != "POST":
+            return
+        content_type = self.request.headers.get("Content-Type", "")
+        self.multipart = content_type.startswith("multipart/form-data")
+        if not self.multipart:
+            self.request.connection.set_max_body_size(self.max_upload_size)
+        self.buffer = bytearray()
+        self.error: Optional[str] = None
         self.view.clear()
-        bio = BytesIO(self.filecontents)
-        for i in io.FlowReader(bio).stream():
+
+    def data_received(self, chunk: bytes):
+        self.buffer += chunk
+        if not self.multipart:
+            self.load_flows()
+
+    def load_flows(self, final: bool = False):
+        """
+        Loads all complete flows from the upload buffer.
+        """
+        if self.error:
+            return
+        pos = 0
+        try:
+            while True:
+                end = parallel.record_end(self.buffer, pos)
+                if end is None:
+                    break
+                pos = end
+            if final and pos < len(self.buffer):
+                raise ValueError("incomplete record at end of file")
+        except ValueError:
+            self.error = "Invalid data format."
+        try:
+            flows = parallel.decode_chunk(bytes(self.buffer[:pos]))
+        except exceptions.FlowReadException as e:
+            self.error = str(e)
+            flows = []
+        del self.buffer[:pos]
+        for i in flows:
             asyncio.ensure_future(self.master.load_flow(i))
-        bio.close()
+
+    def post(self):
+        if self.multipart:
+            files: dict = {}
+            tornado.httputil.parse_body_arguments(
+                self.request.headers["Content-Type"], bytes(self.buffer), {}, files
+            )
+            if files:
+                self.buffer = bytearray(next(iter(files.values()))[0].body)
+        self.load_flows(final=True)
+        if self.error:
+            raise APIError(400, self.error)
 
 
 class ClearAll(RequestHandler):
@@ -356,17 +608,21 @@ class ReplayFlow(RequestHandler):
 
 
 class FlowContent(RequestHandler):
+    # Content is sent in chunks of about this many bytes.
+    chunk_size = 1024 * 1024
+
     def post(self, flow_id, message):
         self.flow.backup()
         message = getattr(self.flow, message)
         message.content = self.filecontents
         self.view.update([self.flow])
 
-    def get(self, flow_id, message):
+    async def get(self, flow_id, message):
         message = getattr(self.flow, message)
 
         if not message.raw_content:
             raise APIError(400, "No content.")
+        content = message.raw_content
 
         content_encoding = message.headers.get("Content-Encoding", None)
         if content_encoding:
@@ -388,22 +644,133 @@ class FlowContent(RequestHandler):
         self.set_header("Content-Type", "application/text")
         self.set_header("X-Content-Type-Options", "nosniff")
         self.set_header("X-Frame-Options", "DENY")
-        self.write(message.raw_content)
+        self.set_header("Accept-Ranges", "bytes")
+
+        start, end = 0, len(content)
+        if "Range" in self.request.headers:
+            try:
+                byte_range = parse_range(self.request.headers["Range"], len(content))
+            except ValueError:
+                pass  # Ranges we don't understand are ignored.
+            else:
+                if byte_range is None:
+                    self.set_status(416)
+                    self.set_header("Content-Range", "bytes */{}".format(len(content)))
+                    return
+                start, end = byte_range
+                self.set_status(206)
+                self.set_header("Content-Range", "bytes {}-{}/{}".format(start, end - 1, len(content)))
+
+        self.set_header("Content-Length", end - start)
+        data = memoryview(content)
+        for i in range(start, end, self.chunk_size):
+            self.write(bytes(data[i:min(i + self.chunk_size, end)]))
+            await self.flush()
+
+
+class ContentViewCursors:
+    """
+        Partially rendered content views, so that further pages continue where
+        the previous one stopped. A cursor keeps the raw content of its message
+        alive, so the cache is bounded by the total size of these contents,
+        and the cursors of a flow are dropped once it leaves the store.
+    """
+    max_bytes = 16 * 1024 * 1024
+
+    def __init__(self) -> None:
+        # (flow id, message, view, line) -> (content, description, lines), least recently used first.
+        self.cursors: collections.OrderedDict = collections.OrderedDict()
+        # flow id -> keys of its cursors
+        self.flows: Dict[str, Set[tuple]] = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.cursors)
+
+    def pop(self, key: tuple) -> Optional[tuple]:
+        cursor = self.cursors.pop(key, None)
+        if cursor:
+            self._forget(key, cursor)
+        return cursor
+
+    def add(self, key: tuple, cursor: tuple) -> None:
+        size = len(cursor[0] or b"")
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self.cursors[key] = cursor
+        self.flows.setdefault(key[0], set()).add(key)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._forget(*self.cursors.popitem(last=False))
+
+    def remove_flow(self, flow_id: str) -> None:
+        for key in self.flows.get(flow_id, set()).copy():
+            self.pop(key)
+
+    def clear(self) -> None:
+        self.cursors.clear()
+        self.flows.clear()
+        self.size = 0
+
+    def _forget(self, key: tuple, cursor: tuple) -> None:
+        self.size -= len(cursor[0] or b"")
+        keys = self.flows[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.flows[key[0]]
 
 
 class FlowContentView(RequestHandler):
     def get(self, flow_id, message, content_view):
+        """
+        With the lines query argument, only that many lines are rendered and
+        returned, together with a token to pass as continue for the next page.
+        """
+        message_name = message
         message = getattr(self.flow, message)
-
-        description, lines, error = contentviews.get_message_content_view(
-            content_view.replace('_', ' '), message, self.flow
-        )
-        #        if error:
-        #           add event log
-
+        try:
+            limit = self.get_query_argument("lines", None)
+            limit = None if limit is None else int(limit)
+            offset = int(self.get_query_argument("continue", "0"))
+            if (limit is not None and limit < 1) or offset < 0:
+                raise ValueError
+        except ValueError:
+            raise APIError(400, "Invalid lines or continue argument.")
+
+        cursors = self.application.content_view_cursors
+        cursor = cursors.pop((flow_id, message_name, content_view, offset))
+        if cursor and cursor[0] is message.raw_content:
+            _, description, lines = cursor
+        else:
+            description, lines, error = contentviews.get_message_content_view(
+                content_view.replace('_', ' '), message, self.flow
+            )
+            #        if error:
+            #           add event log
+            lines = itertools.islice(lines, offset, None)
+
+        if limit is None:
+            self.write(dict(
+                lines=list(lines),
+                description=description
+            ))
+            return
+
+        page = list(itertools.islice(lines, limit + 1))
+        token = None
+        if len(page) > limit:
+            lines = itertools.chain(page[limit:], lines)
+            page = page[:limit]
+            token = str(offset + limit)
+            cursors.add(
+                (flow_id, message_name, content_view, offset + limit),
+                (message.raw_content, description, lines)
+            )
         self.write(dict(
-            lines=list(lines),
-            description=description
+            lines=page,
+            description=description,
+            next=token,
         ))
 
 
@@ -433,6 +800,9 @@ class Settings(RequestHandler):
             listen_host=self.master.options.listen_host,
             listen_port=self.master.options.listen_port,
             server=self.master.options.server,
+            readfile_progress=(
+                self.master.readfile.get_progress() if self.master.readfile.is_reading else None
+            ),
         ))
 
     def put(self):
@@ -483,6 +853,9 @@ class Application(tornado.web.Application):
 
     def __init__(self, master: "mitmproxy.tools.web.master.WebMaster", debug: bool) -> None:
         self.master = master
+        self.content_view_cursors = ContentViewCursors()
+        master.view.sig_store_remove.connect(self._sig_store_remove)
+        master.view.sig_store_refresh.connect(self._sig_store_refresh)
         super().__init__(
             default_host="dns-rebind-protection",
             template_path=os.path.join(os.path.dirname(__file__), "templates"),
@@ -522,3 +895,9 @@ class Application(tornado.web.Application):
                 (r"/options/save", SaveOptions)
             ]
         )
+
+    def _sig_store_remove(self, view, flow):
+        self.content_view_cursors.remove_flow(flow.id)
+
+    def _sig_store_refresh(self, view):
+        self.content_view_cursors.clear()
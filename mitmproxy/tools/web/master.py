@@ -1,7 +1,11 @@
+import asyncio
+import typing
+
 import tornado.httpserver
 import tornado.ioloop
 from tornado.platform.asyncio import AsyncIOMainLoop
 
+import mitmproxy.flow
 from mitmproxy import addons
 from mitmproxy import log
 from mitmproxy import master
@@ -16,8 +20,13 @@ from mitmproxy.tools.web import app, webaddons, static_viewer
 
 
 class WebMaster(master.Master):
+    # Updates of a flow within this many seconds are sent as a single message.
+    update_interval = 0.05
+
     def __init__(self, options, with_termlog=True):
         super().__init__(options)
+        self._pending_updates: typing.Dict[str, mitmproxy.flow.Flow] = {}
+        self._flush_handle: typing.Optional[asyncio.TimerHandle] = None
         self.view = view.View()
         self.view.sig_view_add.connect(self._sig_view_add)
         self.view.sig_view_remove.connect(self._sig_view_remove)
@@ -31,11 +40,14 @@ class WebMaster(master.Master):
         self.options.changed.connect(self._sig_options_update)
         self.options.changed.connect(self._sig_settings_update)
 
+        self.readfile = readfile.ReadFile()
+        self.readfile.sig_progress.connect(self._sig_readfile_progress)
+
         self.addons.add(*addons.default_addons())
         self.addons.add(
             webaddons.WebAddon(),
             intercept.Intercept(),
-            readfile.ReadFile(),
+            self.readfile,
             static_viewer.StaticViewer(),
             self.view,
             self.events,
@@ -47,20 +59,35 @@ class WebMaster(master.Master):
         )
 
     def _sig_view_add(self, view, flow):
-        app.ClientConnection.broadcast(
-            resource="flows",
-            cmd="add",
-            data=app.flow_to_json(flow)
-        )
+        self._pending_updates.pop(flow.id, None)
+        if not app.ClientConnection.connections:
+            return
+        app.ClientConnection.broadcast_flow("add", app.flow_to_json(flow))
 
     def _sig_view_update(self, view, flow):
-        app.ClientConnection.broadcast(
-            resource="flows",
-            cmd="update",
-            data=app.flow_to_json(flow)
-        )
+        self._pending_updates[flow.id] = flow
+        if self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._flush_updates()
+            else:
+                self._flush_handle = loop.call_later(self.update_interval, self._flush_updates)
+
+    def _flush_updates(self):
+        """
+            Sends all pending flow updates.
+        """
+        self._flush_handle = None
+        pending, self._pending_updates = self._pending_updates, {}
+        if not app.ClientConnection.connections:
+            return
+        for flow in pending.values():
+            app.ClientConnection.broadcast_flow("update", app.flow_to_json(flow))
 
     def _sig_view_remove(self, view, flow, index):
+        self._pending_updates.pop(flow.id, None)
+        app.ClientConnection.forget(flow.id)
         app.ClientConnection.broadcast(
             resource="flows",
             cmd="remove",
@@ -68,6 +95,8 @@ class WebMaster(master.Master):
         )
 
     def _sig_view_refresh(self, view):
+        self._pending_updates.clear()
+        app.ClientConnection.forget()
         app.ClientConnection.broadcast(
             resource="flows",
             cmd="reset"
@@ -101,6 +130,13 @@ class WebMaster(master.Master):
             data={k: getattr(options, k) for k in updated}
         )
 
+    def _sig_readfile_progress(self, readfile, progress):
+        app.ClientConnection.broadcast(
+            resource="settings",
+            cmd="update",
+            data={"readfile_progress": progress}
+        )
+
     def run(self):  # pragma: no cover
         AsyncIOMainLoop().install()
         iol = tornado.ioloop.IOLoop.instance()
@@ -0,0 +1,123 @@
+"""
+Run several mitmdump processes that listen on the same port.
+
+The supervisor starts each worker as a separate mitmdump process with the
+original command line. Workers bind the proxy port with SO_REUSEPORT, so the
+kernel distributes incoming connections between them. Every worker loads its
+own options, config file and scripts, and watches scripts for changes itself.
+Workers report their statistics on exit, and the supervisor prints the totals.
+"""
+import os
+import signal
+import subprocess
+import sys
+import threading
+import typing
+
+from mitmproxy.utils import workers
+
+WORKER_MAIN = "import sys; from mitmproxy.tools.main import mitmdump; sys.exit(mitmdump())"
+
+
+class Supervisor:
+    def __init__(
+        self,
+        count: int,
+        arguments: typing.Optional[typing.Sequence[str]] = None,
+        command: typing.Optional[typing.Sequence[str]] = None,
+        output: typing.Optional[typing.BinaryIO] = None,
+    ) -> None:
+        self.count = count
+        self.arguments = list(sys.argv[1:] if arguments is None else arguments)
+        self.command = list(command or [sys.executable, "-c", WORKER_MAIN])
+        self.output = output or sys.stdout.buffer
+        self.output_lock = threading.Lock()
+        self.procs: typing.List[subprocess.Popen] = []
+        self.relays: typing.List[threading.Thread] = []
+        self.stopping = False
+        # latest statistics reported by each worker.
+        self.stats: typing.Dict[int, typing.Dict[str, int]] = {}
+        # exit code of the first worker that failed by itself.
+        self.returncode = 0
+
+    def start(self) -> None:
+        for i in range(self.count):
+            env = dict(os.environ)
+            env[workers.WORKER_ENV] = str(i)
+            # Make sure that log lines arrive in time.
+            env["PYTHONUNBUFFERED"] = "1"
+            p = subprocess.Popen(
+                self.command + self.arguments,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            self.procs.append(p)
+            t = threading.Thread(
+                target=self.relay,
+                args=(i, p),
+                name="worker {} output".format(i),
+                daemon=True,
+            )
+            self.relays.append(t)
+            t.start()
+
+    def relay(self, worker: int, proc: subprocess.Popen) -> None:
+        """
+            Copies a worker's output to our own, prefixing every line with the worker number.
+            Once the worker has exited, all others are stopped if it failed.
+        """
+        prefix = "[worker {}] ".format(worker).encode()
+        for line in proc.stdout:
+            stats = workers.parse_stats(line.decode(errors="replace"))
+            if stats is not None:
+                self.stats[worker] = stats
+                continue
+            with self.output_lock:
+                self.output.write(prefix + line)
+                self.output.flush()
+        proc.stdout.close()
+        if proc.wait() != 0 and not self.stopping:
+            self.returncode = proc.returncode
+            with self.output_lock:
+                self.output.write(prefix + "exited with code {}, stopping all workers.\n".format(proc.returncode).encode())
+                self.output.flush()
+            self.stop()
+
+    def stop(self) -> None:
+        self.stopping = True
+        for p in self.procs:
+            if p.poll() is None:
+                p.terminate()
+
+    def wait(self) -> int:
+        """
+            Waits for all workers to exit. Returns the exit code of the worker
+            that caused the others to stop, or 0.
+        """
+        for t in self.relays:
+            t.join()
+        if self.stats:
+            with self.output_lock:
+                self.output.write("[supervisor] totals: {}\n".format(
+                    ", ".join("{} {}".format(v, k.replace("_", " ")) for k, v in self.totals().items())
+                ).encode())
+                self.output.flush()
+        return self.returncode
+
+    def totals(self) -> typing.Dict[str, int]:
+        """
+            Adds up the statistics reported by all workers.
+        """
+        totals: typing.Dict[str, int] = {}
+        for stats in self.stats.values():
+            for k, v in stats.items():
+                totals[k] = totals.get(k, 0) + v
+        return totals
+
+    def run(self) -> int:  # pragma: no cover
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: self.stop())
+        self.start()
+        return self.wait()
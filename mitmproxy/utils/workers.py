@@ -0,0 +1,47 @@
+"""
+    Helpers shared by the workers supervisor and the addons that run inside
+    a worker process.
+"""
+import json
+import os
+import typing
+
+# Set for worker processes, contains the worker number.
+WORKER_ENV = "MITMPROXY_WORKER"
+# Output lines starting with this carry a worker's statistics to the supervisor.
+STATS_PREFIX = "mitmproxy-worker-stats: "
+
+
+def worker_id() -> typing.Optional[int]:
+    """
+        Returns the number of the current worker process, or None if this is not a worker.
+    """
+    n = os.environ.get(WORKER_ENV)
+    return int(n) if n is not None else None
+
+
+def shard_path(path: str, worker: int) -> str:
+    """
+        Returns the per-worker file name for a save_stream_file path.
+    """
+    return "{}.{}".format(path, worker)
+
+
+def format_stats(stats: typing.Dict[str, int]) -> str:
+    return STATS_PREFIX + json.dumps(stats, sort_keys=True)
+
+
+def parse_stats(line: str) -> typing.Optional[typing.Dict[str, int]]:
+    """
+        Returns the statistics carried by an output line, or None if the line
+        is a regular one.
+    """
+    if not line.startswith(STATS_PREFIX):
+        return None
+    try:
+        stats = json.loads(line[len(STATS_PREFIX):])
+    except ValueError:
+        return None
+    if not isinstance(stats, dict):
+        return None
+    return {k: v for k, v in stats.items() if isinstance(k, str) and isinstance(v, int)}
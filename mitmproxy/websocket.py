@@ -83,6 +83,7 @@ class WebSocketFlow(flow.Flow):
 
         self._inject_messages_client = queue.Queue(maxsize=1)
         self._inject_messages_server = queue.Queue(maxsize=1)
+        self._inject_waker = None
 
         if handshake_flow:
             self.client_key = websockets.get_client_key(handshake_flow.request.headers)
@@ -162,3 +163,5 @@ class WebSocketFlow(flow.Flow):
             self._inject_messages_server.put(payload)
         else:
             raise ValueError('Invalid endpoint')
+        if self._inject_waker:
+            self._inject_waker.wake()
@@ -0,0 +1,43 @@
+"""
+Benchmark reading a flow file in-process and with a process pool.
+
+    python ./flowfile-loading-bm.py [number of flows]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from mitmproxy import io
+from mitmproxy.io import parallel
+from mitmproxy.test import tflow
+
+
+def write_flows(path, count):
+    f = tflow.tflow(resp=True)
+    f.response.content = b"y" * 1024
+    with open(path, "wb") as fo:
+        w = io.FlowWriter(fo)
+        for _ in range(count):
+            w.add(f)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "flows")
+        write_flows(path, count)
+        size = os.path.getsize(path)
+        print("{} flows, {:.1f}MB".format(count, size / 1024 / 1024))
+        print("{:>10} {:>10} {:>12}".format("processes", "seconds", "flows/s"))
+        for processes in sorted({1, 2, 4, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            with open(path, "rb") as fo:
+                n = sum(1 for _ in parallel.read_flows(fo, processes))
+            t = time.perf_counter() - start
+            assert n == count
+            print("{:>10} {:>10.2f} {:>12.0f}".format(processes, t, count / t))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark parsed and compiled filter expressions over a corpus of flows.
+
+    python ./flowfilter-bm.py [number of flows]
+
+The corpus cycles through a small set of distinct flows with gzipped bodies.
+"""
+import sys
+import time
+
+from mitmproxy import flowfilter
+from mitmproxy.test import tflow
+
+EXPRESSIONS = [
+    "~d example.com",
+    "~b needle & ~m POST",
+    "~bs needle | ~bq needle | ~c 404",
+    "~h x-debug & ~d example.com & ~s",
+    "!(~b needle) & ~http & ~c 200",
+    "~b foo | ~b bar | ~b baz",
+]
+
+
+def make_flows():
+    flows = []
+    for i in range(16):
+        f = tflow.tflow(resp=True)
+        f.request.method = "POST" if i % 4 == 0 else "GET"
+        f.request.host = "example.com" if i % 2 else "mitmproxy.org"
+        f.request.content = b"x" * 4096 + (b"needle" if i % 8 == 0 else b"")
+        f.response.status_code = 404 if i % 5 == 0 else 200
+        f.response.content = b"y" * 32768
+        f.response.encode("gzip")
+        flows.append(f)
+    return flows
+
+
+def run(flt, corpus):
+    start = time.perf_counter()
+    n = sum(1 for f in corpus if flt(f))
+    return n, time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    flows = make_flows()
+    corpus = [flows[i % len(flows)] for i in range(count)]
+    print("{} flows".format(count))
+    print("{:<40} {:>10} {:>10} {:>8}".format("expression", "parsed", "compiled", "speedup"))
+    for expr in EXPRESSIONS:
+        flt = flowfilter.parse(expr)
+        matched, parsed = run(flt, corpus)
+        matched_compiled, compiled = run(flowfilter.optimize(flt), corpus)
+        assert matched == matched_compiled
+        print("{:<40} {:>9.2f}s {:>9.2f}s {:>7.1f}x".format(expr, parsed, compiled, parsed / compiled))
+
+
+if __name__ == "__main__":
+    main()
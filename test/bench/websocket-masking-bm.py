@@ -0,0 +1,36 @@
+"""
+Benchmark WebSocket payload masking over a range of frame sizes.
+
+    python ./websocket-masking-bm.py
+"""
+import timeit
+
+from mitmproxy.net import websockets
+
+SIZES = [10, 100, 1024, 16 * 1024, 256 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+
+
+def human(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return "{}{}".format(size, unit)
+        size //= 1024
+    return "{}GB".format(size)
+
+
+def main():
+    masker = websockets.Masker(b"\x12\x34\x56\x78")
+    print("{:>8} {:>14} {:>14} {:>10}".format("size", "mask", "mask_inplace", "MB/s"))
+    for size in SIZES:
+        data = b"x" * size
+        buf = bytearray(data)
+        number = max(1, 10 ** 7 // (size + 100))
+        t_mask = timeit.timeit(lambda: masker.mask(1, data), number=number) / number
+        t_inplace = timeit.timeit(lambda: masker.mask_inplace(1, buf), number=number) / number
+        print("{:>8} {:>12.2f}us {:>12.2f}us {:>10.0f}".format(
+            human(size), t_mask * 1e6, t_inplace * 1e6, size / t_inplace / 1e6
+        ))
+
+
+if __name__ == "__main__":
+    main()
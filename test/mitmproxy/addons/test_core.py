@@ -1,3 +1,4 @@
+import socket
 from unittest import mock
 
 from mitmproxy.addons import core
@@ -178,6 +179,38 @@ def test_validation_simple():
                 sa,
                 mode = "Flibble"
             )
+        with pytest.raises(exceptions.OptionsError, match="Invalid HTTP/2 window size"):
+            tctx.configure(sa, http2_stream_window_size = 1024)
+        with pytest.raises(exceptions.OptionsError, match="Invalid HTTP/2 window size"):
+            tctx.configure(sa, http2_connection_window_size = 2 ** 31)
+        with pytest.raises(exceptions.OptionsError, match="Invalid HTTP/2 max frame size"):
+            tctx.configure(sa, http2_max_frame_size = 1024)
+        tctx.configure(sa, http2_stream_window_size = 2 ** 20, http2_max_frame_size = 2 ** 16)
+        with pytest.raises(exceptions.OptionsError, match="Invalid WebSocket messages size limit"):
+            tctx.configure(sa, websocket_messages_size_limit = "foobar")
+        with pytest.raises(exceptions.OptionsError, match="Invalid WebSocket messages limit"):
+            tctx.configure(sa, websocket_messages_limit = -1)
+        tctx.configure(sa, websocket_messages_limit = 100, websocket_messages_size_limit = "10m")
+        with pytest.raises(exceptions.OptionsError, match="Invalid TCP messages size limit"):
+            tctx.configure(sa, tcp_messages_size_limit = "foobar")
+        with pytest.raises(exceptions.OptionsError, match="Invalid TCP messages limit"):
+            tctx.configure(sa, tcp_messages_limit = -1)
+        with pytest.raises(exceptions.OptionsError, match="Invalid TCP coalesce size"):
+            tctx.configure(sa, tcp_coalesce_size = "foobar")
+        tctx.configure(sa, tcp_messages_limit = 100, tcp_messages_size_limit = "10m", tcp_coalesce_size = "64k")
+
+
+def test_validation_workers(monkeypatch):
+    sa = core.Core()
+    with taddons.context() as tctx:
+        with pytest.raises(exceptions.OptionsError, match="must not be negative"):
+            tctx.configure(sa, workers = -1)
+        monkeypatch.setattr(socket, "SO_REUSEPORT", 15, raising=False)
+        tctx.configure(sa, workers = 4)
+        monkeypatch.delattr(socket, "SO_REUSEPORT")
+        with pytest.raises(exceptions.OptionsError, match="SO_REUSEPORT"):
+            tctx.configure(sa, workers = 2)
+        tctx.configure(sa, workers = 1)
 
 
 @mock.patch("mitmproxy.platform.original_addr", None)
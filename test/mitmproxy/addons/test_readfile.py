@@ -1,4 +1,5 @@
 import asyncio
+import gzip
 import io
 
 import pytest
@@ -45,6 +46,8 @@ class TestReadFile:
             tctx.configure(rf, readfile_filter="~q")
             with pytest.raises(Exception, match="Invalid readfile filter"):
                 tctx.configure(rf, readfile_filter="~~")
+            with pytest.raises(Exception, match="must not be negative"):
+                tctx.configure(rf, readfile_processes=-1)
 
     @pytest.mark.asyncio
     async def test_read(self, tmpdir, data, corrupt_data):
@@ -83,6 +86,32 @@ class TestReadFile:
                 await rf.load_flows(corrupt_data)
             assert await tctx.master.await_log("file corrupted")
 
+    @pytest.mark.asyncio
+    async def test_segments(self, tmpdir, data):
+        rf = readfile.ReadFile()
+        with taddons.context(rf):
+            tmpdir.join("flows.000001").write(data.getvalue(), mode="wb")
+            with gzip.open(str(tmpdir.join("flows.000002.gz")), "wb") as f:
+                f.write(data.getvalue())
+            with asynctest.patch('mitmproxy.master.Master.load_flow'):
+                assert await rf.load_flows_from_path(str(tmpdir.join("flows.*"))) == 8
+
+    @pytest.mark.asyncio
+    async def test_parallel(self, tmpdir, data):
+        rf = readfile.ReadFile()
+        with taddons.context(rf) as tctx:
+            tf = tmpdir.join("tfile")
+            tf.write(data.getvalue(), mode="wb")
+            tctx.configure(rf, readfile_processes=2)
+            progress = []
+            rf.sig_progress.connect(lambda sender, **kwargs: progress.append(kwargs["progress"]), weak=False)
+            with asynctest.patch('mitmproxy.master.Master.load_flow'):
+                with asynctest.patch("mitmproxy.addons.readfile.PROGRESS_INTERVAL", 0):
+                    assert await rf.load_flows_from_path(str(tf)) == 4
+            assert rf.get_progress() == 100
+            assert progress[-1] == 100
+            assert await tctx.master.await_log("Loading flows: 100%")
+
     @pytest.mark.asyncio
     async def test_nonexistent_file(self):
         rf = readfile.ReadFile()
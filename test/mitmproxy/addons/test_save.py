@@ -7,6 +7,7 @@ from mitmproxy import io
 from mitmproxy import exceptions
 from mitmproxy.addons import save
 from mitmproxy.addons import view
+from mitmproxy.utils import workers
 
 
 def test_configure(tmpdir):
@@ -56,6 +57,70 @@ def test_websocket(tmpdir):
         assert rd(p)
 
 
+def test_rotate(tmpdir):
+    sa = save.Save()
+    with taddons.context(sa) as tctx:
+        with pytest.raises(exceptions.OptionsError, match="Invalid rotation size"):
+            tctx.configure(sa, save_stream_rotate_size="foo")
+        with pytest.raises(exceptions.OptionsError, match="Invalid rotation interval"):
+            tctx.configure(sa, save_stream_rotate_interval=-1)
+
+        p = str(tmpdir.join("foo"))
+        tctx.configure(
+            sa,
+            save_stream_file="+" + p,
+            save_stream_rotate_size="1",
+            save_stream_compress=True,
+            save_stream_background=True,
+        )
+        assert isinstance(sa.stream, io.BackgroundFlowWriter)
+        for _ in range(3):
+            sa.response(tflow.tflow(resp=True))
+        tctx.configure(sa, save_stream_file=None)
+        assert sorted(x.basename for x in tmpdir.listdir()) == ["foo.00000%s.gz" % i for i in (1, 2, 3)]
+        assert len(io.read_flows_from_paths([p + ".*"])) == 3
+
+
+@pytest.mark.asyncio
+async def test_background(tmpdir):
+    sa = save.Save()
+    with taddons.context(sa) as tctx:
+        with pytest.raises(exceptions.OptionsError, match="Invalid queue size"):
+            tctx.configure(sa, save_stream_queue_size=0)
+
+        p = str(tmpdir.join("foo"))
+        tctx.configure(
+            sa,
+            save_stream_file=p,
+            save_stream_background=True,
+            save_stream_overflow="block",
+            save_stream_fsync="batch",
+        )
+        assert sa.stream.overflow == "block"
+        assert sa.stream.fsync == "batch"
+        sa.response(tflow.tflow(resp=True))
+        sa.stream.dropped = 3
+        tctx.configure(sa, save_stream_file=None)
+        assert await tctx.master.await_log("Dropped 3 flows")
+        assert len(rd(p)) == 1
+
+
+def test_workers(tmpdir, monkeypatch):
+    sa = save.Save()
+    with taddons.context(sa) as tctx:
+        p = str(tmpdir.join("foo"))
+        monkeypatch.delenv(workers.WORKER_ENV, raising=False)
+        tctx.configure(sa, save_stream_file=p, workers=2)
+        assert not sa.stream
+
+        monkeypatch.setenv(workers.WORKER_ENV, "1")
+        tctx.configure(sa, workers=3)
+        sa.response(tflow.tflow(resp=True))
+        tctx.configure(sa, save_stream_file=None)
+        assert rd(p + ".1")
+        assert not tmpdir.join("foo").exists()
+
+
 def test_save_command(tmpdir):
     sa = save.Save()
     with taddons.context() as tctx:
@@ -0,0 +1,123 @@
+import asyncio
+from unittest import mock
+import pytest
+
+from mitmproxy.addons import throttle
+from mitmproxy.test import taddons
+from mitmproxy.test import tflow
+
+
+def test_parse_throttle():
+    assert throttle.parse_throttle("/client/100k") == (None, "client", 100 * 1024, None)
+    assert throttle.parse_throttle(":~d example.com:host::5") == ("~d example.com", "host", None, 5)
+    assert throttle.parse_throttle("/~q/filter/1m/0.5") == ("~q", "filter", 1024 * 1024, 0.5)
+    for spec in ["/", "/client", "/foo/bar/1k", "/client/1k/5/6"]:
+        with pytest.raises(Exception, match="Invalid throttle specifier"):
+            throttle.parse_throttle(spec)
+    for spec in ["/client/", "/client/foo", "/client/1k/bar", "/client/0", "/host//-1"]:
+        with pytest.raises(Exception, match="Invalid throttle limits"):
+            throttle.parse_throttle(spec)
+
+
+def test_token_bucket():
+    b = throttle.TokenBucket(100)
+    assert b.burst == 10
+    assert b.reserve(10) == 0
+    # the bucket goes into debt, later callers wait for the earlier ones.
+    assert b.reserve(10) == pytest.approx(0.1, abs=0.01)
+    assert b.reserve(10) == pytest.approx(0.2, abs=0.01)
+
+
+def test_configure():
+    t = throttle.Throttle()
+    with taddons.context(t) as tctx:
+        with pytest.raises(Exception, match="Invalid throttle filter pattern"):
+            tctx.configure(t, throttle=["/~b/client/1k"])
+        tctx.configure(t, throttle=["/client/1k", "/~d example.com/host/2k"])
+        assert len(t.specs) == 2
+
+
+def test_bandwidth():
+    t = throttle.Throttle()
+    with taddons.context(t) as tctx:
+        tctx.configure(t, throttle=["/client/1k", ":~d address:host:2k"])
+
+        f = tflow.tflow()
+        t.requestheaders(f)
+        assert f.client_conn.throttle
+        assert f.server_conn.throttle
+        assert len(t.buckets) == 4
+        assert f.reply.state == "start"
+
+        f.request.host = "example.com"
+        throttles = f.client_conn.throttle, f.server_conn.throttle
+        t.requestheaders(f)
+        assert len(t.buckets) == 4
+        # another flow on the same connection keeps the limits of the first
+        assert (f.client_conn.throttle, f.server_conn.throttle) == throttles
+        assert len(f.server_conn.throttle.buckets) == 2
+
+        tctx.configure(t, throttle=[])
+        t.requestheaders(f)
+        assert f.client_conn.throttle is None
+        assert f.server_conn.throttle is None
+
+
+@pytest.mark.asyncio
+async def test_requests():
+    t = throttle.Throttle()
+    with taddons.context(t) as tctx:
+        tctx.configure(t, throttle=["/filter//10"])
+
+        f = tflow.tflow()
+        t.requestheaders(f)
+        assert f.reply.state == "start"
+        f.reply.take()
+        f.reply.ack()
+        f.reply.commit()
+
+        f = tflow.tflow()
+        t.requestheaders(f)
+        assert f.client_conn.throttle is None
+        assert f.reply.state == "taken"
+        await asyncio.sleep(0.2)
+        assert f.reply.state == "committed"
+
+
+def test_connection_throttle():
+    t = throttle.Throttle()
+    with taddons.context(t) as tctx:
+        f = tflow.tflow()
+        t.clientconnect(mock.Mock(client_conn=f.client_conn))
+        t.serverconnect(f.server_conn)
+        assert f.client_conn.throttle is None
+
+        tctx.configure(t, throttle=["/client/1k"])
+        t.clientconnect(mock.Mock(client_conn=f.client_conn))
+        t.serverconnect(f.server_conn)
+        ct = f.client_conn.throttle
+        assert isinstance(ct, throttle.ConnectionThrottle)
+        assert not ct.buckets
+        t.requestheaders(f)
+        assert f.client_conn.throttle is ct
+        assert len(ct.buckets) == 1
+        ct.add(ct.buckets)
+        assert len(ct.buckets) == 1
+        ct(10)
+
+        # buckets are dropped with the last connection that uses them
+        del f, ct
+        assert not t.buckets
+
+
+def test_prune():
+    t = throttle.Throttle()
+    with taddons.context(t) as tctx:
+        tctx.configure(t, throttle=["/client//1000", "/host//0.001"])
+        t.requestheaders(tflow.tflow())
+        assert len(t.request_buckets) == 2
+        for b in t.request_buckets.values():
+            b.timestamp -= 1
+        t.last_prune -= throttle.PRUNE_INTERVAL
+        t.prune()
+        assert list(t.request_buckets) == [(1, "address", "requests")]
@@ -1,3 +1,6 @@
+import asyncio
+from unittest import mock
+
 import pytest
 
 from mitmproxy.test import tflow
@@ -6,6 +9,7 @@ from mitmproxy.addons import view
 from mitmproxy import flowfilter
 from mitmproxy import exceptions
 from mitmproxy import io
+from mitmproxy.proxy.protocol import base
 from mitmproxy.test import taddons
 from mitmproxy.tools.console import consoleaddons
 
@@ -166,6 +170,78 @@ def test_filter():
     assert len(v) == 4
 
 
+def test_filter_verdicts():
+    v = view.View()
+    get, put = tft(method="get"), tft(method="put")
+    v.add([get, put])
+    with mock.patch.object(flowfilter.FMethod, "__call__", autospec=True, side_effect=flowfilter.FMethod.__call__) as m:
+        # negations cannot use the indexes, so all flows are filtered.
+        v.set_filter_cmd("!~m put")
+        v.set_filter_cmd("!~m get")
+        assert m.call_count == 4
+        v.set_filter_cmd("!~m put")
+        assert m.call_count == 4
+        assert list(v) == [get]
+
+        put.request.method = "GET"
+        v.update([put])
+        assert m.call_count == 5
+        assert list(v) == [get, put]
+
+    v.verdict_cache_size = 1
+    v.set_filter_cmd("~m post")
+    assert list(v._verdicts) == ["~m post"]
+    v.clear()
+    assert not v._verdicts
+
+
+@pytest.mark.asyncio
+async def test_refilter_background():
+    v = view.View()
+    v.refilter_chunk_size = 2
+    v.refilter_refresh_interval = 0
+    refreshes = []
+
+    def rec_refresh(view):
+        refreshes.append(len(view))
+
+    v.sig_view_refresh.connect(rec_refresh)
+    flows = [tft(method="get" if i % 2 == 0 else "put", start=i) for i in range(8)]
+    v.add(flows)
+
+    # negations cannot use the indexes, so all flows are filtered.
+    v.set_filter_cmd("!~m get")
+    assert v.refiltering
+    assert list(v) == [flows[1]]
+    # superseded by the next filter.
+    v.set_filter_cmd("!~m put")
+    assert list(v) == [flows[0]]
+
+    v.update([flows[6]])
+    assert list(v) == [flows[0], flows[6]]
+    v.remove([flows[4]])
+    while v.refiltering:
+        await asyncio.sleep(0)
+    assert list(v) == [flows[0], flows[2], flows[6]]
+    assert refreshes[-5:] == [1, 3, 3, 3, 3]
+    await asyncio.sleep(0)
+    assert not v._refilter_task
+
+    v.set_filter_cmd("~m put")
+    v.clear()
+    assert not v.refiltering
+
+
+def test_refilter_without_loop():
+    v = view.View()
+    v.refilter_chunk_size = 2
+    flows = [tft(method="get" if i % 2 == 0 else "put", start=i) for i in range(8)]
+    v.add(flows)
+    v.set_filter_cmd("~m put")
+    assert not v.refiltering
+    assert list(v) == flows[1::2]
+
+
 def tdump(path, flows):
     with open(path, "wb") as f:
         w = io.FlowWriter(f)
@@ -267,6 +343,185 @@ def test_resolve():
             tctx.command(v.resolve, "~")
 
 
+def test_indexes():
+    v = view.View()
+    flows = []
+    for i in range(6):
+        f = tflow.tflow(resp=i % 3 != 0)
+        f.request.host = "host%s.com" % (i % 2)
+        f.request.method = ["GET", "POST", "PUT"][i % 3]
+        if f.response:
+            f.response.status_code = 200 if i % 2 else 404
+            f.response.headers["content-type"] = "text/html" if i % 2 else "image/png"
+        flows.append(f)
+    tcp = tflow.ttcpflow()
+    v.add(flows + [tcp])
+
+    assert v.count_by("status") == {None: 2, 200: 2, 404: 2}
+    assert v.count_by("method") == {b"GET": 2, b"POST": 2, b"PUT": 2}
+    assert v.indexes["host"].other == {tcp.id: tcp}
+
+    with taddons.context() as tctx:
+        for spec in [
+            "~d host1", "~m post", "~c 404", "~s", "~q", "~marked", "~t html", "~tq html",
+            "~ts image", "~d host0 & ~s", "~c 200 | ~m get", "~c 200 | ~u host", "!~c 200",
+            "~m post ~d host1", "~tcp", "~d address",
+        ]:
+            flt = flowfilter.parse(spec)
+            expected = [f for f in v._store.values() if flt(f)]
+            assert tctx.command(v.resolve, spec) == expected, spec
+
+        assert v._candidates(flowfilter.parse("~c 200 | ~u host")) is None
+        assert len(v._candidates(flowfilter.parse("~c 200 & ~u host"))) == 2
+        assert v._candidates(flowfilter.parse("~marked")) is None
+
+        # marking a flow does not need an update.
+        flows[0].marked = True
+        assert tctx.command(v.resolve, "@marked") == [flows[0]]
+        assert tctx.command(v.resolve, "~marked") == [flows[0]]
+        flows[0].request.method = "POST"
+        flows[0].response = tflow.tflow(resp=True).response
+        v.update([flows[0]])
+        assert tctx.command(v.resolve, "~m post") == [flows[0], flows[1], flows[4]]
+        assert v.count_by("status") == {None: 1, 200: 3, 404: 2}
+
+        # the view filter only looks at flows the indexes cannot rule out.
+        v.set_filter(flowfilter.parse("~m post & ~u host"))
+        assert list(v) == [flows[0], flows[1], flows[4]]
+        assert set(v._verdicts["~m post & ~u host"]) == {flows[0].id, flows[1].id, flows[4].id}
+        v.set_filter(None)
+        assert len(v) == 7
+
+        v.remove([flows[1]])
+        assert tctx.command(v.resolve, "~m post") == [flows[0], flows[4]]
+        v.clear_not_marked()
+        assert tctx.command(v.resolve, "@all") == [flows[0]]
+        assert v.count_by("host") == {("host0.com", "host0.com"): 1}
+        v.clear()
+        assert v.count_by("host") == {}
+        assert not v._seq
+
+
+def test_eviction(tmpdir):
+    v = view.View()
+    with taddons.context(v) as tctx:
+        flows = [tflow.tflow(resp=True) for _ in range(5)]
+        v.add(flows)
+        size = v.store_bytes // 5
+        assert size > 0
+
+        flows[0].marked = True
+        flows[1].intercept()
+        v.update(flows[:2])
+        tctx.configure(v, view_max_flows=3)
+        assert list(v) == flows[:2] + flows[4:]
+
+        v.add([tflow.tflow(resp=True)])
+        assert len(v) == 3
+        assert flows[0] in v and flows[1] in v
+        assert v.store_bytes == 3 * size
+
+        tctx.configure(v, view_max_flows=0, view_max_bytes=str(2 * size))
+        assert list(v) == flows[:2]
+
+        t = tflow.ttcpflow()
+        tctx.configure(v, view_max_bytes=None)
+        v.add([t])
+        before = v.store_bytes
+        t.messages.append(tflow.ttcpflow().messages[0])
+        v.update([t])
+        assert v.store_bytes == before + len(t.messages[-1].content)
+        # the oldest messages have been trimmed.
+        others = v.store_bytes - sum(len(m.content) for m in t.messages)
+        base.trim_messages(t.messages, 0, 1, None)
+        t.messages.append(tflow.ttcpflow().messages[1])
+        v.update([t])
+        assert len(t.messages) == 2
+        assert v.store_bytes == others + sum(len(m.content) for m in t.messages)
+        del t.messages[:]
+        v.update([t])
+        assert v.store_bytes == others
+        v.remove([t])
+        assert v.store_bytes == 2 * size
+
+        spill = str(tmpdir.join("spill"))
+        tctx.configure(v, view_spill_file=spill)
+        flows[0].marked = False
+        flows[1].resume()
+        v.update(flows[:2])
+        tctx.configure(v, view_max_flows=1)
+        assert list(v) == flows[1:2]
+        v.done()
+        with open(spill, "rb") as f:
+            assert [x.id for x in io.FlowReader(f).stream()] == [flows[0].id]
+
+        with pytest.raises(exceptions.OptionsError, match="must not be negative"):
+            tctx.configure(v, view_max_bytes="-1")
+        with pytest.raises(exceptions.OptionsError, match="Invalid view_max_bytes"):
+            tctx.configure(v, view_max_bytes="1x")
+        tctx.configure(v, view_max_bytes="512m")
+        assert v.max_bytes == 512 * 1024 ** 2
+        with pytest.raises(exceptions.OptionsError, match="Error opening"):
+            tctx.configure(v, view_spill_file=str(tmpdir.join("no", "spill")))
+
+        v.clear()
+        assert v.store_bytes == 0
+        assert not v._sizes
+
+
+def test_select():
+    v = view.View()
+    with taddons.context(v) as tctx:
+        flows = [tft(method=m, start=i) for i, m in enumerate(["put", "get", "post"])]
+        v.add(flows)
+        assert v.select() is v
+        assert v.select("", "time", False) is v
+        assert v.select(order="method") == [flows[1], flows[2], flows[0]]
+        assert v.select("~m p", reverse=True) == [flows[2], flows[0]]
+
+        # results are cached until the store changes.
+        s = v.select(order="method")
+        assert v.select(order="method") is s
+        assert s.index(flows[0]) == 2
+        with pytest.raises(ValueError):
+            s.index(tft())
+        flows[0].request.method = "DELETE"
+        v.update([flows[0]])
+        # keys are not taken from the view's cache, which only knows the time order.
+        assert v.select(order="method") == [flows[0], flows[1], flows[2]]
+        assert v.select(order="method") is not s
+        f = tft(method="aaa", start=3)
+        v.add([f])
+        assert v.select(order="method") == [f, flows[0], flows[1], flows[2]]
+        v.remove([f])
+
+        v.selection_cache_size = 1
+        v.select(order="url")
+        v.select(order="size")
+        assert len(v._selections) == 1
+
+        tctx.configure(v, view_filter="~m get")
+        assert v.select("~m get") is v
+        assert v.select("") == flows
+        assert v.select(order="method") == [flows[1]]
+        with pytest.raises(exceptions.CommandError):
+            v.select(order="foo")
+        with pytest.raises(exceptions.CommandError):
+            v.select("~~")
+        v.clear()
+        assert not v._selections
+
+
+def test_selection():
+    flows = [tflow.tflow() for _ in range(3)]
+    s = view.Selection(flows)
+    assert s == flows
+    assert s.index(flows[1]) == 1
+    assert s.index(flows[1], 1, 2) == 1
+    with pytest.raises(ValueError):
+        s.index(flows[0], 1)
+
+
 def test_movement():
     v = view.View()
     with taddons.context():
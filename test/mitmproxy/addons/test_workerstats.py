@@ -0,0 +1,40 @@
+import io
+
+from mitmproxy.addons import workerstats
+from mitmproxy.test import taddons
+from mitmproxy.test import tflow
+from mitmproxy.utils import workers
+
+
+def test_workerstats(monkeypatch):
+    out = io.StringIO()
+    ws = workerstats.WorkerStats(out)
+    with taddons.context(ws) as tctx:
+        ws.clientconnect(None)
+        ws.response(tflow.tflow(resp=True))
+        ws.response(tflow.tflow(resp=True))
+        ws.error(tflow.tflow(err=True))
+        ws.tcp_end(tflow.ttcpflow())
+        ws.tcp_error(tflow.ttcpflow(err=True))
+        ws.websocket_end(tflow.twebsocketflow())
+        ws.websocket_error(tflow.twebsocketflow(err=True))
+
+        monkeypatch.delenv(workers.WORKER_ENV, raising=False)
+        tctx.configure(ws, workers=2)
+        ws.done()
+        assert out.getvalue() == ""
+
+        monkeypatch.setenv(workers.WORKER_ENV, "1")
+        tctx.configure(ws, workers=0)
+        ws.done()
+        assert out.getvalue() == ""
+
+        tctx.configure(ws, workers=2)
+        ws.done()
+        assert workers.parse_stats(out.getvalue()) == dict(
+            client_connections=1,
+            http_flows=2,
+            tcp_flows=1,
+            websocket_flows=1,
+            errors=3,
+        )
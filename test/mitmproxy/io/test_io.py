@@ -1 +1,126 @@
-# TODO: write tests
+import gzip
+import threading
+import time
+from io import BytesIO
+from unittest import mock
+
+import pytest
+
+from mitmproxy import io
+from mitmproxy import flowfilter
+from mitmproxy.coretypes import basethread
+from mitmproxy.test import tflow
+
+
+def test_open_flow_file(tmpdir):
+    p = tmpdir.join("foo")
+    with open(str(p), "wb") as f:
+        io.FlowWriter(f).add(tflow.tflow())
+    with gzip.open(str(p) + ".gz", "wb") as f:
+        io.FlowWriter(f).add(tflow.tflow())
+    for path in (str(p), str(p) + ".gz"):
+        with io.open_flow_file(path) as f:
+            assert len(list(io.FlowReader(f).stream())) == 1
+
+
+def test_expand_flow_paths(tmpdir):
+    for name in ("foo.2", "foo.1", "foo*", "bar"):
+        tmpdir.join(name).write("")
+    assert io.expand_flow_paths(str(tmpdir.join("foo.*"))) == [str(tmpdir.join("foo.1")), str(tmpdir.join("foo.2"))]
+    assert io.expand_flow_paths(str(tmpdir.join("foo*"))) == [str(tmpdir.join("foo*"))]
+    assert io.expand_flow_paths(str(tmpdir.join("baz.*"))) == [str(tmpdir.join("baz.*"))]
+
+
+def test_read_flows_from_paths(tmpdir):
+    for i in range(2):
+        with open(str(tmpdir.join("foo.%s" % i)), "wb") as f:
+            io.FlowWriter(f).add(tflow.tflow())
+    assert len(io.read_flows_from_paths([str(tmpdir.join("foo.*"))])) == 2
+
+
+class TestBackgroundFlowWriter:
+    def test_simple(self, tmpdir):
+        p = str(tmpdir.join("foo"))
+        w = io.BackgroundFlowWriter(open(p, "wb"), flowfilter.parse("~s"))
+        f = tflow.tflow(resp=True)
+        w.add(f)
+        w.add(tflow.tflow())
+        # the state is taken when the flow is added.
+        f.request.path = "/changed"
+        w.close()
+        with open(p, "rb") as fo:
+            flows = list(io.FlowReader(fo).stream())
+        assert len(flows) == 1
+        assert flows[0].request.path == "/path"
+
+    def test_error(self, tmpdir):
+        p = str(tmpdir.join("foo"))
+        fo = open(p, "wb")
+        w = io.BackgroundFlowWriter(fo, None)
+        fo.close()
+        w.add(tflow.tflow())
+        w.close()
+        assert w.error
+        with pytest.raises(ValueError):
+            w.add(tflow.tflow())
+
+    def test_error_drains_queue(self):
+        class BrokenFile(BytesIO):
+            def write(self, data):
+                raise RuntimeError("broken")
+
+        # fill the queue before the writer thread starts.
+        with mock.patch.object(basethread.BaseThread, "start"):
+            w = io.BackgroundFlowWriter(BrokenFile(), None, maxsize=1, overflow="block")
+        w.add(tflow.tflow())
+        w.thread.start()
+        # does not hang although the queue is full and writing fails.
+        w.close()
+        assert isinstance(w.error, RuntimeError)
+        assert w.written == 0
+
+    def test_invalid_policy(self):
+        with pytest.raises(ValueError, match="overflow"):
+            io.BackgroundFlowWriter(BytesIO(), None, overflow="foo")
+        with pytest.raises(ValueError, match="fsync"):
+            io.BackgroundFlowWriter(BytesIO(), None, fsync="foo")
+
+    def test_drop(self):
+        class SlowFile(BytesIO):
+            go = threading.Event()
+
+            def write(self, data):
+                self.go.wait()
+                return super().write(data)
+
+            def close(self):
+                pass
+
+        fo = SlowFile()
+        w = io.BackgroundFlowWriter(fo, None, maxsize=1)
+        assert w.overflow == "drop"
+        w.add(tflow.tflow())
+        # wait until the writer is stuck in write()
+        while not w.queue.empty():
+            time.sleep(0.001)
+        for _ in range(3):
+            w.add(tflow.tflow())
+        assert w.dropped == 2
+        fo.go.set()
+        w.close()
+        assert w.written == 2
+        assert len(list(io.FlowReader(BytesIO(fo.getvalue())).stream())) == 2
+
+    @pytest.mark.parametrize("policy, syncs", [("never", 0), ("batch", 1), ("flow", 3)])
+    def test_fsync(self, tmpdir, policy, syncs):
+        p = str(tmpdir.join("foo"))
+        # queue a batch before the writer thread starts.
+        with mock.patch.object(basethread.BaseThread, "start"):
+            w = io.BackgroundFlowWriter(open(p, "wb"), None, fsync=policy)
+        for _ in range(3):
+            w.add(tflow.tflow())
+        with mock.patch("os.fsync") as fsync:
+            w.thread.start()
+            w.close()
+        assert fsync.call_count == syncs
+        assert w.written == 3
@@ -0,0 +1,126 @@
+import concurrent.futures
+from io import BytesIO
+from unittest import mock
+
+import pytest
+
+from mitmproxy import exceptions
+from mitmproxy import io
+from mitmproxy.io import parallel
+from mitmproxy.io import tnetstring
+from mitmproxy.test import tflow
+
+
+@pytest.fixture
+def data():
+    f = BytesIO()
+    w = io.FlowWriter(f)
+    for i in range(20):
+        fl = tflow.tflow(resp=True) if i % 2 else tflow.ttcpflow()
+        fl.metadata["i"] = i
+        w.add(fl)
+    return f.getvalue()
+
+
+def test_record_end():
+    assert parallel.record_end(b"3:foo,", 0) == 6
+    assert parallel.record_end(b"xx3:foo,1:a,", 2) == 8
+    assert parallel.record_end(b"3:foo", 0) is None
+    assert parallel.record_end(b"123", 0) is None
+    with pytest.raises(ValueError):
+        parallel.record_end(b"x:foo,", 0)
+    with pytest.raises(ValueError):
+        parallel.record_end(b"12345678901234:", 0)
+
+
+def test_read_chunks(data):
+    chunks = list(parallel.read_chunks(BytesIO(data), 1000))
+    assert len(chunks) > 1
+    assert b"".join(chunks) == data
+    for c in chunks:
+        assert len(parallel.decode_chunk(c)) >= 1
+
+    assert list(parallel.read_chunks(BytesIO(b""))) == []
+
+
+def test_read_chunks_corrupt(data):
+    chunks = parallel.read_chunks(BytesIO(data + b"qibble"), 10 ** 6)
+    assert next(chunks) == data
+    with pytest.raises(ValueError):
+        next(chunks)
+
+    chunks = parallel.read_chunks(BytesIO(data + b"3:fo"), 10 ** 6)
+    assert next(chunks) == data
+    with pytest.raises(ValueError, match="incomplete"):
+        next(chunks)
+
+
+def test_decode_chunk():
+    with pytest.raises(exceptions.FlowReadException, match="Invalid data format"):
+        parallel.decode_chunk(b"3:foo~")
+    with pytest.raises(exceptions.FlowReadException, match="version"):
+        parallel.decode_chunk(tnetstring.dumps({b"version": (0, 1)}))
+    with pytest.raises(exceptions.FlowReadException, match="Unknown flow type"):
+        list(parallel.load_states([{"type": "foo"}]))
+
+
+def test_default_processes(tmpdir):
+    assert parallel.default_processes(BytesIO(), 3) == 3
+    assert parallel.default_processes(BytesIO(), 0) == 1
+    p = tmpdir.join("foo")
+    p.write("")
+    with open(str(p), "rb") as f:
+        assert parallel.file_size(f) is None
+        assert parallel.default_processes(f, 0) == 1
+    p.write("x" * 10)
+    with open(str(p), "rb") as f:
+        assert parallel.file_size(f) == 10
+        with mock.patch("mitmproxy.io.parallel.PARALLEL_THRESHOLD", 10):
+            with mock.patch("os.cpu_count", return_value=4):
+                assert parallel.default_processes(f, 0) == 4
+
+
+class TestParallelFlowReader:
+    def test_order(self, data):
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            r = parallel.ParallelFlowReader(BytesIO(data), executor, max_pending=2, chunk_size=1000)
+            flows = list(r.stream())
+        assert [f.metadata["i"] for f in flows] == list(range(20))
+
+    def test_corrupt(self, data):
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            r = parallel.ParallelFlowReader(BytesIO(data + b"qibble"), executor, chunk_size=1000)
+            flows = []
+            with pytest.raises(exceptions.FlowReadException, match="Invalid data format"):
+                for f in r.stream():
+                    flows.append(f)
+        assert len(flows) == 20
+
+    def test_stop_early(self, data):
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            r = parallel.ParallelFlowReader(BytesIO(data), executor, max_pending=10, chunk_size=100)
+            chunks = r.chunks()
+            next(chunks)
+            chunks.close()
+
+
+def test_process_pool():
+    with parallel.process_pool(1) as executor:
+        assert executor.submit(parallel.decode_chunk, b"").result() == []
+
+
+def test_close_reader(data):
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    chunks = parallel.ParallelFlowReader(BytesIO(data), executor, chunk_size=100).chunks()
+    next(chunks)
+    parallel.close_reader(chunks, executor)
+    with pytest.raises(StopIteration):
+        next(chunks)
+    with pytest.raises(RuntimeError):
+        executor.submit(int)
+
+
+def test_read_flows(data, tmpdir):
+    assert len(list(parallel.read_flows(BytesIO(data)))) == 20
+    flows = list(parallel.read_flows(BytesIO(data), processes=2))
+    assert [f.metadata["i"] for f in flows] == list(range(20))
@@ -0,0 +1,77 @@
+import gzip
+from unittest import mock
+
+from mitmproxy.io import rotate
+
+
+def test_segment_path():
+    assert rotate.segment_path("foo", 1) == "foo.000001"
+    assert rotate.segment_path("foo", 1234567) == "foo.1234567"
+
+
+def test_segments(tmpdir):
+    p = str(tmpdir.join("fo[o]"))
+    for name in ("fo[o].000002.gz", "fo[o].000001", "fo[o].000010", "fo[o].000003.tmp", "fo[o].1"):
+        tmpdir.join(name).write("")
+    assert rotate.segments(p) == [
+        (1, p + ".000001"),
+        (2, p + ".000002.gz"),
+        (10, p + ".000010"),
+    ]
+    assert rotate.segments(str(tmpdir.join("bar"))) == []
+
+
+def test_compress(tmpdir):
+    p = tmpdir.join("foo")
+    p.write(b"data", mode="wb")
+    assert rotate.compress(str(p)) == str(p) + ".gz"
+    assert not p.exists()
+    assert tmpdir.listdir() == [tmpdir.join("foo.gz")]
+    with gzip.open(str(p) + ".gz") as f:
+        assert f.read() == b"data"
+
+
+class TestRotatingFile:
+    def test_size(self, tmpdir):
+        p = str(tmpdir.join("foo"))
+        f = rotate.RotatingFile(p, max_size=5)
+        f.write(b"abc")
+        f.write(b"def")
+        f.write(b"g")
+        f.write(b"h")
+        f.close()
+        assert tmpdir.join("foo.000001").read() == "abcdef"
+        assert tmpdir.join("foo.000002").read() == "gh"
+
+        # numbering continues, empty segments are removed.
+        f = rotate.RotatingFile(p, max_size=5)
+        assert f.current == p + ".000003"
+        f.close()
+        f.close()
+        assert not tmpdir.join("foo.000003").exists()
+
+    def test_age(self, tmpdir):
+        p = str(tmpdir.join("foo"))
+        with mock.patch("time.monotonic") as t:
+            t.return_value = 100
+            f = rotate.RotatingFile(p, max_age=10)
+            f.write(b"a")
+            t.return_value = 105
+            f.write(b"b")
+            t.return_value = 110
+            f.write(b"c")
+            f.flush()
+            assert f.fileno() == f.fo.fileno()
+            f.close()
+        assert tmpdir.join("foo.000001").read() == "ab"
+        assert tmpdir.join("foo.000002").read() == "c"
+
+    def test_compress(self, tmpdir):
+        p = str(tmpdir.join("foo"))
+        f = rotate.RotatingFile(p, max_size=1, compress=True)
+        for c in b"abc":
+            f.write(bytes([c]))
+        f.close()
+        assert [s for _, s in rotate.segments(p)] == [p + ".00000%d.gz" % i for i in (1, 2, 3)]
+        with gzip.open(p + ".000002.gz") as g:
+            assert g.read() == b"b"
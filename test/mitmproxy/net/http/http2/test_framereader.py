@@ -4,7 +4,7 @@ from io import BytesIO
 import hyperframe.frame
 
 from mitmproxy import exceptions
-from mitmproxy.net.http.http2 import read_raw_frame, parse_frame
+from mitmproxy.net.http.http2 import FrameReader, read_raw_frame, parse_frame
 
 
 def test_read_raw_frame():
@@ -26,6 +26,47 @@ def test_read_raw_frame_failed():
         read_raw_frame(bio)
 
 
+class _ChunkedFile:
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def read_some(self, length):
+        if not self.chunks:
+            return b""
+        chunk = self.chunks.pop(0)
+        assert len(chunk) <= length
+        return chunk
+
+    def read(self, length):
+        return b"".join(self.chunks)
+
+
+class TestFrameReader:
+    frame = codecs.decode('000006000101234567666f6f626172', 'hex_codec')
+
+    def test_batch(self):
+        r = FrameReader(_ChunkedFile(self.frame * 3 + self.frame[:5], self.frame[5:]))
+        assert r.read_frames() == self.frame * 3
+        assert r.read_frames() == self.frame
+        with pytest.raises(exceptions.TcpDisconnect):
+            r.read_frames()
+
+    def test_split(self):
+        chunks = [self.frame[i:i + 1] for i in range(len(self.frame))]
+        r = FrameReader(_ChunkedFile(*chunks))
+        assert r.read_frames() == self.frame
+
+    def test_incomplete(self):
+        r = FrameReader(_ChunkedFile(self.frame[:12]))
+        with pytest.raises(exceptions.TcpReadIncomplete):
+            r.read_frames()
+
+    def test_http1(self):
+        r = FrameReader(_ChunkedFile(b"HTTP/1.1 200 OK\r\n\r\n"))
+        with pytest.raises(exceptions.HttpException, match="HTTP/1.1"):
+            r.read_frames()
+
+
 def test_parse_frame():
     f = parse_frame(
         codecs.decode('000006000101234567', 'hex_codec'),
@@ -0,0 +1,110 @@
+import socket
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from mitmproxy.net import resolver
+
+
+class FakeGetaddrinfo:
+    def __init__(self, fail=False, delay=0):
+        self.calls = 0
+        self.fail = fail
+        self.delay = delay
+
+    def __call__(self, host, port, *args):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port))]
+
+
+def test_disabled():
+    r = resolver.Resolver()
+    g = FakeGetaddrinfo()
+    with mock.patch("socket.getaddrinfo", g):
+        r.getaddrinfo("example.com", 80)
+        r.getaddrinfo("example.com", 80)
+        r.prefetch("example.com", 80)
+    assert g.calls == 2
+
+
+def test_cache():
+    r = resolver.Resolver(ttl=60)
+    g = FakeGetaddrinfo()
+    with mock.patch("socket.getaddrinfo", g):
+        assert r.getaddrinfo("example.com", 80)[0][4] == ("127.0.0.1", 80)
+        assert r.getaddrinfo("example.com", 80)[0][4] == ("127.0.0.1", 80)
+        assert g.calls == 1
+        assert r.getaddrinfo("example.com", 443)[0][4] == ("127.0.0.1", 443)
+        assert g.calls == 2
+
+        r.clear()
+        r.getaddrinfo("example.com", 80)
+        assert g.calls == 3
+
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+            r.getaddrinfo("example.com", 80)
+        assert g.calls == 4
+
+
+def test_negative_cache():
+    r = resolver.Resolver(ttl=60, negative_ttl=5)
+    g = FakeGetaddrinfo(fail=True)
+    with mock.patch("socket.getaddrinfo", g):
+        for _ in range(2):
+            with pytest.raises(socket.gaierror):
+                r.getaddrinfo("example.invalid", 80)
+        assert g.calls == 1
+
+    r = resolver.Resolver(ttl=60, negative_ttl=0)
+    with mock.patch("socket.getaddrinfo", g):
+        for _ in range(2):
+            with pytest.raises(socket.gaierror):
+                r.getaddrinfo("example.invalid", 80)
+        assert g.calls == 3
+
+
+def test_max_entries():
+    r = resolver.Resolver(ttl=60, max_entries=2)
+    g = FakeGetaddrinfo()
+    with mock.patch("socket.getaddrinfo", g):
+        for port in (1, 2, 3):
+            r.getaddrinfo("example.com", port)
+        assert len(r._cache) == 2
+        r.getaddrinfo("example.com", 3)
+        assert g.calls == 3
+        r.getaddrinfo("example.com", 1)
+        assert g.calls == 4
+
+
+def test_coalesce():
+    r = resolver.Resolver(ttl=60)
+    g = FakeGetaddrinfo(delay=0.1)
+    with mock.patch("socket.getaddrinfo", g):
+        threads = [
+            threading.Thread(target=r.getaddrinfo, args=("example.com", 80))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert g.calls == 1
+
+
+def test_prefetch():
+    r = resolver.Resolver(ttl=60)
+    g = FakeGetaddrinfo()
+    with mock.patch("socket.getaddrinfo", g):
+        r.prefetch("example.com", 80)
+        for _ in range(100):
+            if r._cache:
+                break
+            time.sleep(0.01)
+        r.prefetch("example.com", 80)
+        r.getaddrinfo("example.com", 80, 0, socket.SOCK_STREAM)
+    assert g.calls == 1
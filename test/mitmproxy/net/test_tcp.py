@@ -1,4 +1,5 @@
 from io import BytesIO
+import errno
 import re
 import queue
 import time
@@ -635,6 +636,90 @@ class TestTCPClient(tservers.ServerTestBase):
         with pytest.raises(exceptions.TcpException, match="Failed to spoof"):
             c.connect()
 
+    def test_happy_eyeballs(self, monkeypatch):
+        monkeypatch.setattr(tcp, "_broken_families", {})
+        monkeypatch.setattr(tcp.TCPClient, "CONNECTION_ATTEMPT_DELAY", 0.05)
+        addresses = [
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.1", self.port)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", self.port)),
+        ]
+        c = tcp.TCPClient(("example.com", self.port))
+        start_connect = c._start_connect
+        hanging = socket.socket()
+
+        def _start_connect(addrinfo):
+            if addrinfo[4][0] == "192.0.2.1":
+                # a listening socket never becomes writable, just like a connection attempt that hangs.
+                hanging.bind(("127.0.0.1", 0))
+                hanging.listen()
+                return hanging, False
+            return start_connect(addrinfo)
+
+        c._start_connect = _start_connect
+        with mock.patch("socket.getaddrinfo", return_value=addresses):
+            with c.create_connection(timeout=5) as conn:
+                assert conn.getpeername() == ("127.0.0.1", self.port)
+                assert conn.gettimeout() == 5
+        # the attempt that lost the race is closed.
+        assert hanging.fileno() == -1
+
+    def test_connect_wouldblock(self, monkeypatch):
+        # what a non-blocking connect_ex() returns on Windows.
+        monkeypatch.setattr(errno, "WSAEWOULDBLOCK", 10035, raising=False)
+        sock = mock.Mock()
+        sock.connect_ex.return_value = 10035
+        c = tcp.TCPClient(("127.0.0.1", self.port))
+        monkeypatch.setattr(c, "makesocket", lambda *args: sock)
+        addrinfo = (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", self.port))
+        assert c._start_connect(addrinfo) == (sock, False)
+        assert not sock.close.called
+
+        sock.connect_ex.return_value = errno.ECONNREFUSED
+        with pytest.raises(OSError):
+            c._start_connect(addrinfo)
+        assert sock.close.called
+
+    def test_all_attempts_fail(self, monkeypatch):
+        monkeypatch.setattr(tcp, "_broken_families", {})
+        addresses = [
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", 0)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", 0)),
+        ]
+        c = tcp.TCPClient(("example.com", 0))
+        with mock.patch("socket.getaddrinfo", return_value=addresses):
+            with pytest.raises(exceptions.TcpException, match="Error connecting"):
+                c.connect()
+
+    def test_broken_family(self, monkeypatch):
+        monkeypatch.setattr(tcp, "_broken_families", {})
+        tcp._address_family_failed(socket.AF_INET, errno.ECONNREFUSED)
+        assert not tcp._broken_families
+        tcp._address_family_failed(socket.AF_INET, errno.ENETUNREACH)
+        assert socket.AF_INET in tcp._broken_families
+
+        # We still try broken families if nothing else is left, and forget about them once they work again.
+        c = tcp.TCPClient(("127.0.0.1", self.port))
+        with c.create_connection():
+            pass
+        assert not tcp._broken_families
+
+
+def test_sort_addresses(monkeypatch):
+    monkeypatch.setattr(tcp, "_broken_families", {})
+    v4 = [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("10.0.0.%s" % i, 80)) for i in range(3)]
+    v6 = [(socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("::%s" % i, 80, 0, 0)) for i in range(2)]
+
+    assert tcp.sort_addresses([]) == []
+    assert tcp.sort_addresses(v4) == v4
+    assert tcp.sort_addresses(v6 + v4) == [v6[0], v4[0], v6[1], v4[1], v4[2]]
+    assert tcp.sort_addresses(v4 + v6) == [v4[0], v6[0], v4[1], v6[1], v4[2]]
+
+    tcp._address_family_failed(socket.AF_INET6, errno.ENETUNREACH)
+    assert tcp.sort_addresses(v6 + v4) == v4 + v6
+
+    tcp._broken_families[socket.AF_INET6] = time.monotonic() - 1
+    assert tcp.sort_addresses(v6 + v4)[0] == v6[0]
+
 
 class TestTCPServer:
 
@@ -642,6 +727,23 @@ class TestTCPServer:
         with pytest.raises(socket.error, match="prohibited"):
             tcp.TCPServer(("localhost", 8080))
 
+    def test_shutdown(self):
+        s = tcp.TCPServer(("127.0.0.1", 0))
+        t = threading.Thread(target=s.serve_forever)
+        t.start()
+        while s._TCPServer__is_shut_down.is_set():
+            time.sleep(0.01)
+        s.shutdown()
+        t.join(5)
+        assert not t.is_alive()
+
+    def test_reuse_port(self):
+        s = tcp.TCPServer(("127.0.0.1", 0), reuse_port=True)
+        s2 = tcp.TCPServer(s.address, reuse_port=True)
+        assert s2.address == s.address
+        s.socket.close()
+        s2.socket.close()
+
     def test_wait_for_silence(self):
         s = tcp.TCPServer(("127.0.0.1", 0))
         with s.handler_counter:
@@ -650,6 +752,20 @@ class TestTCPServer:
             s.shutdown()
 
 
+def test_waker():
+    w = tcp.Waker()
+    try:
+        assert tcp.ssl_read_select([w], 0) == []
+        w.wake()
+        w.wake()
+        assert tcp.ssl_read_select([w], 0) == [w]
+        w.clear()
+        assert tcp.ssl_read_select([w], 0) == []
+    finally:
+        w.close()
+    w.wake()
+
+
 class TestFileLike:
 
     def test_blocksize(self):
@@ -672,6 +788,16 @@ class TestFileLike:
         # Test __getattr__
         assert s.isatty
 
+    def test_read_some(self):
+        s = BytesIO(b"1234567890")
+        s = tcp.Reader(s)
+        s.start_log()
+        assert s.read_some(4) == b"1234"
+        assert s.read_some(100) == b"567890"
+        assert s.read_some(100) == b""
+        assert s.get_log() == b"1234567890"
+        assert s.first_byte_timestamp
+
     def test_limit(self):
         s = BytesIO(b"foobar\nfoobar")
         s = tcp.Reader(s)
@@ -711,6 +837,15 @@ class TestFileLike:
         s.write(b"x")
         assert s.get_log() == b"xx"
 
+    def test_writer_throttle(self):
+        b = BytesIO()
+        s = tcp.Writer(b)
+        sizes = []
+        s.throttle = sizes.append
+        s.write(b"x" * (s.THROTTLE_CHUNK_SIZE + 10))
+        assert sizes == [s.THROTTLE_CHUNK_SIZE, 10]
+        assert b.getvalue() == b"x" * (s.THROTTLE_CHUNK_SIZE + 10)
+
     def test_writer_flush_error(self):
         s = BytesIO()
         s = tcp.Writer(s)
@@ -144,6 +144,11 @@ class TestFrame:
         round(b"test", rsv1=1)
         round(b"test", opcode=websockets.OPCODE.PING)
         round(b"test", masking_key=b"test")
+        round(b"test" * 1000, masking_key=b"test")
+
+        payload = bytes(range(256)) * 4
+        raw = bytes(websockets.Frame(payload, masking_key=b"abcd"))
+        assert raw[-len(payload):] == websockets.Masker(b"abcd")(payload)
 
     def test_human_readable(self):
         f = websockets.Frame()
@@ -21,3 +21,23 @@ class TestMasker:
 
         data = websockets.Masker(b"abcd")(data)
         assert data == b"".join(input)
+
+    @pytest.mark.parametrize("size", [0, 1, 511, 512, 513, 4099])
+    @pytest.mark.parametrize("offset", [0, 1, 2, 3, 5])
+    def test_mask_large(self, size, offset):
+        key = b"\x00\x9a\xff\x01"
+        data = bytes(i % 251 for i in range(size))
+        expected = bytes(b ^ key[(offset + i) % 4] for i, b in enumerate(data))
+
+        m = websockets.Masker(key)
+        assert m.mask(offset, data) == expected
+
+        buf = bytearray(data)
+        m.mask_inplace(offset, buf)
+        assert buf == expected
+        m.mask_inplace(offset, buf)
+        assert buf == data
+
+        buf = bytearray(b"head" + data)
+        m.mask_inplace(offset, buf, 4)
+        assert buf == b"head" + expected
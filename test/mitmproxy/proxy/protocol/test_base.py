@@ -1 +1,46 @@
-# TODO: write tests
+from unittest import mock
+
+from mitmproxy.proxy.protocol import base
+from mitmproxy.tcp import TCPMessage
+
+
+def test_trim_messages():
+    def messages():
+        return [TCPMessage(True, b"x" * i) for i in (1, 2, 3, 4)]
+
+    m = messages()
+    assert base.trim_messages(m, 10, 0, None) == 10
+    assert len(m) == 4
+
+    m = messages()
+    assert base.trim_messages(m, 10, 2, None) == 7
+    assert [len(x.content) for x in m] == [3, 4]
+
+    m = messages()
+    assert base.trim_messages(m, 10, 0, 5) == 4
+    assert [len(x.content) for x in m] == [4]
+
+    m = messages()
+    assert base.trim_messages(m, 10, 3, 9) == 9
+    assert [len(x.content) for x in m] == [2, 3, 4]
+
+    m = messages()
+    assert base.trim_messages(m, 10, 0, 0) == 0
+    assert m == []
+
+
+def test_disconnect_keeps_throttle():
+    class Layer(base.ServerConnectionMixin):
+        config = mock.Mock()
+        channel = mock.Mock()
+        log = mock.Mock()
+
+    Layer.config.options.spoof_source_address = False
+    Layer.config.options.upstream_bind_address = ""
+    layer = Layer()
+    old = layer.server_conn
+    old.throttle = throttle = mock.Mock()
+    old.finish = old.close = mock.Mock()
+    layer.disconnect()
+    assert layer.server_conn is not old
+    assert layer.server_conn.throttle is throttle
@@ -13,6 +13,7 @@ import mitmproxy.net
 from ...net import tservers as net_tservers
 from mitmproxy import exceptions
 from mitmproxy.net.http import http1, http2
+from mitmproxy.proxy.protocol.http2 import Http2Layer
 from pathod.language import generators
 
 from ... import tservers
@@ -609,6 +610,77 @@ class TestBodySizeLimit(_Http2Test):
         assert len(self.master.state.flows) == 0
 
 
+class TestFlowControl(_Http2Test):
+    request_body_buffer = b''
+
+    @classmethod
+    def handle_server_event(cls, event, h2_conn, rfile, wfile):
+        if isinstance(event, h2.events.ConnectionTerminated):
+            return False
+        elif isinstance(event, h2.events.DataReceived):
+            cls.request_body_buffer += event.data
+            h2_conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            wfile.write(h2_conn.data_to_send())
+            wfile.flush()
+        elif isinstance(event, h2.events.StreamEnded):
+            h2_conn.send_headers(event.stream_id, [(':status', '200')], end_stream=True)
+            wfile.write(h2_conn.data_to_send())
+            wfile.flush()
+        return True
+
+    def test_flow_control(self, monkeypatch):
+        monkeypatch.setattr(Http2Layer, "max_concurrent_streams", 10)
+        self.options.http2_connection_window_size = 4 * 1024 * 1024
+        self.options.http2_stream_window_size = 1024 * 1024
+        self.options.http2_max_frame_size = 65536
+        body = b'x' * 300000
+
+        h2_conn = self.setup_connection()
+        while h2_conn.outbound_flow_control_window != 4 * 1024 * 1024:
+            raw = b''.join(http2.read_raw_frame(self.client.rfile))
+            h2_conn.receive_data(raw)
+            self.client.wfile.write(h2_conn.data_to_send())
+            self.client.wfile.flush()
+        assert h2_conn.remote_settings.initial_window_size == 1024 * 1024
+        assert h2_conn.max_outbound_frame_size == 65536
+        assert h2_conn.remote_settings.max_concurrent_streams == 10
+
+        # larger than the default windows, would be blocked without the window update.
+        self._send_request(
+            self.client.wfile,
+            h2_conn,
+            headers=[
+                (':authority', "127.0.0.1:{}".format(self.server.server.address[1])),
+                (':method', 'POST'),
+                (':scheme', 'https'),
+                (':path', '/'),
+            ],
+            end_stream=False,
+        )
+        for i in range(0, len(body), 65536):
+            h2_conn.send_data(1, body[i:i + 65536])
+        h2_conn.end_stream(1)
+        self.client.wfile.write(h2_conn.data_to_send())
+        self.client.wfile.flush()
+
+        done = False
+        while not done:
+            raw = b''.join(http2.read_raw_frame(self.client.rfile))
+            events = h2_conn.receive_data(raw)
+            self.client.wfile.write(h2_conn.data_to_send())
+            self.client.wfile.flush()
+            for event in events:
+                if isinstance(event, h2.events.StreamEnded):
+                    done = True
+
+        h2_conn.close_connection()
+        self.client.wfile.write(h2_conn.data_to_send())
+        self.client.wfile.flush()
+
+        assert self.request_body_buffer == body
+        assert self.master.state.flows[0].request.content == body
+
+
 class TestPushPromise(_Http2Test):
 
     @classmethod
@@ -1031,3 +1103,53 @@ class TestResponseStreaming(_Http2Test):
             assert data
         else:
             assert data is None
+
+
+def test_stream_worker_pool():
+    import threading
+    from mitmproxy.proxy.protocol.http2 import _StreamWorkerPool
+
+    pool = _StreamWorkerPool("test")
+    started = threading.Semaphore(0)
+    done = threading.Semaphore(0)
+    release = threading.Event()
+    names = []
+
+    def job():
+        names.append(threading.current_thread().name)
+        started.release()
+        release.wait()
+        done.release()
+
+    for _ in range(3):
+        pool.submit(job)
+    # blocked streams don't hold up others
+    for _ in range(3):
+        assert started.acquire(timeout=5)
+    assert pool.workers == 3
+    release.set()
+    for _ in range(3):
+        assert done.acquire(timeout=5)
+
+    # idle workers are reused
+    for _ in range(2):
+        pool.submit(job)
+        assert done.acquire(timeout=5)
+    assert pool.workers == 3
+    assert set(names) == {"test worker 1", "test worker 2", "test worker 3"}
+    pool.shutdown()
+
+
+def test_read_data_queue_acknowledges_on_close():
+    import queue
+    from unittest import mock
+    from mitmproxy.proxy.protocol.http2 import Http2SingleStreamLayer
+
+    conn = mock.Mock()
+    q = queue.Queue()
+    q.put((b"foo", conn, 1))
+    q.put((b"barbaz", conn, 1))
+    gen = Http2SingleStreamLayer._read_data_queue(mock.Mock(), q)
+    assert next(gen) == b"foo"
+    gen.close()
+    assert conn.safe_acknowledge_received_data.call_args_list == [mock.call(6, 1), mock.call(3, 1)]
@@ -405,6 +405,9 @@ class TestStreaming(_WebSocketTest):
             def websocket_start(self, f):
                 f.stream = streaming
 
+            def websocket_message(self, f):
+                pass
+
         self.proxy.set_addons(Stream())
         self.setup_connection()
 
@@ -421,6 +424,50 @@ class TestStreaming(_WebSocketTest):
             assert self.master.state.flows[1].messages == []  # Message not appended as the final frame isn't received
 
 
+class TestMessageRetention(_WebSocketTest):
+
+    @classmethod
+    def handle_websockets(cls, rfile, wfile):
+        for i in range(5):
+            wfile.write(bytes(websockets.Frame(fin=1, opcode=websockets.OPCODE.BINARY, payload=b'%d' % i * 10)))
+            wfile.flush()
+
+        frame = websockets.Frame.from_file(rfile)
+        wfile.write(bytes(websockets.Frame(fin=1, opcode=frame.header.opcode, payload=frame.payload)))
+        wfile.flush()
+
+    @pytest.mark.parametrize('limit, size_limit', [(2, None), (0, "25"), (3, "20")])
+    def test_retention(self, limit, size_limit):
+        seen = []
+
+        class Record:
+            def websocket_message(self, f):
+                seen.append(f.messages[-1].content)
+
+        self.proxy.set_addons(Record())
+        self.master.options.websocket_messages_limit = limit
+        self.master.options.websocket_messages_size_limit = size_limit
+        try:
+            self.setup_connection()
+
+            for i in range(5):
+                frame = websockets.Frame.from_file(self.client.rfile)
+                assert frame.payload == b'%d' % i * 10
+
+            self.client.wfile.write(bytes(websockets.Frame(fin=1, mask=1, opcode=websockets.OPCODE.BINARY, payload=b'x' * 10)))
+            self.client.wfile.flush()
+            frame = websockets.Frame.from_file(self.client.rfile)
+            assert frame.payload == b'x' * 10
+        finally:
+            self.master.options.websocket_messages_limit = 0
+            self.master.options.websocket_messages_size_limit = None
+
+        # addons get to see every message, but only the latest ones are kept.
+        assert len(seen) == 7
+        messages = self.master.state.flows[1].messages
+        assert [m.content for m in messages] == [b'x' * 10, b'x' * 10]
+
+
 class TestExtension(_WebSocketTest):
 
     @classmethod
@@ -26,3 +26,12 @@ class TestProxyConfig:
                                                           "mutually exclusive; please choose "
                                                           "one."):
             ProxyConfig(opts)
+
+    def test_dns_cache(self):
+        opts = options.Options()
+        config = ProxyConfig(opts)
+        assert config.resolver.ttl == opts.dns_cache_ttl
+        opts.update(dns_cache_ttl=0, dns_negative_cache_ttl=0)
+        assert not config.resolver.enabled
+        with pytest.raises(exceptions.OptionsError, match="must not be negative"):
+            opts.update(dns_cache_ttl=-1)
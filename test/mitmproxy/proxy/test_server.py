@@ -16,6 +16,7 @@ from mitmproxy.net import socks
 from mitmproxy.net import tcp
 from mitmproxy.net.http import http1
 from mitmproxy.proxy.config import HostMatcher
+from mitmproxy.proxy.protocol.rawtcp import RawTCPLayer
 from mitmproxy.utils import data
 from pathod import pathoc
 from pathod import pathod
@@ -121,6 +122,17 @@ class TcpMixin:
 
         self._ignore_off()
 
+    @pytest.mark.parametrize("use_splice", [True, False])
+    def test_ignore_large(self, use_splice):
+        with mock.patch("mitmproxy.proxy.protocol.rawtcp.RawTCPLayer.use_splice", use_splice and hasattr(os, "splice")):
+            self._ignore_on()
+            try:
+                i = self.pathod("200:b@1m")
+            finally:
+                self._ignore_off()
+        assert i.status_code == 200
+        assert len(i.content) == 1024 * 1024
+
     def test_allow(self):
         n = self.pathod("304")
         self._allow_on()
@@ -582,6 +594,39 @@ class TestTransparent(tservers.TransparentProxyTest, CommonMixin, TcpMixin):
         self._tcpproxy_off()
         assert d.content == b"bar"
 
+    @pytest.mark.parametrize("coalesce", [None, "1m"])
+    def test_tcp_messages(self, coalesce):
+        class Record:
+            def __init__(self):
+                self.sizes = []
+                self.retained = []
+
+            def tcp_message(self, f):
+                if not f.messages[-1].from_client:
+                    self.sizes.append(len(f.messages[-1].content))
+                self.retained.append(len(f.messages))
+
+        r = Record()
+        self.set_addons(r)
+        self.options.tcp_messages_limit = 1
+        self.options.tcp_coalesce_size = coalesce
+        self._tcpproxy_on()
+        try:
+            d = self.pathod("200:b@300k")
+        finally:
+            self._tcpproxy_off()
+            self.options.tcp_messages_limit = 0
+            self.options.tcp_coalesce_size = None
+
+        assert len(d.content) == 300 * 1024
+        assert sum(r.sizes) > 300 * 1024
+        # messages are trimmed after the event.
+        assert max(r.retained) == 2
+        if coalesce:
+            assert max(r.sizes) > RawTCPLayer.chunk_size
+        else:
+            assert max(r.sizes) <= RawTCPLayer.chunk_size
+
 
 class TestTransparentSSL(tservers.TransparentProxyTest, CommonMixin, TcpMixin):
     ssl = True
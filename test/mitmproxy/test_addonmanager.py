@@ -185,6 +185,10 @@ def test_nesting():
     assert a.get("three").running_called
     assert a.get("four").running_called
 
+    assert a.has_handler("running")
+    assert not a.has_handler("response")
+    assert not a.has_handler("request")
+
     a.remove(a.get("three"))
     assert not a.get("three")
     assert not a.get("four")
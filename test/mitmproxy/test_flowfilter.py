@@ -1,5 +1,6 @@
 import io
 import pytest
+import pyparsing as pp
 from unittest.mock import patch
 
 from mitmproxy.test import tflow
@@ -78,6 +79,40 @@ class TestParsing:
         assert isinstance(a, flowfilter.FHeadRequest)
         self._dump(a)
 
+    def test_cache(self):
+        assert flowfilter.parse("~q & ~s") is flowfilter.parse("~q & ~s")
+        assert flowfilter.parse("~q & ~s").pattern == "~q & ~s"
+
+
+def tree(t):
+    if isinstance(t, (flowfilter.FAnd, flowfilter.FOr)):
+        return (type(t), [tree(i) for i in t.lst])
+    if isinstance(t, flowfilter.FNot):
+        return (flowfilter.FNot, tree(t.itm))
+    return (type(t), getattr(t, "expr", None), getattr(t, "num", None))
+
+
+@pytest.fixture(scope="module")
+def bnf():
+    return flowfilter._make()
+
+
+@pytest.mark.parametrize("expr", [
+    "~q", "~b", "~c", "~c 10", "~c10", "~c 10abc", "~x", "~", "~q(", "(~q)", "(~q )",
+    "foo", "foo bar", "~q ~s | ~c 200", "(~q ~s)", "a&b", "a & b", "a& b", "a &b",
+    "~q &", "~q & & ~s", "~q |", "!", "~q !", "!!~q", "!(~q & ~s) | ~e",
+    "~h 'foo bar'", r'~h "a\"b"', r"~u 'a\nb'", r"~u 'a\\nb'", "~u '\tb'", "~u ''",
+    "~u 'unterminated", "~hé", "~h é", "~q\t~s", "~q\n|\n~s", "~http & ~tcp | ~websocket",
+    "~marked ~src 127 ~dst 1", "((~q))", "(~q", "~q)", "~h [", "~u 'x' & [",
+])
+def test_parser(bnf, expr):
+    try:
+        expected = tree(bnf.parseString(expr, parseAll=True)[0])
+    except (pp.ParseException, ValueError):
+        expected = None
+    flt = flowfilter.parse(expr)
+    assert (tree(flt) if flt else None) == expected
+
 
 class TestMatchingHTTPFlow:
 
@@ -589,3 +624,144 @@ def test_match():
 
     assert flowfilter.match(None, None)
     assert not flowfilter.match('foobar', None)
+
+
+def optimized(q, o):
+    flt = flowfilter.parse(q)
+    return flowfilter.optimize(flt)(o)
+
+
+class TestOptimizedHTTPFlow(TestMatchingHTTPFlow):
+    q = staticmethod(optimized)
+
+
+class TestOptimizedTCPFlow(TestMatchingTCPFlow):
+    q = staticmethod(optimized)
+
+
+class TestOptimizedWebSocketFlow(TestMatchingWebSocketFlow):
+    q = staticmethod(optimized)
+
+
+class TestOptimizedDummyFlow(TestMatchingDummyFlow):
+    q = staticmethod(optimized)
+
+
+class TestOptimize:
+
+    def test_pattern(self):
+        flt = flowfilter.optimize(flowfilter.parse("~q"))
+        assert flt.pattern == "~q"
+        assert flt(tflow.tflow())
+        assert not flt(tflow.tflow(resp=True))
+
+    def test_order(self):
+        f = tflow.tflow(resp=True)
+        with patch.object(flowfilter.FBod, "__call__") as bod:
+            flt = flowfilter.optimize(flowfilter.parse("~b foo & ~m POST"))
+            assert not flt(f)
+            assert not bod.called
+            f.request.method = "POST"
+            bod.return_value = True
+            assert flt(f)
+            assert bod.called
+
+    def test_flatten(self):
+        f = tflow.tflow(resp=True)
+        with patch.object(flowfilter.FHead, "__call__") as head:
+            flt = flowfilter.optimize(flowfilter.parse("~h foo | (~h bar | (~m GET | ~c 500))"))
+            assert flt(f)
+            assert not head.called
+
+    def test_content_cache(self):
+        f = tflow.tflow(resp=True)
+        f.response.encode("gzip")
+        with patch.object(f.response, "get_content", wraps=f.response.get_content) as get_content:
+            flt = flowfilter.optimize(flowfilter.parse("~bs foo | ~b message | ~bs bar"))
+            assert flt(f)
+            assert get_content.call_count == 1
+            assert flt(f)
+            assert get_content.call_count == 2
+        assert flowfilter._content_cache.get() is None
+
+    def test_known_types(self):
+        f = tflow.tflow(resp=True)
+        flt = flowfilter.optimize(flowfilter.parse("~http & ~s & ~c 200"))
+        assert flt(f)
+        assert not flt(tflow.tflow())
+        assert not flt(tflow.ttcpflow())
+
+
+registry = flowfilter.FilterRegistry()
+
+
+def registered(q, o):
+    return registry.parse(q)(o)
+
+
+class TestRegistryHTTPFlow(TestMatchingHTTPFlow):
+    q = staticmethod(registered)
+
+
+class TestRegistryTCPFlow(TestMatchingTCPFlow):
+    q = staticmethod(registered)
+
+
+class TestRegistryWebSocketFlow(TestMatchingWebSocketFlow):
+    q = staticmethod(registered)
+
+
+class TestRegistryDummyFlow(TestMatchingDummyFlow):
+    q = staticmethod(registered)
+
+
+class TestFilterRegistry:
+
+    def test_parse(self):
+        r = flowfilter.FilterRegistry()
+        assert r.parse("~h [") is None
+        flt = r.parse("~d address")
+        assert flt.pattern == "~d address"
+        assert flt(tflow.tflow())
+
+    def test_shared(self):
+        r = flowfilter.FilterRegistry()
+        a = r.parse("~d address & ~q")
+        b = r.parse("~s | ~d address")
+        f = tflow.tflow()
+        with patch.object(flowfilter.FDomain, "__call__", autospec=True, return_value=True) as domain:
+            assert a(f)
+            assert b(f)
+            assert a(f)
+            assert domain.call_count == 1
+            f.request.host = "example.com"
+            assert b(f)
+            assert domain.call_count == 2
+        assert r.parse("~d address")(tflow.tflow())
+        assert not r.parse("~d address")(tflow.ttcpflow())
+
+    def test_combined(self):
+        r = flowfilter.FilterRegistry()
+        foo = r.parse("~h foo")
+        bar = r.parse("~h bar & ~s")
+        f = tflow.tflow(resp=True)
+        with patch.object(flowfilter.FHead, "__call__", autospec=True, side_effect=flowfilter.FHead.__call__) as head:
+            assert not foo(f)
+            assert not bar(f)
+            assert head.call_count == 1
+            f.response.headers["bar"] = "1"
+            assert not foo(f)
+            assert bar(f)
+            assert head.call_count == 4
+
+    def test_combined_groups(self):
+        r = flowfilter.FilterRegistry()
+        flt = r.parse(r"~u '(x)\1' | ~u address")
+        assert r.groups[flowfilter.FUrl].combined is None
+        assert flt(tflow.tflow())
+        assert r.parse(r"~u xx")(tflow.tflow()) is False
+
+        r = flowfilter.FilterRegistry()
+        filters = [r.parse("~u foo"), r.parse("~u bar")]
+        assert r.groups[flowfilter.FUrl].combined.expr == "(?:bar)|(?:foo)"
+        assert not any(flt(tflow.tflow()) for flt in filters)
@@ -0,0 +1,64 @@
+import io
+import sys
+
+from mitmproxy.tools import workers
+
+
+def supervisor(script, count=2):
+    out = io.BytesIO()
+    s = workers.Supervisor(count, ["foo"], command=[sys.executable, "-c", script], output=out)
+    return s, out
+
+
+def test_supervisor():
+    s, out = supervisor(
+        "import os, sys; print(sys.argv[1], os.environ['MITMPROXY_WORKER']); print('done')"
+    )
+    s.start()
+    assert s.wait() == 0
+    lines = out.getvalue().splitlines()
+    assert sorted(lines) == [
+        b"[worker 0] done",
+        b"[worker 0] foo 0",
+        b"[worker 1] done",
+        b"[worker 1] foo 1",
+    ]
+    assert lines.index(b"[worker 0] foo 0") < lines.index(b"[worker 0] done")
+
+
+def test_supervisor_failure():
+    s, out = supervisor(
+        "import os, sys, time\n"
+        "if os.environ['MITMPROXY_WORKER'] == '1': sys.exit(3)\n"
+        "time.sleep(60)"
+    )
+    s.start()
+    assert s.wait() == 3
+    assert b"[worker 1] exited with code 3, stopping all workers." in out.getvalue()
+    assert s.procs[0].returncode != 0
+
+
+def test_supervisor_stop():
+    s, out = supervisor("import time; time.sleep(60)")
+    s.start()
+    s.stop()
+    assert s.wait() == 0
+    assert all(p.returncode != 0 for p in s.procs)
+    assert out.getvalue() == b""
+
+
+def test_supervisor_stats():
+    s, out = supervisor(
+        "import os\n"
+        "from mitmproxy.utils import workers\n"
+        "n = int(os.environ[workers.WORKER_ENV])\n"
+        "print('hello')\n"
+        "print(workers.format_stats({'http_flows': n + 1, 'errors': 1}))"
+    )
+    s.start()
+    assert s.wait() == 0
+    assert s.stats == {0: {"http_flows": 1, "errors": 1}, 1: {"http_flows": 2, "errors": 1}}
+    assert s.totals() == {"http_flows": 3, "errors": 2}
+    lines = out.getvalue().splitlines()
+    assert sorted(lines[:2]) == [b"[worker 0] hello", b"[worker 1] hello"]
+    assert lines[2:] == [b"[supervisor] totals: 2 errors, 3 http flows"]
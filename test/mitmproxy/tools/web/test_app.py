@@ -3,12 +3,14 @@ import logging
 from unittest import mock
 import os
 import asyncio
+from io import BytesIO
 
 import pytest
 import tornado.testing
 from tornado import httpclient
 from tornado import websocket
 
+from mitmproxy import io
 from mitmproxy import options
 from mitmproxy.test import tflow
 from mitmproxy.tools.web import app
@@ -30,6 +32,41 @@ def json(resp: httpclient.HTTPResponse):
     return _json.loads(resp.body.decode())
 
 
+def test_content_info():
+    f = tflow.tflow(resp=True)
+    length, h = app.content_info(f.request)
+    assert length == len(f.request.raw_content)
+    with mock.patch("hashlib.sha256") as m:
+        assert app.content_info(f.request) == (length, h)
+        assert not m.called
+    f.request.content = b"bar"
+    assert app.content_info(f.request) == (3, app.hashlib.sha256(b"bar").hexdigest())
+    f.request.content = b""
+    assert app.content_info(f.request) == (None, None)
+
+
+def test_json_diff():
+    old = {"id": "1", "request": {"method": "GET", "path": "/"}, "error": {"msg": "x"}}
+    new = {"id": "1", "request": {"method": "GET", "path": "/foo"}, "response": {"status_code": 200}}
+    assert app.json_diff(old, new) == {
+        "request": {"path": "/foo"},
+        "response": {"status_code": 200},
+        "error": None,
+    }
+    assert app.json_diff(new, new) == {}
+
+
+def test_parse_range():
+    assert app.parse_range("bytes=0-", 10) == (0, 10)
+    assert app.parse_range("bytes=2-100", 10) == (2, 10)
+    assert app.parse_range("bytes=-20", 10) == (0, 10)
+    assert app.parse_range("bytes=10-", 10) is None
+    assert app.parse_range("bytes=-0", 10) is None
+    for header in ["items=0-1", "bytes=5-2", "bytes=-", "bytes=a-b", "bytes=0-1,3-4", "bytes"]:
+        with pytest.raises(ValueError):
+            app.parse_range(header, 10)
+
+
 @pytest.mark.usefixtures("no_tornado_logging")
 class TestApp(tornado.testing.AsyncHTTPTestCase):
     def get_new_ioloop(self):
@@ -76,10 +113,81 @@ class TestApp(tornado.testing.AsyncHTTPTestCase):
         assert json(resp)[0]["request"]["contentHash"]
         assert json(resp)[1]["error"]
 
+    def test_flows_page(self):
+        ids = [f.id for f in self.view]
+        page = json(self.fetch("/flows?limit=1"))
+        assert [f["id"] for f in page["flows"]] == ids[:1]
+        assert page["total"] == 2
+        assert page["next"] == ids[0]
+        page = json(self.fetch("/flows?limit=1&after=" + page["next"]))
+        assert [f["id"] for f in page["flows"]] == ids[1:]
+        assert page["next"] is None
+
+        page = json(self.fetch("/flows?filter=~s"))
+        assert [f["id"] for f in page["flows"]] == ["42"]
+        assert page["total"] == 1
+        page = json(self.fetch("/flows?order=time&reversed=true"))
+        assert [f["id"] for f in page["flows"]] == ids[::-1]
+
+        assert self.fetch("/flows?order=foo").code == 400
+        assert self.fetch("/flows?filter=~~").code == 400
+        assert self.fetch("/flows?limit=0").code == 400
+        assert self.fetch("/flows?after=foo").code == 400
+        assert self.fetch("/flows?filter=~s&after=" + ids[1]).code == 400
+
     def test_flows_dump(self):
         resp = self.fetch("/flows/dump")
         assert b"address" in resp.body
 
+    def test_flows_dump_chunked(self):
+        full = self.fetch("/flows/dump").body
+        with mock.patch.object(app.DumpFlows, "chunk_size", 1):
+            resp = self.fetch("/flows/dump")
+        assert resp.body == full
+        flows = list(io.FlowReader(BytesIO(resp.body)).stream())
+        assert [f.id for f in flows] == [f.id for f in self.view]
+
+    def test_flows_upload(self):
+        dump = self.fetch("/flows/dump").body
+        ids = [f.id for f in self.view]
+        assert self.fetch("/flows/dump", method="POST", body=dump).code == 200
+        assert [f.id for f in self.view] == ids
+
+        self.view.clear()
+        boundary = "foo"
+        body = b"".join([
+            b"--foo\r\n",
+            b'Content-Disposition: form-data; name="file"; filename="flows"\r\n',
+            b"Content-Type: application/octet-stream\r\n\r\n",
+            dump,
+            b"\r\n--foo--\r\n",
+        ])
+        resp = self.fetch(
+            "/flows/dump",
+            method="POST",
+            body=body,
+            headers={"Content-Type": "multipart/form-data; boundary=" + boundary},
+        )
+        assert resp.code == 200
+        assert [f.id for f in self.view] == ids
+
+        assert self.fetch("/flows/dump", method="POST", body=dump[:-1]).code == 400
+        assert len(self.view) == 1
+        assert self.fetch("/flows/dump", method="POST", body=b"foo").code == 400
+        assert not len(self.view)
+
+    def test_flows_upload_streamed(self):
+        dump = self.fetch("/flows/dump").body
+        ids = [f.id for f in self.view]
+
+        def body_producer(write):
+            for i in range(0, len(dump), 7):
+                write(dump[i:i + 7])
+
+        resp = self.fetch("/flows/dump", method="POST", body_producer=body_producer)
+        assert resp.code == 200
+        assert [f.id for f in self.view] == ids
+
     def test_clear(self):
         events = self.events.data.copy()
         flows = list(self.view)
@@ -211,6 +319,28 @@ class TestApp(tornado.testing.AsyncHTTPTestCase):
 
         f.revert()
 
+    def test_flow_content_range(self):
+        f = self.view.get_by_id("42")
+        f.response.content = b"0123456789"
+
+        r = self.fetch("/flows/42/response/content.data", headers={"Range": "bytes=2-4"})
+        assert r.code == 206
+        assert r.body == b"234"
+        assert r.headers["Content-Range"] == "bytes 2-4/10"
+        r = self.fetch("/flows/42/response/content.data", headers={"Range": "bytes=-3"})
+        assert r.body == b"789"
+        r = self.fetch("/flows/42/response/content.data", headers={"Range": "bytes=20-"})
+        assert r.code == 416
+        assert r.headers["Content-Range"] == "bytes */10"
+        r = self.fetch("/flows/42/response/content.data", headers={"Range": "bytes=1-2,4-5"})
+        assert r.code == 200
+        assert r.body == b"0123456789"
+
+        with mock.patch.object(app.FlowContent, "chunk_size", 3):
+            r = self.fetch("/flows/42/response/content.data", headers={"Range": "bytes=1-"})
+        assert r.body == b"123456789"
+        assert r.headers["Accept-Ranges"] == "bytes"
+
     def test_update_flow_content(self):
         assert self.fetch(
             "/flows/42/request/content.data",
@@ -249,6 +379,67 @@ class TestApp(tornado.testing.AsyncHTTPTestCase):
             "description": "Raw"
         }
 
+    def test_flow_content_view_paged(self):
+        f = self.view.get_by_id("42")
+        f.request.content = b"\n".join(b"line %d" % i for i in range(5))
+        url = "/flows/42/request/content/raw?lines=2"
+
+        page = json(self.fetch(url))
+        assert page["lines"] == [[["text", "line 0"]], [["text", "line 1"]]]
+        assert page["next"] == "2"
+        assert page["description"] == "Raw"
+        cursors = self._app.content_view_cursors
+        assert len(cursors) == 1
+        page = json(self.fetch(url + "&continue=" + page["next"]))
+        assert page["lines"] == [[["text", "line 2"]], [["text", "line 3"]]]
+        page = json(self.fetch(url + "&continue=" + page["next"]))
+        assert page["lines"] == [[["text", "line 4"]]]
+        assert page["next"] is None
+
+        cursors.clear()
+        page = json(self.fetch(url + "&continue=3"))
+        assert page["lines"] == [[["text", "line 3"]], [["text", "line 4"]]]
+        assert self.fetch(url + "&continue=-1").code == 400
+        assert self.fetch("/flows/42/request/content/raw?lines=0").code == 400
+
+        # cursors go away with their flow.
+        self.fetch(url)
+        assert len(cursors) == 1
+        self.view.remove([f])
+        assert len(cursors) == 0
+        assert cursors.size == 0
+
+    def test_content_view_cursors(self):
+        cursors = app.ContentViewCursors()
+        cursors.max_bytes = 10
+        cursors.add(("a", "request", "raw", 2), (b"x" * 4, "Raw", iter([])))
+        cursors.add(("a", "response", "raw", 2), (b"x" * 4, "Raw", iter([])))
+        cursors.add(("b", "request", "raw", 2), (None, "Raw", iter([])))
+        assert len(cursors) == 3
+        assert cursors.size == 8
+        # too large to keep at all.
+        cursors.add(("c", "request", "raw", 2), (b"x" * 11, "Raw", iter([])))
+        assert len(cursors) == 3
+        # the least recently used cursors make room.
+        cursors.add(("c", "request", "raw", 2), (b"x" * 6, "Raw", iter([])))
+        assert list(cursors.cursors) == [
+            ("a", "response", "raw", 2), ("b", "request", "raw", 2), ("c", "request", "raw", 2)
+        ]
+        assert cursors.size == 10
+        assert cursors.pop(("c", "request", "raw", 2))[0] == b"x" * 6
+        assert cursors.pop(("c", "request", "raw", 2)) is None
+        assert set(cursors.flows) == {"a", "b"}
+        cursors.remove_flow("a")
+        cursors.remove_flow("b")
+        cursors.remove_flow("d")
+        assert cursors.size == 0
+        assert not cursors.cursors and not cursors.flows
+
+        cursors = self._app.content_view_cursors
+        cursors.add(("42", "request", "raw", 2), (b"x", "Raw", iter([])))
+        self.view.clear()
+        assert len(cursors) == 0
+
     def test_events(self):
         resp = self.fetch("/events")
         assert resp.code == 200
@@ -256,6 +447,7 @@ class TestApp(tornado.testing.AsyncHTTPTestCase):
 
     def test_settings(self):
         assert json(self.fetch("/settings"))["mode"] == "regular"
+        assert json(self.fetch("/settings"))["readfile_progress"] is None
 
     def test_settings_update(self):
         assert self.put_json("/settings", {"anticache": True}).code == 200
@@ -317,6 +509,57 @@ class TestApp(tornado.testing.AsyncHTTPTestCase):
         ws_client2 = yield websocket.websocket_connect(ws_url)
         ws_client2.close()
 
+    @tornado.testing.gen_test
+    def test_websocket_subscribe(self):
+        ws_url = "ws://localhost:{}/updates".format(self.get_http_port())
+        ws_client = yield websocket.websocket_connect(ws_url)
+        ws_client.write_message(_json.dumps({"resource": "flows", "cmd": "subscribe", "ids": ["42"]}))
+        ws_client.write_message("invalid")
+        yield asyncio.sleep(0.1)
+
+        app.ClientConnection.broadcast(resource="flows", cmd="update", data={"id": "other"})
+        app.ClientConnection.broadcast(resource="flows", cmd="update", data={"id": "42"})
+        msg = _json.loads((yield ws_client.read_message()))
+        assert msg["data"] == {"id": "42"}
+
+        ws_client.write_message(_json.dumps({"resource": "flows", "cmd": "subscribe", "ids": None}))
+        yield asyncio.sleep(0.1)
+        app.ClientConnection.broadcast(resource="flows", cmd="update", data={"id": "other"})
+        msg = _json.loads((yield ws_client.read_message()))
+        assert msg["data"] == {"id": "other"}
+        ws_client.close()
+
+    @tornado.testing.gen_test
+    def test_websocket_diffs(self):
+        ws_url = "ws://localhost:{}/updates".format(self.get_http_port())
+        ws_client = yield websocket.websocket_connect(ws_url + "?diffs=1")
+        ws_client2 = yield websocket.websocket_connect(ws_url)
+        yield asyncio.sleep(0.1)
+
+        app.ClientConnection.broadcast_flow("add", {"id": "42", "marked": False, "x": 1})
+        app.ClientConnection.broadcast_flow("update", {"id": "42", "marked": True, "x": 1})
+        msg = _json.loads((yield ws_client.read_message()))
+        assert msg["data"] == {"id": "42", "marked": False, "x": 1}
+        msg = _json.loads((yield ws_client.read_message()))
+        assert msg == {"resource": "flows", "cmd": "update", "data": {"id": "42", "marked": True}}
+        yield ws_client2.read_message()
+        msg = _json.loads((yield ws_client2.read_message()))
+        assert msg["data"] == {"id": "42", "marked": True, "x": 1}
+
+        # updates for flows outside of the window are dropped, so the next one is complete.
+        ws_client.write_message(_json.dumps({"resource": "flows", "cmd": "subscribe", "ids": []}))
+        yield asyncio.sleep(0.1)
+        app.ClientConnection.broadcast_flow("update", {"id": "42", "marked": False, "x": 1})
+        ws_client.write_message(_json.dumps({"resource": "flows", "cmd": "subscribe", "ids": None}))
+        yield asyncio.sleep(0.1)
+        app.ClientConnection.broadcast_flow("update", {"id": "42", "marked": False, "x": 2})
+        msg = _json.loads((yield ws_client.read_message()))
+        assert msg["data"] == {"id": "42", "marked": False, "x": 2}
+
+        app.ClientConnection.forget()
+        ws_client.close()
+        ws_client2.close()
+
     def _test_generate_tflow_js(self):
         _tflow = app.flow_to_json(tflow.tflow(resp=True, err=True))
         # Set some value as constant, so that _tflow.js would not change every time.
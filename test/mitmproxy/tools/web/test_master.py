@@ -1,3 +1,9 @@
+import asyncio
+import json
+from unittest import mock
+
+from mitmproxy.test import tflow
+from mitmproxy.tools.web import app
 from mitmproxy.tools.web import master
 from mitmproxy import options
 
@@ -6,6 +12,19 @@ import pytest
 from ... import tservers
 
 
+class FakeConnection:
+    def __init__(self, diffs):
+        self.diffs = diffs
+        self.sent = {}
+        self.messages = []
+
+    def wants(self, resource, cmd, data=None):
+        return True
+
+    def write_message(self, message):
+        self.messages.append(json.loads(message))
+
+
 class TestWebMaster(tservers.MasterTest):
     def mkmaster(self, **opts):
         o = options.Options(**opts)
@@ -17,3 +36,63 @@ class TestWebMaster(tservers.MasterTest):
         for i in (1, 2, 3):
             await self.dummy_cycle(m, 1, b"")
             assert len(m.view) == i
+
+    @pytest.mark.asyncio
+    async def test_flow_updates(self):
+        m = self.mkmaster()
+        f = tflow.tflow()
+        diffs, full = FakeConnection(diffs=True), FakeConnection(diffs=False)
+        with mock.patch.object(app.ClientConnection, "connections", {diffs, full}):
+            m.view.add([f])
+            assert diffs.messages[-1]["cmd"] == "add"
+            assert full.messages[-1]["cmd"] == "add"
+
+            f.marked = True
+            m.view.update([f])
+            f.request.path = "/foo"
+            m.view.update([f])
+            m.view.update([f])
+            assert len(diffs.messages) == 1
+            await asyncio.sleep(m.update_interval * 2)
+            assert diffs.messages[-1] == dict(
+                resource="flows",
+                cmd="update",
+                data={"id": f.id, "marked": True, "request": {"path": "/foo"}},
+            )
+            assert full.messages[-1]["data"] == json.loads(json.dumps(app.flow_to_json(f)))
+
+            # unchanged flows are only sent to clients without diffs.
+            m.view.update([f])
+            await asyncio.sleep(m.update_interval * 2)
+            assert len(diffs.messages) == 2
+            assert len(full.messages) == 3
+
+            # new clients start with the whole flow.
+            late = FakeConnection(diffs=True)
+            app.ClientConnection.connections.add(late)
+            f.marked = False
+            m.view.update([f])
+            await asyncio.sleep(m.update_interval * 2)
+            assert diffs.messages[-1]["data"] == {"id": f.id, "marked": False}
+            assert late.messages[-1]["data"] == json.loads(json.dumps(app.flow_to_json(f)))
+
+            m.view.update([f])
+            m.view.remove([f])
+            await asyncio.sleep(m.update_interval * 2)
+            assert diffs.messages[-1]["cmd"] == "remove"
+            assert not diffs.sent
+
+            m.view.add([f])
+            m.view.clear()
+            assert diffs.messages[-1]["cmd"] == "reset"
+            assert not diffs.sent
+
+    def test_readfile_progress(self):
+        m = self.mkmaster()
+        with mock.patch.object(app.ClientConnection, "broadcast") as broadcast:
+            m.readfile.sig_progress.send(m.readfile, progress=42)
+            assert broadcast.call_args[1] == dict(
+                resource="settings",
+                cmd="update",
+                data={"readfile_progress": 42},
+            )
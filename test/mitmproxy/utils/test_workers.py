@@ -0,0 +1,23 @@
+from mitmproxy.utils import workers
+
+
+def test_worker_id(monkeypatch):
+    monkeypatch.delenv(workers.WORKER_ENV, raising=False)
+    assert workers.worker_id() is None
+    monkeypatch.setenv(workers.WORKER_ENV, "0")
+    assert workers.worker_id() == 0
+
+
+def test_shard_path():
+    assert workers.shard_path("flows", 2) == "flows.2"
+    assert workers.shard_path("+~/flows", 0) == "+~/flows.0"
+
+
+def test_stats():
+    line = workers.format_stats({"errors": 2, "http_flows": 3})
+    assert workers.parse_stats(line) == {"errors": 2, "http_flows": 3}
+    assert workers.parse_stats(line + "\n") == {"errors": 2, "http_flows": 3}
+    assert workers.parse_stats("errors: 2") is None
+    assert workers.parse_stats(workers.STATS_PREFIX + "{") is None
+    assert workers.parse_stats(workers.STATS_PREFIX + "[1]") is None
+    assert workers.parse_stats(workers.STATS_PREFIX + '{"a": 1, "b": "x"}') == {"a": 1}
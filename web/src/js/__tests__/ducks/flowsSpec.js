@@ -173,10 +173,12 @@ describe('flows actions', () => {
     })
 
     it('should handle upload action', () => {
-        let body = new FormData()
-        body.append('file', 'foo')
         store.dispatch(flowActions.upload('foo'))
-        expect(fetchApi).toBeCalledWith('/flows/dump', { method: 'POST', body })
+        expect(fetchApi).toBeCalledWith('/flows/dump', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: 'foo',
+        })
     })
 })
 
@@ -224,3 +226,27 @@ describe('makeSort', () => {
         expect(sort(a, b)).toEqual(-1)
     })
 })
+
+describe('applyDiff', () => {
+    it('should merge nested changes', () => {
+        let flow = { id: 1, request: { method: 'GET', headers: [['a', 'b']] }, error: { msg: 'x' } },
+            diff = { id: 1, request: { headers: [['c', 'd']] }, response: { status_code: 200 }, error: null }
+        expect(flowActions.applyDiff(flow, diff)).toEqual({
+            id: 1,
+            request: { method: 'GET', headers: [['c', 'd']] },
+            response: { status_code: 200 },
+            error: null,
+        })
+        expect(flow.request.headers).toEqual([['a', 'b']])
+    })
+
+    it('should use the diff for unknown flows', () => {
+        expect(flowActions.applyDiff(undefined, { id: 1 })).toEqual({ id: 1 })
+    })
+
+    it('should be applied on update', () => {
+        let state = reduceFlows(undefined, { type: flowActions.ADD, data: { id: 1, marked: false, request: { method: 'GET' } }, cmd: 'add' })
+        state = reduceFlows(state, { type: flowActions.UPDATE, data: { id: 1, marked: true }, cmd: 'update' })
+        expect(state.byId[1]).toEqual({ id: 1, marked: true, request: { method: 'GET' } })
+    })
+})
@@ -16,7 +16,8 @@ export default class WebsocketBackend {
     }
 
     connect() {
-        this.socket = new WebSocket(location.origin.replace('http', 'ws') + '/updates')
+        // We merge partial flow updates, so the server only needs to send what has changed.
+        this.socket = new WebSocket(location.origin.replace('http', 'ws') + '/updates?diffs=1')
         this.socket.addEventListener('open', () => this.onOpen())
         this.socket.addEventListener('close', event => this.onClose(event))
         this.socket.addEventListener('message', msg => this.onMessage(JSON.parse(msg.data)))
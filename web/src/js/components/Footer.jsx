@@ -10,7 +10,7 @@ Footer.propTypes = {
 
 function Footer({ settings }) {
     let {mode, intercept, showhost, no_upstream_cert, rawtcp, http2, websocket, anticache, anticomp,
-            stickyauth, stickycookie, stream_large_bodies, listen_host, listen_port, version, server} = settings;
+            stickyauth, stickycookie, stream_large_bodies, listen_host, listen_port, version, server, readfile_progress} = settings;
     return (
         <footer>
             {mode && mode != "regular" && (
@@ -49,6 +49,9 @@ function Footer({ settings }) {
             {stream_large_bodies && (
                 <span className="label label-success">stream: {formatSize(stream_large_bodies)}</span>
             )}
+            {readfile_progress != null && (
+                <span className="label label-warning">Loading flows: {readfile_progress}%</span>
+            )}
             <div className="pull-right">
                 <HideInStatic>
                 {
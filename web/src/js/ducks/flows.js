@@ -30,8 +30,13 @@ export default function reduce(state = defaultState, action) {
         case UPDATE:
         case REMOVE:
         case RECEIVE:
+            let data = action.data
+            if (action.type === UPDATE) {
+                // The server only sends the parts of a flow that have changed.
+                data = applyDiff(state.byId[data.id], data)
+            }
             let storeAction = storeActions[action.cmd](
-                action.data,
+                data,
                 makeFilter(state.filter),
                 makeSort(state.sort)
             )
@@ -114,6 +119,25 @@ const sortKeyFuns = {
     },
 }
 
+function isObject(value) {
+    return value !== null && typeof value === 'object' && !Array.isArray(value)
+}
+
+export function applyDiff(item, diff) {
+    if (!item) {
+        return diff
+    }
+    let result = { ...item }
+    for (let key of Object.keys(diff)) {
+        if (isObject(diff[key]) && isObject(item[key])) {
+            result[key] = applyDiff(item[key], diff[key])
+        } else {
+            result[key] = diff[key]
+        }
+    }
+    return result
+}
+
 export function makeFilter(filter) {
     if (!filter) {
         return
@@ -223,9 +247,12 @@ export function download() {
 }
 
 export function upload(file) {
-    const body = new FormData()
-    body.append('file', file)
-    return dispatch => fetchApi('/flows/dump', { method: 'POST', body })
+    // Send the file as the request body, so that the server can stream it.
+    return dispatch => fetchApi('/flows/dump', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/octet-stream' },
+        body: file,
+    })
 }
 
 